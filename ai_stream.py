@@ -0,0 +1,154 @@
+"""
+Потоковое получение AI анализа с инкрементальным форматированием для Slack
+"""
+
+import inspect
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Замены markdown → Slack mrkdwn, которые применяет format_summary
+SUMMARY_REPLACEMENTS = (
+    ("#### ", ""),
+    ("### ", ""),
+    ("**", "*")
+)
+
+
+def apply_summary_transforms(text: str) -> str:
+    """Применяет замены форматирования к готовому фрагменту текста"""
+    for old, new in SUMMARY_REPLACEMENTS:
+        text = text.replace(old, new)
+    return text
+
+
+def format_summary(summary):
+    """Улучшает форматирование итогового резюме"""
+    if not summary or len(summary.strip()) < 10:
+        return "📝 _Резюме недоступно_"
+    
+    formatted = summary.strip()
+    
+    # Улучшаем форматирование
+    formatted = apply_summary_transforms(formatted)
+    
+    return formatted
+
+
+class StreamingSummaryFormatter:
+    """Форматирует поток токенов по мере поступления.
+
+    Замены не пересекают границы строк, поэтому завершенные строки
+    форматируются один раз, а заново обрабатывается только хвост.
+    """
+
+    def __init__(self):
+        self._done_raw_length = 0
+        self._done_formatted = ""
+        self._raw = ""
+
+    def feed(self, delta: str) -> str:
+        self._raw += delta
+        last_newline = self._raw.rfind("\n", self._done_raw_length)
+        if last_newline >= 0:
+            self._done_formatted += apply_summary_transforms(self._raw[self._done_raw_length:last_newline + 1])
+            self._done_raw_length = last_newline + 1
+        return self.text
+
+    @property
+    def raw(self) -> str:
+        return self._raw
+
+    @property
+    def text(self) -> str:
+        return (self._done_formatted + apply_summary_transforms(self._raw[self._done_raw_length:])).strip()
+
+
+class StreamTimings:
+    """Время до первого токена и полное время генерации"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.completions = 0
+        self.last: Dict[str, float] = {}
+        self._ttft_total = 0.0
+        self._total_total = 0.0
+
+    def record(self, ttft: Optional[float], total: float):
+        with self._lock:
+            self.completions += 1
+            self.last = {"ttft": round(ttft or total, 3), "total": round(total, 3)}
+            self._ttft_total += ttft or total
+            self._total_total += total
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            count = self.completions
+            return {
+                "completions": count,
+                "last": dict(self.last),
+                "ttft_avg": round(self._ttft_total / count, 3) if count else 0.0,
+                "total_avg": round(self._total_total / count, 3) if count else 0.0
+            }
+
+
+stream_timings = StreamTimings()
+
+
+def stream_completion(
+    client: Any,
+    on_text: Callable[[str], None],
+    **request: Any
+) -> Tuple[str, Dict[str, float]]:
+    """Запрашивает completion потоком и передает отформатированный текст в on_text.
+
+    Возвращает сырой текст ответа и тайминги (ttft, total) в секундах.
+    """
+    started = time.monotonic()
+    first_token_at = None
+    formatter = StreamingSummaryFormatter()
+
+    stream = client.chat.completions.create(stream=True, **request)
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if first_token_at is None:
+            first_token_at = time.monotonic()
+        on_text(formatter.feed(delta))
+
+    total = time.monotonic() - started
+    ttft = first_token_at - started if first_token_at is not None else None
+    stream_timings.record(ttft, total)
+    return formatter.raw.strip(), {"ttft": ttft if ttft is not None else total, "total": total}
+
+
+async def stream_completion_async(
+    client: Any,
+    on_text: Callable[[str], Any],
+    **request: Any
+) -> Tuple[str, Dict[str, float]]:
+    """Асинхронный вариант stream_completion для AsyncOpenAI; on_text может быть корутинной функцией"""
+    started = time.monotonic()
+    first_token_at = None
+    formatter = StreamingSummaryFormatter()
+
+    stream = await client.chat.completions.create(stream=True, **request)
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if first_token_at is None:
+            first_token_at = time.monotonic()
+        update = on_text(formatter.feed(delta))
+        if inspect.isawaitable(update):
+            await update
+
+    total = time.monotonic() - started
+    ttft = first_token_at - started if first_token_at is not None else None
+    stream_timings.record(ttft, total)
+    return formatter.raw.strip(), {"ttft": ttft if ttft is not None else total, "total": total}
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарки горячих путей бота на записанных фикстурах, без доступа к Slack, OpenAI и Globalping.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run_benchmarks                  # сравнить с baseline.json
+    python -m benchmarks.run_benchmarks --update         # перезаписать baseline.json
+    python -m benchmarks.run_benchmarks -k globalping    # только бенчмарки с подстрокой в имени
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, "fixtures")
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from ai_stream import format_summary
+from globalping_models import parse_measurement, render_slack
+from prompt_builder import build_analysis_prompt, build_compact_results, compact_results
+from target_extraction import extract_targets
+
+GLOBALPING_TESTS = ("ping", "http", "dns", "traceroute", "mtr")
+
+# Допустимое замедление относительно baseline: запас на шум общих CI машин и ноутбуков
+DEFAULT_TOLERANCE = 2.0
+
+
+def load_fixture(name: str) -> Any:
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as file:
+        return json.load(file) if name.endswith(".json") else file.read()
+
+
+def _globalping_results() -> Dict[str, Dict[str, Any]]:
+    return {test_type: load_fixture(f"globalping_{test_type}.json") for test_type in GLOBALPING_TESTS}
+
+
+def _all_results_text(raw: Dict[str, Dict[str, Any]]) -> Tuple[str, Dict[str, Any]]:
+    """Текст результатов, как он уходит в AI анализ, и типизированные записи к нему"""
+    measurements = {test_type: parse_measurement(data, test_type, "example.com") for test_type, data in raw.items()}
+    texts = [render_slack(measurement) for measurement in measurements.values()]
+    return "\n".join(texts + [load_fixture("local_results.txt")]), measurements
+
+
+def build_benchmarks() -> List[Tuple[str, Callable[[], Any]]]:
+    """Список (имя, функция без аргументов); фикстуры загружаются один раз заранее"""
+    raw = _globalping_results()
+    all_results, measurements = _all_results_text(raw)
+    event = load_fixture("slack_event_large.json")
+    small_event = {"text": "google.com не работает, проверьте https://github.com и 8.8.8.8"}
+    summary = load_fixture("ai_summary.md")
+
+    benchmarks: List[Tuple[str, Callable[[], Any]]] = [
+        ("extract_targets.small_message", lambda: extract_targets(small_event)),
+        ("extract_targets.large_event", lambda: extract_targets(event)),
+    ]
+    for test_type in GLOBALPING_TESTS:
+        data = raw[test_type]
+        benchmarks.append((f"globalping.parse.{test_type}", lambda data=data, test_type=test_type: parse_measurement(data, test_type, "example.com")))
+        measurement = measurements[test_type]
+        benchmarks.append((f"globalping.render_slack.{test_type}", lambda measurement=measurement: render_slack(measurement)))
+    benchmarks += [
+        ("format_summary", lambda: format_summary(summary)),
+        ("prompt.compact_from_text", lambda: compact_results(all_results)),
+        ("prompt.compact_from_measurements", lambda: compact_results(all_results, measurements=measurements)),
+        ("prompt.build_analysis_prompt", lambda: build_analysis_prompt(
+            "example.com", build_compact_results(all_results, 1500, measurements=measurements)[0]
+        )),
+    ]
+    return benchmarks
+
+
+def measure(func: Callable[[], Any], min_time: float = 0.2, repeat: int = 7) -> float:
+    """Лучшее время одного вызова в микросекундах.
+
+    Число вызовов в серии подбирается так, чтобы серия длилась не меньше min_time.
+    """
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - started) / loops)
+    return best * 1e6
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[Dict[str, Any]]:
+    """Сравнивает замеры с baseline; regression - замедление больше tolerance раз"""
+    rows = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        ratio = current / base if base else None
+        rows.append({
+            "name": name,
+            "current_us": current,
+            "baseline_us": base,
+            "ratio": ratio,
+            "regression": ratio is not None and ratio > tolerance
+        })
+    return rows
+
+
+def load_baseline(path: str = BASELINE_PATH) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {"benchmarks": {}}
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_baseline(results: Dict[str, float], path: str = BASELINE_PATH):
+    baseline = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "benchmarks": {name: round(value, 3) for name, value in sorted(results.items())}
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(baseline, file, ensure_ascii=False, indent=2)
+        file.write("\n")
+
+
+def run(filter_text: Optional[str] = None, min_time: float = 0.2, repeat: int = 7) -> Dict[str, float]:
+    results = {}
+    for name, func in build_benchmarks():
+        if filter_text and filter_text not in name:
+            continue
+        results[name] = measure(func, min_time=min_time, repeat=repeat)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих путей Slack AI бота")
+    parser.add_argument("-k", dest="filter", help="запускать только бенчмарки с подстрокой в имени")
+    parser.add_argument("--update", action="store_true", help="записать результаты в baseline.json")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="допустимое замедление, раз")
+    parser.add_argument("--min-time", type=float, default=0.2, help="минимальная длительность серии, сек")
+    parser.add_argument("--repeat", type=int, default=7, help="число серий")
+    args = parser.parse_args(argv)
+
+    results = run(args.filter, args.min_time, args.repeat)
+    if args.update:
+        # При частичном запуске остальные значения baseline сохраняются
+        merged = {**load_baseline()["benchmarks"], **results}
+        save_baseline(merged)
+        print(f"💾 Baseline обновлен: {len(results)} бенчмарков → {BASELINE_PATH}")
+        return 0
+
+    rows = compare(results, load_baseline()["benchmarks"], args.tolerance)
+    print(f"{'бенчмарк':<40} {'сейчас, мкс':>12} {'baseline':>12} {'x':>6}")
+    for row in rows:
+        baseline = f"{row['baseline_us']:.1f}" if row["baseline_us"] else "—"
+        ratio = f"{row['ratio']:.2f}" if row["ratio"] else "—"
+        mark = " ❌ регрессия" if row["regression"] else ""
+        print(f"{row['name']:<40} {row['current_us']:>12.1f} {baseline:>12} {ratio:>6}{mark}")
+
+    regressions = [row["name"] for row in rows if row["regression"]]
+    if regressions:
+        print(f"❌ Регрессии (медленнее baseline более чем в {args.tolerance} раза): {', '.join(regressions)}")
+        return 1
+    print("✅ Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""
+Аренды событий Slack между экземплярами бота: одно событие диагностируется одним узлом
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+class LeaseStore(ABC):
+    """Хранилище аренд, общее для всех узлов.
+
+    acquire захватывает все ключи сразу или ни одного; занятый ключ не выдается
+    повторно даже своему владельцу, пока аренда не истекла. Время - time.time(),
+    общее для узлов разных хостов. Общее хранилище (Redis, etcd, БД) реализует
+    те же четыре метода, например через SET NX PX и проверку владельца в скрипте.
+    """
+
+    @abstractmethod
+    def acquire(self, keys: Sequence[str], owner: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def renew(self, keys: Sequence[str], owner: str, ttl: float) -> bool:
+        """Продлевает аренду владельца; False, если хотя бы один ключ уже не его"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def release(self, keys: Sequence[str], owner: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def purge(self) -> int:
+        """Удаляет истекшие аренды и возвращает их число"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryLeaseStore(LeaseStore):
+    """Аренды в памяти процесса: дедупликация повторных доставок без кластера и для тестов"""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._leases: Dict[str, Any] = {}
+
+    def _held(self, key: str, now: float) -> Optional[str]:
+        lease = self._leases.get(key)
+        return lease[0] if lease is not None and lease[1] > now else None
+
+    def acquire(self, keys: Sequence[str], owner: str, ttl: float) -> bool:
+        with self._lock:
+            now = self._clock()
+            if any(self._held(key, now) is not None for key in keys):
+                return False
+            for key in keys:
+                self._leases[key] = (owner, now + ttl)
+            return True
+
+    def renew(self, keys: Sequence[str], owner: str, ttl: float) -> bool:
+        with self._lock:
+            now = self._clock()
+            if any(self._held(key, now) != owner for key in keys):
+                return False
+            for key in keys:
+                self._leases[key] = (owner, now + ttl)
+            return True
+
+    def release(self, keys: Sequence[str], owner: str):
+        with self._lock:
+            for key in keys:
+                if key in self._leases and self._leases[key][0] == owner:
+                    del self._leases[key]
+
+    def purge(self) -> int:
+        with self._lock:
+            now = self._clock()
+            expired = [key for key, (_, expires_at) in self._leases.items() if expires_at <= now]
+            for key in expired:
+                del self._leases[key]
+            return len(expired)
+
+
+class SQLiteLeaseStore(LeaseStore):
+    """Аренды в файле SQLite: для нескольких процессов бота на одном хосте"""
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time, busy_timeout: float = 10.0):
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Транзакции открываются явно: BEGIN IMMEDIATE блокирует запись для других процессов
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS leases (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_leases_expires ON leases(expires_at)")
+
+    def _transaction(self, body: Callable[[float], Any]) -> Any:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = body(self._clock())
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _owners(self, keys: Sequence[str], now: float) -> List[Optional[str]]:
+        owners = []
+        for key in keys:
+            row = self._conn.execute("SELECT owner FROM leases WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            owners.append(row[0] if row else None)
+        return owners
+
+    def _write(self, keys: Sequence[str], owner: str, expires_at: float):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+            [(key, owner, expires_at) for key in keys]
+        )
+
+    def acquire(self, keys: Sequence[str], owner: str, ttl: float) -> bool:
+        def body(now):
+            if any(holder is not None for holder in self._owners(keys, now)):
+                return False
+            self._write(keys, owner, now + ttl)
+            return True
+        return self._transaction(body)
+
+    def renew(self, keys: Sequence[str], owner: str, ttl: float) -> bool:
+        def body(now):
+            if any(holder != owner for holder in self._owners(keys, now)):
+                return False
+            self._write(keys, owner, now + ttl)
+            return True
+        return self._transaction(body)
+
+    def release(self, keys: Sequence[str], owner: str):
+        self._transaction(lambda now: self._conn.executemany(
+            "DELETE FROM leases WHERE key = ? AND owner = ?", [(key, owner) for key in keys]
+        ))
+
+    def purge(self) -> int:
+        return self._transaction(lambda now: self._conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,)).rowcount)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_lease_store(url: str) -> LeaseStore:
+    """Хранилище по адресу: memory:// или sqlite:///путь (путь без схемы - тоже SQLite)"""
+    if url == "memory://":
+        return MemoryLeaseStore()
+    if url.startswith("sqlite://"):
+        return SQLiteLeaseStore(url[len("sqlite://"):])
+    if "://" in url:
+        raise ValueError(f"Неизвестное хранилище аренд: {url}")
+    return SQLiteLeaseStore(url)
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def event_keys(event: Dict[str, Any], event_id: Optional[str] = None) -> List[str]:
+    """Ключи аренды события: id доставки и (канал, ts) сообщения.
+
+    Повторная доставка Slack приходит с тем же event_id, а одно сообщение
+    может прийти разными событиями - с одинаковыми каналом и ts.
+    """
+    keys = [f"message:{event.get('channel', '')}:{event.get('ts', '')}"]
+    if event_id:
+        keys.append(f"event:{event_id}")
+    return sorted(keys)
+
+
+class Lease:
+    """Захваченное событие: продлевается узлом, пока диагностика идет"""
+
+    __slots__ = ("keys", "_coordinator", "_closed")
+
+    def __init__(self, coordinator: "LeaseCoordinator", keys: List[str]):
+        self.keys = keys
+        self._coordinator = coordinator
+        self._closed = False
+
+    def complete(self):
+        """Событие обработано: ключи остаются занятыми на done_ttl, чтобы повторы не диагностировались"""
+        if not self._closed:
+            self._closed = True
+            self._coordinator._finish(self, completed=True)
+
+    def release(self):
+        """Событие не обработано (например, очередь полна): повторную доставку может взять любой узел"""
+        if not self._closed:
+            self._closed = True
+            self._coordinator._finish(self, completed=False)
+
+
+class LeaseCoordinator:
+    """Захват событий узлом и фоновое продление аренд.
+
+    Аренда живет ttl секунд и продлевается каждые ttl / 3, пока узел жив;
+    если процесс упал, через ttl событие снова может взять другой узел.
+    """
+
+    def __init__(self, store: LeaseStore, owner: Optional[str] = None, ttl: float = 60.0, done_ttl: float = 3600.0):
+        self.store = store
+        self.owner = owner or default_node_id()
+        self.ttl = ttl
+        self.done_ttl = done_ttl
+        self._lock = threading.Lock()
+        self._active: Dict[int, Lease] = {}
+        self._stop = threading.Event()
+        self.claimed = 0
+        self.duplicates = 0
+        self.completed = 0
+        self.released = 0
+        self.lost = 0
+        self.errors = 0
+        self._heartbeat = threading.Thread(target=self._renew_loop, name="lease-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def claim(self, keys: List[str]) -> Optional[Lease]:
+        """Lease, если событие досталось этому узлу; None - его уже обрабатывает другой.
+
+        Если хранилище недоступно, событие обрабатывается: лучше повтор, чем потеря.
+        """
+        try:
+            acquired = self.store.acquire(keys, self.owner, self.ttl)
+        except Exception as e:
+            print(f"⚠️ Хранилище аренд недоступно: {e}")
+            with self._lock:
+                self.errors += 1
+            acquired = True
+        with self._lock:
+            if not acquired:
+                self.duplicates += 1
+                return None
+            self.claimed += 1
+            lease = Lease(self, keys)
+            self._active[id(lease)] = lease
+            return lease
+
+    def _finish(self, lease: Lease, completed: bool):
+        with self._lock:
+            self._active.pop(id(lease), None)
+            if completed:
+                self.completed += 1
+            else:
+                self.released += 1
+        try:
+            if completed:
+                self.store.renew(lease.keys, self.owner, self.done_ttl)
+            else:
+                self.store.release(lease.keys, self.owner)
+        except Exception as e:
+            print(f"⚠️ Хранилище аренд недоступно: {e}")
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.ttl / 3):
+            self.renew_all()
+
+    def renew_all(self):
+        with self._lock:
+            leases = list(self._active.values())
+        for lease in leases:
+            try:
+                if not self.store.renew(lease.keys, self.owner, self.ttl):
+                    # Аренда истекла (например, узел завис) и могла перейти к другому узлу
+                    with self._lock:
+                        if self._active.pop(id(lease), None) is not None:
+                            self.lost += 1
+            except Exception as e:
+                print(f"⚠️ Не удалось продлить аренду {lease.keys}: {e}")
+        try:
+            self.store.purge()
+        except Exception:
+            pass
+
+    def active(self) -> int:
+        with self._lock:
+            return len(self._active)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "owner": self.owner,
+                "active": len(self._active),
+                "claimed": self.claimed,
+                "duplicates": self.duplicates,
+                "completed": self.completed,
+                "released": self.released,
+                "lost": self.lost,
+                "errors": self.errors
+            }
+
+    def close(self):
+        """Останавливает продление и отпускает незавершенные события"""
+        self._stop.set()
+        with self._lock:
+            leases = list(self._active.values())
+        for lease in leases:
+            lease.release()
+        self.store.close()
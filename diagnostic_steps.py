@@ -0,0 +1,143 @@
+"""
+Шаги диагностики без ввода-вывода, общие для синхронного и асинхронного режимов:
+исходы попыток локальных команд, тексты результатов и разбор измерений Globalping
+"""
+
+import platform
+import re
+from typing import Any, Dict, Optional, Tuple
+
+from globalping_models import Measurement, render_slack
+from probe_escalation import CreditLedger, ProbeRequest
+from result_cache import format_cache_age, normalize_target
+
+# Базовые таймауты локальных команд (сек); растут с каждой попыткой
+COMMAND_TIMEOUTS = {
+    "tracert": 20, "traceroute": 20,
+    "pathping": 25, "mtr": 25,
+    "telnet": 8,
+    "ping": 12,
+    "dig": 8, "nslookup": 8,
+    "default": 10
+}
+
+# Кодировка вывода команд: в Windows - кодировка консоли
+COMMAND_ENCODING = 'cp866' if platform.system().lower() == 'windows' else 'utf-8'
+
+# (результат, ошибка) для RetryPolicy; ошибка None - попытка успешна
+Outcome = Tuple[Any, Any]
+
+
+def command_name(command: str) -> str:
+    return command.split()[0].lower()
+
+
+def command_timeout(cmd_name: str, timeout_scale: float, deadline, base_timeout: Optional[float] = None) -> int:
+    """Таймаут попытки: растет с каждой попыткой, но не выходит за дедлайн; 0 - времени не осталось.
+
+    base_timeout по умолчанию берется из COMMAND_TIMEOUTS.
+    """
+    if base_timeout is None:
+        base_timeout = COMMAND_TIMEOUTS.get(cmd_name, COMMAND_TIMEOUTS["default"])
+    return int(deadline.cap(base_timeout * timeout_scale))
+
+
+def command_not_started(cmd_name: str, slots_busy: bool = False) -> Outcome:
+    reason = "все слоты заняты до конца лимита этапа" if slots_busy else "исчерпан лимит времени этапа"
+    return f"⏱️ {cmd_name.title()} не запущен: {reason}", "deadline"
+
+
+def command_failed(cmd_name: str, error: Exception) -> Outcome:
+    """Исход попытки, в которой процесс не удалось запустить или дождаться"""
+    if isinstance(error, FileNotFoundError):
+        return f"❌ Команда не найдена: {cmd_name} (возможно, не установлена в системе)", error
+    return f"❌ Критическая ошибка {cmd_name}: {str(error)}", error
+
+
+def command_outcome(cmd_name: str, attempt: int, timeout: int, finished: Optional[Tuple[int, str, str]]) -> Outcome:
+    """Исход завершившейся попытки; finished - (код возврата, stdout, stderr), None - прерван по таймауту"""
+    if finished is None:
+        # Повтор с увеличенным таймаутом, если хватает времени
+        return f"⏱️ {cmd_name.title()} прерван по таймауту ({timeout}с) после {attempt} попыток", "timeout"
+    returncode, stdout, stderr = finished
+    if returncode == 0 and stdout.strip():
+        return stdout, None
+    if stderr.strip():
+        return f"❌ Ошибка после {attempt} попыток: {stderr.strip()}", stderr
+    return (stdout if stdout else "⚠️ Команда выполнена, но результат пуст"), None
+
+
+def command_span_fields(finished: Optional[Tuple[int, str, str]]) -> Dict[str, Any]:
+    """Поля спана попытки: исход и объем вывода"""
+    if finished is None:
+        return {"outcome": "timeout"}
+    returncode, stdout, stderr = finished
+    return {"outcome": "ok" if returncode == 0 else "error", "bytes": len(stdout) + len(stderr)}
+
+
+def native_outcome(output: str) -> Outcome:
+    """Исход встроенной пробы: текст с ❌ - ошибка для RetryPolicy (NXDOMAIN не повторяется)"""
+    return output, (output if output.startswith("❌") else None)
+
+
+def native_span_fields(output: str) -> Dict[str, Any]:
+    return {"outcome": "error" if output.startswith("❌") else "ok", "bytes": len(output)}
+
+
+def local_result_ok(text: str) -> bool:
+    """Проверяет, что вывод локальной команды не является ошибкой или таймаутом"""
+    return not re.match(r"💻 `[^`]*`:\s*(```)?\s*(❌|⏱️)", text)
+
+
+def local_result(command: str, output: str, age: Optional[float]) -> Tuple[str, str]:
+    """Текст результата локальной команды и исход для спана"""
+    text = f"💻 `{command}`:\n```{output}```{format_cache_age(age)}"
+    return text, "cached" if age is not None else ("ok" if local_result_ok(text) else "error")
+
+
+def local_error(command: str, error: Exception) -> str:
+    return f"💻 `{command}`: ❌ Критическая ошибка: {str(error)}"
+
+
+def local_stage_timeout(command: str, stage_deadline: int) -> str:
+    return f"💻 `{command}`: ⏱️ не завершена за общий лимит этапа ({stage_deadline}с)"
+
+
+def globalping_cache_key(target: str, test_type: str, request: Optional[ProbeRequest] = None) -> tuple:
+    """Ключ кеша: разные наборы проб адаптивного режима кешируются отдельно"""
+    key = ("globalping", normalize_target(target), test_type)
+    if request is not None:
+        key += request.key
+    return key
+
+
+def globalping_result(
+    test_type: str,
+    result: Any,
+    age: Optional[float],
+    request: Optional[ProbeRequest] = None,
+    measurements: Optional[Dict[str, Measurement]] = None,
+    ledger: Optional[CreditLedger] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """Текст результата теста и поля спана.
+
+    Measurement записывается в measurements, свежие пробы - в ledger; result - Measurement или текст ошибки.
+    """
+    if isinstance(result, Measurement):
+        if ledger is not None and age is None:
+            ledger.add(request.stage if request else "standard", len(result.probes))
+        if measurements is not None:
+            measurements[test_type] = result
+        fields = {"outcome": "cached" if age is not None else "ok", "probes": len(result.probes)}
+        result = render_slack(result)
+    else:
+        fields = {"outcome": "timeout" if result.startswith("⏱️") else "error"}
+    return result + format_cache_age(age), fields
+
+
+def globalping_stage_timeout(test_type: str, deadline: int) -> str:
+    return f"⏱️ **{test_type.upper()}**: не завершен за общий лимит этапа ({deadline}с)"
+
+
+def globalping_error(test_type: str, error: Exception) -> str:
+    return f"❌ **Критическая ошибка {test_type}**: {str(error)}"
@@ -0,0 +1,139 @@
+"""
+Асинхронный клиент Globalping на aiohttp для режима с одним циклом событий
+"""
+
+import asyncio
+import json
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import aiohttp
+
+from globalping_budget import GlobalpingScheduler
+from globalping_models import parse_measurement
+from globalping_polling import poll_measurement_async
+
+API_BASE = "https://api.globalping.io/v1"
+
+
+class HTTPResponse(NamedTuple):
+    """Прочитанный ответ: тот же интерфейс, что у requests.Response, для планировщика и опроса"""
+    status_code: int
+    headers: Any
+    content: bytes
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+def measurement_payload(target: str, test_type: str, locations: List[str], limit: int) -> Dict[str, Any]:
+    """Тело запроса на создание измерения, как у синхронного клиента"""
+    payload = {
+        "type": test_type,
+        "target": target,
+        "locations": [{"magic": location} for location in locations],
+        "limit": limit
+    }
+    if test_type == "ping":
+        payload["measurementOptions"] = {"packets": 3}
+    elif test_type == "dns":
+        payload["measurementOptions"] = {"query": {"type": "A"}}
+    return payload
+
+
+class AsyncGlobalpingClient:
+    """Измерения через токен или публичный API на общей сессии aiohttp.
+
+    Сессия создается вызывающим кодом в цикле событий и переиспользует соединения
+    для всех отчетов; ответы на создание измерений учитываются планировщиком бюджета.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, api_token: Optional[str] = None, scheduler: Optional[GlobalpingScheduler] = None):
+        self.session = session
+        self.api_token = api_token
+        self.scheduler = scheduler
+        self.rest_api_base = API_BASE
+        # Максимальное время ожидания результатов одного измерения (сек)
+        self.max_wait = 25
+
+    def _headers(self, endpoint: str) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if endpoint == "token" and self.api_token:
+            headers["Authorization"] = f"Bearer {self.api_token}"
+        return headers
+
+    async def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None, payload: Any = None, timeout: float = 10) -> HTTPResponse:
+        """Один запрос; сетевые ошибки aiohttp приходят как ConnectionError"""
+        try:
+            async with self.session.request(
+                method, url, json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                return HTTPResponse(response.status, response.headers, await response.read())
+        except aiohttp.ClientError as e:
+            raise ConnectionError(str(e)) from e
+
+    async def measure(
+        self,
+        target: str,
+        test_type: str,
+        locations: List[str],
+        limit: int,
+        endpoint: str = "token",
+        max_wait: Optional[float] = None,
+        request_timeout: float = 10,
+        on_poll_error=None
+    ) -> Dict[str, Any]:
+        """Создает измерение и ждет результат; словарь как у GlobalpingTokenClient._execute_test.
+
+        Отмена задачи прерывает ожидание результатов.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        headers = self._headers(endpoint)
+        try:
+            response = await self.request(
+                "POST", f"{self.rest_api_base}/measurements", headers,
+                measurement_payload(target, test_type, locations, limit), timeout=min(request_timeout, max(1, max_wait))
+            )
+            if self.scheduler is not None:
+                self.scheduler.update(endpoint, response)
+
+            if response.status_code != 202:
+                return {"success": False, "error": f"HTTP {response.status_code}", "bytes": len(response.content)}
+
+            measurement_id = response.json().get("id")
+            if not measurement_id:
+                return {"success": False, "error": "No measurement ID", "bytes": len(response.content)}
+
+            async def fetch(url, request_headers, timeout):
+                return await self.request("GET", url, request_headers, timeout=timeout)
+
+            poll = await poll_measurement_async(
+                fetch,
+                f"{self.rest_api_base}/measurements/{measurement_id}",
+                measurement_id,
+                test_type,
+                max_wait=max_wait,
+                headers=headers,
+                request_timeout=request_timeout,
+                on_error=on_poll_error
+            )
+            sent = {"polls": poll["polls"], "bytes": len(response.content) + poll["bytes"]}
+
+            if poll["status"] == "finished":
+                return {"success": True, "measurement": parse_measurement(poll["data"], test_type, target, source=endpoint), **sent}
+            elif poll["status"] == "failed":
+                return {"success": False, "error": f"Test failed: {poll['data'].get('error', 'Unknown error')}", **sent}
+            elif poll["status"] == "rejected":
+                return {"success": False, "error": f"HTTP {poll['http_status']}", **sent}
+            return {"success": False, "error": "Timeout", **sent}
+
+        except (ConnectionError, asyncio.TimeoutError, ValueError) as e:
+            return {"success": False, "error": str(e) or type(e).__name__}
+
+    async def get_credits(self) -> Dict[str, Any]:
+        try:
+            response = await self.request("GET", f"{self.rest_api_base}/credits", self._headers("token"))
+            if response.status_code == 200:
+                return {"success": True, "credits": response.json()}
+            return {"success": False, "error": f"HTTP {response.status_code}"}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
@@ -0,0 +1,354 @@
+"""
+Планировщик создания Globalping измерений с учетом кредитов и лимитов API
+"""
+
+import asyncio
+import math
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+import requests
+
+from globalping_polling import _retry_after_seconds
+
+
+class BudgetExhausted(Exception):
+    """Ни у одного API нет запаса проб до конца допустимого ожидания"""
+
+    # Повтор сразу после отказа не поможет: бюджет восстанавливается минутами
+    retryable = False
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def take(self, amount: float):
+        self._refill()
+        self._tokens -= amount
+
+    def clamp(self, amount: float):
+        """Не больше, чем реально осталось по данным сервера"""
+        self._refill()
+        self._tokens = min(self._tokens, amount)
+
+    def time_until(self, amount: float) -> float:
+        self._refill()
+        if self._tokens >= amount:
+            return 0.0
+        if self.rate <= 0:
+            return math.inf
+        return (amount - self._tokens) / self.rate
+
+
+class EndpointBudget:
+    """Состояние лимитов одного API: локальное ведро и последние заголовки ответа"""
+
+    def __init__(self, name: str, rate_per_hour: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_hour / 3600.0, burst, clock)
+        self._clock = clock
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at: Optional[float] = None
+        self.credits: Optional[int] = None
+        self.blocked_until = 0.0
+        self.granted = 0
+        self.reduced = 0
+        self.throttled = 0
+
+    def server_headroom(self) -> float:
+        """Запас по данным сервера: остаток часового лимита плюс кредиты"""
+        now = self._clock()
+        if now < self.blocked_until:
+            return 0.0
+        if self.remaining is None or (self.reset_at is not None and now >= self.reset_at):
+            rate_left = math.inf
+        else:
+            rate_left = self.remaining
+        # Сверх часового лимита тесты списываются с кредитов
+        return rate_left + (self.credits or 0)
+
+    def available(self) -> float:
+        return min(self.bucket.tokens, self.server_headroom())
+
+    def is_low(self, low_fraction: float) -> bool:
+        if self.remaining is None or not self.limit:
+            return False
+        return self.remaining + (self.credits or 0) < self.limit * low_fraction
+
+    def wait_time(self, amount: float) -> float:
+        now = self._clock()
+        waits = [self.bucket.time_until(amount)]
+        if now < self.blocked_until:
+            waits.append(self.blocked_until - now)
+        if self.server_headroom() < amount:
+            waits.append(self.reset_at - now if self.reset_at and self.reset_at > now else math.inf)
+        return max(waits)
+
+    def update(self, response: requests.Response):
+        headers = response.headers
+        now = self._clock()
+
+        def header_int(name: str) -> Optional[int]:
+            try:
+                return int(float(headers[name]))
+            except (KeyError, TypeError, ValueError):
+                return None
+
+        limit = header_int("X-RateLimit-Limit")
+        remaining = header_int("X-RateLimit-Remaining")
+        reset = header_int("X-RateLimit-Reset")
+        credits = header_int("X-Credits-Remaining")
+        if limit is not None:
+            self.limit = limit
+        if remaining is not None:
+            self.remaining = remaining
+            self.bucket.clamp(remaining + (credits if credits is not None else self.credits or 0))
+        if reset is not None:
+            self.reset_at = now + reset
+        if credits is not None:
+            self.credits = credits
+
+        if response.status_code == 429:
+            self.throttled += 1
+            wait = _retry_after_seconds(response)
+            if wait is None:
+                wait = reset if reset is not None else 60
+            self.blocked_until = max(self.blocked_until, now + wait)
+            self.bucket.clamp(0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = self._clock()
+        return {
+            "tokens": round(self.bucket.tokens, 2),
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "reset_in": round(self.reset_at - now, 1) if self.reset_at else None,
+            "credits": self.credits,
+            "blocked_for": round(max(0.0, self.blocked_until - now), 1),
+            "granted": self.granted,
+            "reduced": self.reduced,
+            "throttled": self.throttled
+        }
+
+
+class Grant:
+    """Разрешение создать измерение: через какой API и с каким числом проб"""
+
+    __slots__ = ("endpoint", "limit", "requested", "waited")
+
+    def __init__(self, endpoint: str, limit: int, requested: int, waited: float):
+        self.endpoint = endpoint
+        self.limit = limit
+        self.requested = requested
+        self.waited = waited
+
+    @property
+    def reduced(self) -> bool:
+        return self.limit < self.requested
+
+
+class GlobalpingScheduler:
+    """Общий для всех отчетов бюджет проб Globalping.
+
+    Перед созданием измерения выдает Grant: выбирает API с запасом, уменьшает
+    limit при низком остатке и ставит запрос в очередь, пока бюджет не восстановится.
+    """
+
+    def __init__(
+        self,
+        endpoints: Dict[str, EndpointBudget],
+        min_limit: int = 1,
+        low_fraction: float = 0.2,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Optional[Callable[[float], None]] = None
+    ):
+        self.endpoints = endpoints
+        self.min_limit = min_limit
+        self.low_fraction = low_fraction
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._sleep = sleep
+        self.waits = 0
+        self.rejected = 0
+
+    def _wanted(self, endpoint: EndpointBudget, limit: int) -> int:
+        return self.min_limit if endpoint.is_low(self.low_fraction) else limit
+
+    def _try_grant(self, order: Sequence[str], limit: int, allow_reduced: bool) -> Optional[Grant]:
+        for name in order:
+            endpoint = self.endpoints.get(name)
+            if endpoint is None:
+                continue
+            available = endpoint.available()
+            wanted = self._wanted(endpoint, limit)
+            granted = int(min(wanted, available))
+            if granted < (self.min_limit if allow_reduced else wanted):
+                continue
+            endpoint.bucket.take(granted)
+            if endpoint.remaining is not None:
+                # До следующего ответа сервера учитываем выданные пробы сами
+                endpoint.remaining -= granted
+            endpoint.granted += 1
+            if granted < limit:
+                endpoint.reduced += 1
+            return Grant(name, granted, limit, 0.0)
+        return None
+
+    def _wait_time(self, order: Sequence[str], limit: Optional[int]) -> float:
+        return min(
+            (
+                self.endpoints[name].wait_time(limit or self._wanted(self.endpoints[name], self.min_limit))
+                for name in order if name in self.endpoints
+            ),
+            default=math.inf
+        )
+
+    def _step(self, order: Sequence[str], limit: int, remaining: float) -> Tuple[Optional[Grant], float]:
+        """Grant, если его можно выдать сейчас, иначе (None, сколько ждать); BudgetExhausted - ждать бесполезно"""
+        grant = self._try_grant(order, limit, allow_reduced=False)
+        full_wait = self._wait_time(order, limit) if grant is None else 0.0
+        if grant is None and full_wait > remaining:
+            grant = self._try_grant(order, limit, allow_reduced=True)
+        if grant is not None:
+            return grant, 0.0
+
+        # Полный limit дождаться успеваем - ждем его, иначе хотя бы min_limit
+        wait = full_wait if full_wait <= remaining else self._wait_time(order, self.min_limit)
+        if remaining <= 0 or wait > remaining:
+            self.rejected += 1
+            raise BudgetExhausted(
+                f"нет запаса проб ({', '.join(order)}), восстановление через "
+                f"{'∞' if math.isinf(wait) else f'{wait:.0f}с'}"
+            )
+        self.waits += 1
+        return None, wait
+
+    def acquire(self, limit: int, order: Sequence[str] = ("token", "public"), max_wait: float = 0.0) -> Grant:
+        """Выдает Grant или ждет до max_wait секунд; иначе BudgetExhausted.
+
+        Полный limit выдается, если его удается дождаться за max_wait,
+        иначе - сколько есть, но не меньше min_limit.
+        """
+        started = self._clock()
+        with self._condition:
+            while True:
+                grant, wait = self._step(order, limit, max_wait - (self._clock() - started))
+                if grant is not None:
+                    grant.waited = self._clock() - started
+                    return grant
+                if self._sleep is not None:
+                    self._sleep(wait)
+                else:
+                    # Ответы других запросов (update) могут освободить бюджет раньше
+                    self._condition.wait(timeout=max(wait, 0.05))
+
+    async def acquire_async(self, limit: int, order: Sequence[str] = ("token", "public"), max_wait: float = 0.0) -> Grant:
+        """Асинхронный вариант acquire: ожидание не занимает поток цикла событий.
+
+        Ответы других запросов не будят ожидающих, поэтому бюджет перепроверяется не реже раза в секунду.
+        """
+        started = self._clock()
+        while True:
+            with self._condition:
+                grant, wait = self._step(order, limit, max_wait - (self._clock() - started))
+            if grant is not None:
+                grant.waited = self._clock() - started
+                return grant
+            await asyncio.sleep(min(max(wait, 0.05), 1.0))
+
+    def has_headroom(self, name: str, amount: int = 1) -> bool:
+        with self._condition:
+            endpoint = self.endpoints.get(name)
+            return endpoint is not None and endpoint.available() >= amount
+
+    def update(self, name: str, response: requests.Response):
+        """Учитывает заголовки лимитов и кредитов из ответа на создание измерения"""
+        with self._condition:
+            endpoint = self.endpoints.get(name)
+            if endpoint is None:
+                return
+            endpoint.update(response)
+            self._condition.notify_all()
+
+    def set_credits(self, name: str, credits: Optional[int]):
+        with self._condition:
+            if name in self.endpoints and credits is not None:
+                self.endpoints[name].credits = credits
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "waits": self.waits,
+                "rejected": self.rejected,
+                **{name: endpoint.snapshot() for name, endpoint in self.endpoints.items()}
+            }
+
+
+# Отказ токена (неверный, без прав или исчерпана квота): публичный API может ответить сразу
+TOKEN_REJECTED = re.compile(r"HTTP 40[13]\b|HTTP 429\b")
+
+
+class TokenFallback:
+    """Переход с токена на публичный API в пределах одного теста.
+
+    После ошибки токена следующие попытки идут через публичный API, если у него есть запас;
+    при отказе токена публичный API запрашивается сразу, в той же попытке, - иначе
+    RetryPolicy сочтет 401/403 окончательной ошибкой и до публичного API дело не дойдет.
+    """
+
+    def __init__(self, scheduler: GlobalpingScheduler, use_token: bool, enabled: bool = True, min_limit: int = 1):
+        self.scheduler = scheduler
+        self.use_token = use_token
+        self.enabled = enabled
+        self.min_limit = min_limit
+
+    @property
+    def order(self) -> Tuple[str, ...]:
+        """Порядок API для планировщика: токен, пока им можно пользоваться"""
+        return ("token", "public") if self.use_token else ("public",)
+
+    def token_failed(self, error: Any) -> bool:
+        """Отмечает ошибку токена; True - публичный API нужно запросить в этой же попытке"""
+        if not self.enabled or not self.scheduler.has_headroom("public", self.min_limit):
+            return False
+        self.use_token = False
+        return bool(TOKEN_REJECTED.search(str(error)))
+
+    def run(self, token_attempt: Callable[[], Tuple[Any, Any]], public_attempt: Callable[[], Tuple[Any, Any]]) -> Tuple[Any, Any]:
+        """Попытка через токен с переходом на публичный API; возвращает (результат, ошибка)"""
+        result, error = token_attempt()
+        if error is not None and self.token_failed(error):
+            print(f"🔁 Токен Globalping отклонен ({error}), запрос через публичный API")
+            return public_attempt()
+        return result, error
+
+    async def run_async(
+        self,
+        token_attempt: Callable[[], Awaitable[Tuple[Any, Any]]],
+        public_attempt: Callable[[], Awaitable[Tuple[Any, Any]]]
+    ) -> Tuple[Any, Any]:
+        result, error = await token_attempt()
+        if error is not None and self.token_failed(error):
+            print(f"🔁 Токен Globalping отклонен ({error}), запрос через публичный API")
+            return await public_attempt()
+        return result, error
@@ -0,0 +1,163 @@
+"""
+Типизированные записи измерений Globalping, общие для токен- и публичного API
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def _fmt(value: Optional[float]) -> str:
+    """Число в исходном виде API: 12.0 → 12, отсутствующее значение → N/A"""
+    if value is None:
+        return "N/A"
+    return f"{value:g}"
+
+
+@dataclass(slots=True)
+class Hop:
+    """Хоп traceroute/mtr: host None означает, что узел не ответил"""
+    index: int
+    host: Optional[str]
+    rtt: Optional[float]
+    loss: float = 0.0
+
+
+@dataclass(slots=True)
+class HttpTimings:
+    total: Optional[float] = None
+    dns: Optional[float] = None
+    tcp: Optional[float] = None
+    tls: Optional[float] = None
+    first_byte: Optional[float] = None
+    download: Optional[float] = None
+
+
+@dataclass(slots=True)
+class Probe:
+    """Результат одной пробы; заполнены только поля своего типа теста"""
+    city: str
+    country: str
+    avg: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    loss: Optional[float] = None
+    status: Optional[int] = None
+    timings: Optional[HttpTimings] = None
+    answers: Tuple[str, ...] = ()
+    hops: Optional[Tuple[Hop, ...]] = None
+    error: Optional[str] = None
+    # Автономная система пробы: по ней повторное измерение попадает в ту же сеть
+    asn: Optional[int] = None
+
+    @property
+    def location(self) -> str:
+        return f"{self.city}, {self.country}"
+
+
+@dataclass(slots=True)
+class Measurement:
+    test_type: str
+    target: str
+    probes: List[Probe] = field(default_factory=list)
+    # token - получено через API токен, public - через публичный API
+    source: str = "public"
+
+
+def _parse_hops(test_type: str, raw_hops: List[Dict[str, Any]]) -> Tuple[Hop, ...]:
+    hops = []
+    for index, hop in enumerate(raw_hops, 1):
+        host = hop.get("resolvedHostname") or hop.get("resolvedAddress")
+        if test_type == "mtr":
+            stats = hop.get("stats", {})
+            hops.append(Hop(index, host, _number(stats.get("avg")), _number(stats.get("loss")) or 0.0))
+            continue
+        timings = hop.get("timings", [])
+        if not timings:
+            hops.append(Hop(index, None, None, 100.0))
+        else:
+            # Берем первый успешный timing
+            hops.append(Hop(index, host, _number(timings[0].get("rtt"))))
+    return tuple(hops)
+
+
+def _parse_probe(test_type: str, result: Dict[str, Any]) -> Probe:
+    raw_probe = result.get("probe", {})
+    probe = Probe(raw_probe.get("city", "Unknown"), raw_probe.get("country", "Unknown"))
+    if isinstance(raw_probe.get("asn"), int):
+        probe.asn = raw_probe["asn"]
+    try:
+        data = result.get("result", {})
+        if test_type == "ping":
+            stats = data.get("stats", {})
+            probe.avg, probe.min, probe.max = _number(stats.get("avg")), _number(stats.get("min")), _number(stats.get("max"))
+            probe.loss = _number(stats.get("loss"))
+        elif test_type == "http":
+            timings = data.get("timings", {})
+            probe.status = data.get("statusCode") or data.get("status")
+            probe.timings = HttpTimings(
+                total=_number(timings.get("total")),
+                dns=_number(timings.get("dns")),
+                tcp=_number(timings.get("tcp")),
+                tls=_number(timings.get("tls")),
+                first_byte=_number(timings.get("firstByte")),
+                download=_number(timings.get("download"))
+            )
+        elif test_type == "dns":
+            probe.answers = tuple(str(answer.get("value", "N/A")) for answer in data.get("answers", []))
+        elif test_type in ("traceroute", "mtr"):
+            probe.hops = _parse_hops(test_type, data.get("hops", []))
+    except Exception:
+        probe.error = "Ошибка обработки данных"
+    return probe
+
+
+def parse_measurement(result_data: Dict[str, Any], test_type: str, target: str, source: str = "public") -> Measurement:
+    """Разбирает ответ Globalping в типизированные записи за один проход"""
+    return Measurement(
+        test_type,
+        target,
+        [_parse_probe(test_type, result) for result in result_data.get("results", [])],
+        source
+    )
+
+
+def _render_path(probe: Probe, test_type: str) -> str:
+    if not probe.hops:
+        label = "Traceroute" if test_type == "traceroute" else "MTR"
+        return f"📍 {probe.location}: {label} данные недоступны"
+    hop_details = []
+    for hop in probe.hops:
+        if test_type == "traceroute" and hop.rtt is None and hop.loss >= 100:
+            hop_details.append(f"  {hop.index:2}. * * * (timeout)")
+            continue
+        loss_str = f" ({_fmt(hop.loss)}% loss)" if hop.loss > 0 else ""
+        hop_details.append(f"  {hop.index:2}. {hop.host or '* * *'} - {_fmt(hop.rtt)}ms{loss_str}")
+    return f"📍 {probe.location} {test_type.upper()}:\n" + "\n".join(hop_details)
+
+
+def render_probe(probe: Probe, test_type: str) -> str:
+    if probe.error:
+        return f"📍 {probe.location}: {probe.error}"
+    if test_type == "ping":
+        return f"📍 {probe.location}: {_fmt(probe.avg)}ms (потерь: {_fmt(probe.loss)}%)"
+    if test_type == "http":
+        total = probe.timings.total if probe.timings else None
+        return f"📍 {probe.location}: HTTP {probe.status if probe.status is not None else 'N/A'} ({_fmt(total)}ms)"
+    if test_type == "dns":
+        return f"📍 {probe.location}: {probe.answers[0] if probe.answers else 'No DNS response'}"
+    return _render_path(probe, test_type)
+
+
+def render_slack(measurement: Measurement) -> str:
+    """Текст результатов для Slack"""
+    header = f"**{measurement.test_type.upper()}** для `{measurement.target}`"
+    if not measurement.probes:
+        return f"❌ {header}: Нет результатов"
+    text = f"🌍 {header}:\n" + "\n".join(render_probe(probe, measurement.test_type) for probe in measurement.probes)
+    return f"✅ {text}" if measurement.source == "token" else text
@@ -0,0 +1,237 @@
+"""
+Адаптивный опрос результатов Globalping измерений
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import requests
+
+# Профили опроса: первый интервал, множитель backoff и потолок интервала (сек).
+# Быстрые тесты завершаются за сотни миллисекунд, mtr - за десятки секунд.
+POLL_PROFILES = {
+    "dns": {"first": 0.2, "factor": 1.5, "max": 1.0},
+    "ping": {"first": 0.3, "factor": 1.5, "max": 1.5},
+    "http": {"first": 0.3, "factor": 1.5, "max": 1.5},
+    "traceroute": {"first": 1.0, "factor": 1.5, "max": 3.0},
+    "mtr": {"first": 2.0, "factor": 1.4, "max": 4.0},
+    "default": {"first": 0.5, "factor": 1.5, "max": 2.0}
+}
+
+
+class PollStats:
+    """Счетчики опросов по типам тестов и по последним измерениям"""
+
+    def __init__(self, max_measurements: int = 200):
+        self._lock = threading.Lock()
+        self._max_measurements = max_measurements
+        self.by_measurement: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.by_test_type: Dict[str, Dict[str, int]] = {}
+
+    def record(self, measurement_id: str, test_type: str, polls: int, not_modified: int, status: str, elapsed: float):
+        with self._lock:
+            self.by_measurement[measurement_id] = {
+                "test_type": test_type,
+                "polls": polls,
+                "not_modified": not_modified,
+                "status": status,
+                "elapsed": round(elapsed, 3)
+            }
+            while len(self.by_measurement) > self._max_measurements:
+                self.by_measurement.popitem(last=False)
+
+            totals = self.by_test_type.setdefault(test_type, {"measurements": 0, "polls": 0, "not_modified": 0})
+            totals["measurements"] += 1
+            totals["polls"] += polls
+            totals["not_modified"] += not_modified
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "by_test_type": {name: dict(values) for name, values in self.by_test_type.items()},
+                "recent": dict(self.by_measurement)
+            }
+
+
+poll_stats = PollStats()
+
+
+def _retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата)"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def poll_measurement(
+    session: requests.Session,
+    url: str,
+    measurement_id: str,
+    test_type: str,
+    max_wait: float,
+    headers: Optional[Dict[str, str]] = None,
+    request_timeout: float = 10,
+    on_error: Optional[Callable[[Exception, float], None]] = None,
+    sleep: Callable[[float], None] = time.sleep,
+    cancel: Optional[threading.Event] = None
+) -> Dict[str, Any]:
+    """Опрашивает измерение до завершения с адаптивным интервалом.
+
+    Возвращает словарь со статусом (finished/failed/rejected/timeout/cancelled), последними
+    данными измерения, количеством запросов и полученных байт. Ответ 4xx, кроме 429,
+    завершает опрос статусом rejected, код ответа - в http_status. Неизмененные результаты
+    запрашиваются через If-None-Match и обходятся ответом 304.
+    cancel прерывает ожидание, например когда хеджирующий запрос уже победил.
+    """
+    profile = POLL_PROFILES.get(test_type, POLL_PROFILES["default"])
+    interval = profile["first"]
+    started = time.monotonic()
+    polls = 0
+    not_modified = 0
+    received = 0
+    etag = None
+    data: Optional[Dict[str, Any]] = None
+    status = "timeout"
+    http_status: Optional[int] = None
+
+    while True:
+        remaining = max_wait - (time.monotonic() - started)
+        if remaining <= 0:
+            break
+        if cancel is None:
+            sleep(min(interval, remaining))
+        elif cancel.wait(min(interval, remaining)):
+            status = "cancelled"
+            break
+
+        request_headers = dict(headers or {})
+        if etag:
+            request_headers["If-None-Match"] = etag
+
+        hint = None
+        try:
+            polls += 1
+            response = session.get(url, headers=request_headers, timeout=request_timeout)
+            hint = _retry_after_seconds(response)
+            received += len(response.content)
+
+            if response.status_code == 304:
+                not_modified += 1
+            elif response.status_code == 200:
+                etag = response.headers.get("ETag") or etag
+                data = response.json()
+                state = data.get("status")
+                if state in ("finished", "failed"):
+                    status = state
+                    break
+            elif 400 <= response.status_code < 500 and response.status_code != 429:
+                # Измерение не найдено или доступ запрещен: ждать дальше бессмысленно
+                status = "rejected"
+                http_status = response.status_code
+                break
+        except requests.RequestException as e:
+            # Временные сетевые ошибки не прерывают ожидание
+            if on_error:
+                on_error(e, max_wait - (time.monotonic() - started))
+
+        interval = min(interval * profile["factor"], profile["max"])
+        if hint is not None:
+            interval = max(interval, hint)
+
+    elapsed = time.monotonic() - started
+    poll_stats.record(measurement_id, test_type, polls, not_modified, status, elapsed)
+    return {
+        "status": status, "data": data, "polls": polls, "not_modified": not_modified,
+        "elapsed": elapsed, "bytes": received, "http_status": http_status
+    }
+
+
+async def poll_measurement_async(
+    fetch: Callable[[str, Dict[str, str], float], Awaitable[Any]],
+    url: str,
+    measurement_id: str,
+    test_type: str,
+    max_wait: float,
+    headers: Optional[Dict[str, str]] = None,
+    request_timeout: float = 10,
+    on_error: Optional[Callable[[Exception, float], None]] = None
+) -> Dict[str, Any]:
+    """Асинхронный вариант poll_measurement с теми же профилями и счетчиками.
+
+    fetch(url, headers, timeout) возвращает ответ с status_code, headers, content
+    и json(); временные сетевые ошибки он выбрасывает как ConnectionError.
+    Отмена задачи записывается как cancelled и пробрасывается дальше.
+    """
+    profile = POLL_PROFILES.get(test_type, POLL_PROFILES["default"])
+    interval = profile["first"]
+    started = time.monotonic()
+    polls = 0
+    not_modified = 0
+    received = 0
+    etag = None
+    data: Optional[Dict[str, Any]] = None
+    status = "timeout"
+    http_status: Optional[int] = None
+
+    try:
+        while True:
+            remaining = max_wait - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(interval, remaining))
+
+            request_headers = dict(headers or {})
+            if etag:
+                request_headers["If-None-Match"] = etag
+
+            hint = None
+            try:
+                polls += 1
+                response = await fetch(url, request_headers, request_timeout)
+                hint = _retry_after_seconds(response)
+                received += len(response.content)
+
+                if response.status_code == 304:
+                    not_modified += 1
+                elif response.status_code == 200:
+                    etag = response.headers.get("ETag") or etag
+                    data = response.json()
+                    state = data.get("status")
+                    if state in ("finished", "failed"):
+                        status = state
+                        break
+                elif 400 <= response.status_code < 500 and response.status_code != 429:
+                    # Измерение не найдено или доступ запрещен: ждать дальше бессмысленно
+                    status = "rejected"
+                    http_status = response.status_code
+                    break
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                if on_error:
+                    on_error(e, max_wait - (time.monotonic() - started))
+
+            interval = min(interval * profile["factor"], profile["max"])
+            if hint is not None:
+                interval = max(interval, hint)
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        poll_stats.record(measurement_id, test_type, polls, not_modified, status, elapsed)
+
+    return {
+        "status": status, "data": data, "polls": polls, "not_modified": not_modified,
+        "elapsed": elapsed, "bytes": received, "http_status": http_status
+    }
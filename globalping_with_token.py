@@ -1,39 +1,51 @@
-import json
-import requests
-import time
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, Optional
+from http_pool import SharedHTTPClient, get_http_client
+from globalping_budget import GlobalpingScheduler
+from globalping_polling import poll_measurement
+from globalping_models import parse_measurement, render_slack
+from target_extraction import extract_domain
 
 class GlobalpingTokenClient:
-    def __init__(self, api_token: str):
+    def __init__(self, api_token: str, http_client: Optional[SharedHTTPClient] = None, scheduler: Optional[GlobalpingScheduler] = None):
         self.api_token = api_token
+        # Планировщик получает заголовки лимитов и кредитов из ответов API
+        self.scheduler = scheduler
         self.rest_api_base = "https://api.globalping.io/v1"
-        self.session = requests.Session()
-        self.session.headers.update({
+        # Максимальное время ожидания результатов одного измерения (сек)
+        self.max_wait = 25
+        # Сессия общая для всех клиентов, поэтому заголовки передаются в каждом запросе
+        self.http_client = http_client or get_http_client()
+        self.session = self.http_client.session
+        self.headers = {
             "Authorization": f"Bearer {self.api_token}",
             "Content-Type": "application/json"
-        })
+        }
         
-    def ping(self, target: str, locations: str = "EU", limit: int = 2) -> Dict[str, Any]:
-        return self._execute_test(target, "ping", locations, limit)
+    def ping(self, target: str, locations: str = "EU", limit: int = 2, max_wait: Optional[float] = None, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+        return self._execute_test(target, "ping", locations, limit, max_wait, cancel)
     
-    def http(self, target: str, locations: str = "EU", limit: int = 2) -> Dict[str, Any]:
-        return self._execute_test(target, "http", locations, limit)
+    def http(self, target: str, locations: str = "EU", limit: int = 2, max_wait: Optional[float] = None, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+        return self._execute_test(target, "http", locations, limit, max_wait, cancel)
     
-    def dns(self, target: str, locations: str = "EU", limit: int = 2) -> Dict[str, Any]:
-        return self._execute_test(target, "dns", locations, limit)
+    def dns(self, target: str, locations: str = "EU", limit: int = 2, max_wait: Optional[float] = None, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+        return self._execute_test(target, "dns", locations, limit, max_wait, cancel)
     
-    def traceroute(self, target: str, locations: str = "EU", limit: int = 2) -> Dict[str, Any]:
-        return self._execute_test(target, "traceroute", locations, limit)
+    def traceroute(self, target: str, locations: str = "EU", limit: int = 2, max_wait: Optional[float] = None, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+        return self._execute_test(target, "traceroute", locations, limit, max_wait, cancel)
     
-    def mtr(self, target: str, locations: str = "EU", limit: int = 2) -> Dict[str, Any]:
-        return self._execute_test(target, "mtr", locations, limit)
+    def mtr(self, target: str, locations: str = "EU", limit: int = 2, max_wait: Optional[float] = None, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+        return self._execute_test(target, "mtr", locations, limit, max_wait, cancel)
     
-    def _execute_test(self, target: str, test_type: str, locations: str, limit: int = 2) -> Dict[str, Any]:
+    def _execute_test(
+        self, target: str, test_type: str, locations: str, limit: int = 2,
+        max_wait: Optional[float] = None, cancel: Optional[threading.Event] = None
+    ) -> Dict[str, Any]:
+        """max_wait - ожидание результатов (сек), по умолчанию self.max_wait; cancel прерывает ожидание"""
+        max_wait = self.max_wait if max_wait is None else max_wait
         try:
             # Очищаем URL от протокола для всех типов тестов
-            clean_target = target
-            if target.startswith(("http://", "https://")):
-                clean_target = target.replace("https://", "").replace("http://", "").split("/")[0]
+            clean_target = extract_domain(target)
             
             # Правильно формируем локации - разбиваем строку на отдельные magic объекты
             location_objects = []
@@ -52,7 +64,9 @@ class GlobalpingTokenClient:
             elif test_type == "dns":
                 payload["measurementOptions"] = {"query": {"type": "A"}}
             
-            response = self.session.post(f"{self.rest_api_base}/measurements", json=payload, timeout=10)
+            response = self.session.post(f"{self.rest_api_base}/measurements", json=payload, headers=self.headers, timeout=min(10, max(1, max_wait)))
+            if self.scheduler is not None:
+                self.scheduler.update("token", response)
             
             if response.status_code != 202:
                 return {"success": False, "error": f"HTTP {response.status_code}"}
@@ -61,103 +75,43 @@ class GlobalpingTokenClient:
             if not measurement_id:
                 return {"success": False, "error": "No measurement ID"}
             
-            # Ждем результаты
-            for attempt in range(20):
-                result_response = self.session.get(f"{self.rest_api_base}/measurements/{measurement_id}", timeout=10)
-                
-                if result_response.status_code == 200:
-                    result_data = result_response.json()
-                    
-                    if result_data.get("status") == "finished":
-                        formatted_result = self._format_results(result_data, test_type, clean_target)
-                        return {"success": True, "source": "REST API + Token", "result": formatted_result}
-                    elif result_data.get("status") == "failed":
-                        return {"success": False, "error": f"Test failed: {result_data.get('error', 'Unknown error')}"}
-                        
-                time.sleep(1)
+            # Ждем результаты с адаптивным интервалом опроса
+            poll = poll_measurement(
+                self.session,
+                f"{self.rest_api_base}/measurements/{measurement_id}",
+                measurement_id,
+                test_type,
+                max_wait=max_wait,
+                headers=self.headers,
+                cancel=cancel
+            )
+            result_data = poll["data"]
+            
+            if poll["status"] == "finished":
+                measurement = parse_measurement(result_data, test_type, clean_target, source="token")
+                return {
+                    "success": True,
+                    "source": "REST API + Token",
+                    "result": render_slack(measurement),
+                    "measurement": measurement,
+                    "polls": poll["polls"],
+                    "bytes": len(response.content) + poll["bytes"]
+                }
+            elif poll["status"] == "failed":
+                return {"success": False, "error": f"Test failed: {result_data.get('error', 'Unknown error')}", "polls": poll["polls"], "bytes": poll["bytes"]}
+            elif poll["status"] == "cancelled":
+                return {"success": False, "error": "Cancelled", "polls": poll["polls"], "bytes": poll["bytes"]}
+            elif poll["status"] == "rejected":
+                return {"success": False, "error": f"HTTP {poll['http_status']}", "polls": poll["polls"], "bytes": poll["bytes"]}
                 
-            return {"success": False, "error": "Timeout"}
+            return {"success": False, "error": "Timeout", "polls": poll["polls"], "bytes": poll["bytes"]}
             
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    def _format_results(self, result_data: Dict, test_type: str, target: str) -> str:
-        results = []
-        
-        for result in result_data.get("results", []):
-            probe = result.get("probe", {})
-            location = f"{probe.get('city', 'Unknown')}, {probe.get('country', 'Unknown')}"
-            
-            if test_type == "ping":
-                stats = result.get("result", {}).get("stats", {})
-                avg_time = stats.get("avg", "N/A")
-                packet_loss = stats.get("loss", "N/A")
-                results.append(f"📍 {location}: {avg_time}ms (потерь: {packet_loss}%)")
-            elif test_type == "http":
-                http_result = result.get("result", {})
-                status = http_result.get("status", "N/A")
-                total_time = http_result.get("timings", {}).get("total", "N/A")
-                results.append(f"📍 {location}: HTTP {status} ({total_time}ms)")
-            elif test_type == "dns":
-                dns_result = result.get("result", {})
-                answers = dns_result.get("answers", [])
-                if answers:
-                    ip = answers[0].get("value", "N/A")
-                    results.append(f"📍 {location}: {ip}")
-                else:
-                    results.append(f"📍 {location}: No DNS response")
-            elif test_type == "traceroute":
-                trace_result = result.get("result", {})
-                hops = trace_result.get("hops", [])
-                if hops:
-                    hop_details = []
-                    for hop_index, hop in enumerate(hops, 1):
-                        hop_num = hop_index  # Используем индекс как номер хопа
-                        timings = hop.get("timings", [])
-                        
-                        if timings:
-                            # Берем первый успешный timing
-                            timing = timings[0]
-                            rtt = timing.get("rtt", "N/A")
-                            
-                            # Получаем IP или hostname из правильных полей
-                            ip_or_host = hop.get("resolvedHostname") or hop.get("resolvedAddress") or "* * *"
-                            
-                            hop_details.append(f"  {hop_num:2}. {ip_or_host} - {rtt}ms")
-                        else:
-                            hop_details.append(f"  {hop_num:2}. * * * (timeout)")
-                    
-                    results.append(f"📍 {location} TRACEROUTE:\n" + "\n".join(hop_details))
-                else:
-                    results.append(f"📍 {location}: Traceroute данные недоступны")
-            elif test_type == "mtr":
-                mtr_result = result.get("result", {})
-                hops = mtr_result.get("hops", [])
-                    
-                if hops:
-                    hop_details = []
-                    for hop_index, hop in enumerate(hops, 1):
-                        hop_num = hop_index  # Используем индекс как номер хопа
-                        stats = hop.get("stats", {})
-                        avg_time = stats.get("avg", "N/A")
-                        packet_loss = stats.get("loss", 0)
-                        
-                        # Получаем IP или hostname из правильных полей
-                        ip_or_host = hop.get("resolvedHostname") or hop.get("resolvedAddress") or "* * *"
-                        
-                        # Форматируем строку хопа
-                        loss_str = f" ({packet_loss}% loss)" if packet_loss > 0 else ""
-                        hop_details.append(f"  {hop_num:2}. {ip_or_host} - {avg_time}ms{loss_str}")
-                    
-                    results.append(f"📍 {location} MTR:\n" + "\n".join(hop_details))
-                else:
-                    results.append(f"📍 {location}: MTR данные недоступны")
-        
-        return f"🌍 *{test_type.upper()}* для `{target}`:\n" + "\n".join(results)
-
     def get_credits(self) -> Dict[str, Any]:
         try:
-            response = self.session.get(f"{self.rest_api_base}/credits")
+            response = self.session.get(f"{self.rest_api_base}/credits", headers=self.headers, timeout=10)
             if response.status_code == 200:
                 return {"success": True, "credits": response.json()}
             else:
@@ -165,6 +119,20 @@ class GlobalpingTokenClient:
         except Exception as e:
             return {"success": False, "error": str(e)}
 
+_clients: Dict[str, GlobalpingTokenClient] = {}
+_clients_lock = threading.Lock()
+
+def get_token_client(api_token: str, scheduler: Optional[GlobalpingScheduler] = None) -> GlobalpingTokenClient:
+    """Возвращает долгоживущий клиент для токена, работающий через общий пул соединений"""
+    with _clients_lock:
+        client = _clients.get(api_token)
+        if client is None:
+            client = GlobalpingTokenClient(api_token, scheduler=scheduler)
+            _clients[api_token] = client
+        elif scheduler is not None:
+            client.scheduler = scheduler
+        return client
+
 def token_ping(api_token: str, target: str, locations: str = "EU") -> str:
     client = GlobalpingTokenClient(api_token)
     result = client.ping(target, locations)
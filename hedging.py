@@ -0,0 +1,244 @@
+"""
+Хеджирование медленных измерений: второй запрос стартует, если первый задерживается дольше обычного
+"""
+
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+# operation(cancel) возвращает (результат, ошибка); ошибка None - успех
+Operation = Callable[[threading.Event], Tuple[Any, Any]]
+
+
+def percentile(samples, q: float) -> Optional[float]:
+    """Перцентиль по ближайшему рангу"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(q * len(ordered)))
+    return ordered[rank - 1]
+
+
+class HedgeStats:
+    """Задержки основных запросов и исходы хеджирования по ключам (типам тестов)"""
+
+    def __init__(self, window: int = 100):
+        self.window = window
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record_latency(self, key: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def latencies(self, key: str):
+        with self._lock:
+            return list(self._latencies.get(key, ()))
+
+    def record(self, key: str, outcome: str):
+        with self._lock:
+            counts = self._counts.setdefault(key, {
+                "requests": 0, "fired": 0, "skipped": 0,
+                "primary_fast": 0, "primary_wins": 0, "hedge_wins": 0, "failed": 0
+            })
+            counts[outcome] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {key: dict(counts) for key, counts in self._counts.items()}
+
+
+class Hedger:
+    """Запускает основной запрос и, если он не завершился за задержку хеджа, - запасной.
+
+    Задержка - перцентиль задержек основных запросов (для не уложившихся в задержку хеджа -
+    нижняя граница) в пределах [min_delay, max_delay]; пока данных меньше min_samples, используется default_delay.
+    Проигравшему выставляется cancel, его результат игнорируется.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.9,
+        min_delay: float = 3.0,
+        max_delay: float = 20.0,
+        default_delay: float = 8.0,
+        min_samples: int = 5,
+        window: int = 100,
+        max_workers: int = 10
+    ):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.stats = HedgeStats(window)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def delay(self, key: str) -> float:
+        samples = self.stats.latencies(key)
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        return min(self.max_delay, max(self.min_delay, percentile(samples, self.percentile)))
+
+    def run(
+        self,
+        key: str,
+        primary: Operation,
+        secondary: Operation,
+        can_hedge: Callable[[], bool] = lambda: True,
+        timeout: Optional[float] = None
+    ) -> Tuple[Any, Any, Optional[str]]:
+        """Возвращает (результат, ошибка, победитель: primary/secondary/None).
+
+        Основной запрос выполняется в потоке вызывающего, поэтому задержка хеджа
+        отсчитывается от его фактического старта; в пул уходят только запасные.
+        Быстрая ошибка основного запроса возвращается как есть - ее обрабатывает
+        политика повторов. Если не успели оба, возвращается ошибка основного.
+        """
+        self.stats.record(key, "requests")
+        started = time.monotonic()
+        cancels = {"primary": threading.Event(), "secondary": threading.Event()}
+        # Спаны запасного запроса должны попасть в отчет вызывающего потока
+        context = contextvars.copy_context()
+        lock = threading.Lock()
+        state: Dict[str, Any] = {"winner": None, "hedge": None, "timed_out": False, "secondary": None}
+
+        def on_secondary(future: Future):
+            with lock:
+                if future.result()[1] is None and state["winner"] is None:
+                    state["winner"] = "secondary"
+                    cancels["primary"].set()
+
+        def hedge():
+            with lock:
+                if state["winner"] is not None or state["hedge"] is not None:
+                    return
+                state["hedge"] = "fired" if can_hedge() else "skipped"
+                self.stats.record(key, state["hedge"])
+                if state["hedge"] == "fired":
+                    state["secondary"] = self._executor.submit(context.run, secondary, cancels["secondary"])
+            if state["secondary"] is not None:
+                state["secondary"].add_done_callback(on_secondary)
+
+        def expire():
+            state["timed_out"] = True
+            for cancel in cancels.values():
+                cancel.set()
+
+        delay = self.delay(key)
+        timers = [threading.Timer(delay, hedge)]
+        if timeout is not None:
+            timers.append(threading.Timer(timeout, expire))
+        for timer in timers:
+            timer.daemon = True
+            timer.start()
+        try:
+            outcome = primary(cancels["primary"])
+        finally:
+            timers[0].cancel()
+        elapsed = time.monotonic() - started
+        primary_timed_out = state["timed_out"]
+
+        with lock:
+            if outcome[1] is None and state["winner"] is None:
+                state["winner"] = "primary"
+            if state["hedge"] is None:
+                # Завершился до задержки хеджа: запасной уже не запустится
+                state["hedge"] = "none"
+        if state["winner"] == "primary":
+            timers[-1].cancel()
+            cancels["secondary"].set()
+            self.stats.record_latency(key, elapsed)
+            if state["hedge"] == "none":
+                self.stats.record(key, "primary_fast")
+            elif state["hedge"] == "fired":
+                self.stats.record(key, "primary_wins")
+            return outcome[0], None, "primary"
+        if state["hedge"] == "none":
+            timers[-1].cancel()
+            return outcome[0], outcome[1], "primary"
+
+        # Основной не уложился в задержку хеджа: его время - нижняя граница задержки,
+        # без нее перцентиль смещается к быстрым ответам
+        self.stats.record_latency(key, elapsed)
+        secondary_outcome = None
+        if state["secondary"] is not None:
+            remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+            try:
+                secondary_outcome = state["secondary"].result(timeout=remaining)
+            except FuturesTimeout:
+                pass
+        timers[-1].cancel()
+        if secondary_outcome is not None and secondary_outcome[1] is None:
+            self.stats.record(key, "hedge_wins")
+            return secondary_outcome[0], None, "secondary"
+
+        for cancel in cancels.values():
+            cancel.set()
+        self.stats.record(key, "failed")
+        if not primary_timed_out:
+            return outcome[0], outcome[1], None
+        result, error = secondary_outcome or (None, "timeout")
+        return result, error, None
+
+    async def run_async(
+        self,
+        key: str,
+        primary: Callable[[], Awaitable[Tuple[Any, Any]]],
+        secondary: Callable[[], Awaitable[Tuple[Any, Any]]],
+        can_hedge: Callable[[], bool] = lambda: True,
+        timeout: Optional[float] = None
+    ) -> Tuple[Any, Any, Optional[str]]:
+        """Асинхронный вариант run: операции - корутинные функции, проигравшая задача отменяется"""
+        self.stats.record(key, "requests")
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        tasks = {asyncio.ensure_future(primary()): "primary"}
+        try:
+            delay = self.delay(key)
+            done, _ = await asyncio.wait(tasks, timeout=delay if timeout is None else min(delay, timeout))
+            if done:
+                result, error = next(iter(done)).result()
+                if error is None:
+                    self.stats.record_latency(key, loop.time() - started)
+                    self.stats.record(key, "primary_fast")
+                return result, error, "primary"
+
+            if can_hedge():
+                self.stats.record(key, "fired")
+                tasks[asyncio.ensure_future(secondary())] = "secondary"
+            else:
+                self.stats.record(key, "skipped")
+
+            outcomes: Dict[str, Tuple[Any, Any]] = {}
+            pending = set(tasks)
+            while pending:
+                remaining = None if timeout is None else timeout - (loop.time() - started)
+                if remaining is not None and remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = tasks[task]
+                    outcomes[name] = task.result()
+                    if outcomes[name][1] is not None:
+                        continue
+                    # Проигравший основной запрос учитывается нижней границей своей задержки
+                    self.stats.record_latency(key, loop.time() - started)
+                    if len(tasks) > 1:
+                        self.stats.record(key, "primary_wins" if name == "primary" else "hedge_wins")
+                    return outcomes[name][0], None, name
+
+            self.stats.record_latency(key, loop.time() - started)
+            self.stats.record(key, "failed")
+            result, error = outcomes.get("primary") or outcomes.get("secondary") or (None, "timeout")
+            return result, error, None
+        finally:
+            for task in tasks:
+                task.cancel()
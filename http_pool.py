@@ -0,0 +1,115 @@
+"""
+Общий HTTP клиент с пулом keep-alive соединений для всех исходящих запросов бота
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+HTTP_POOL_CONFIG = {
+    "pool_connections": int(os.getenv("HTTP_POOL_CONNECTIONS", "10")),
+    "pool_maxsize": int(os.getenv("HTTP_POOL_MAXSIZE", "20")),
+    "pool_block": False
+}
+
+
+class _ConnectionCounter:
+    """Потокобезопасные счетчики открытых соединений и отправленных запросов"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.requests = 0
+
+    def connection_opened(self):
+        with self._lock:
+            self.opened += 1
+
+    def request_sent(self):
+        with self._lock:
+            self.requests += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections_opened": self.opened,
+                "connections_reused": max(0, self.requests - self.opened)
+            }
+
+
+def _counting_pool(base_class, counter: _ConnectionCounter):
+    """Создает класс пула urllib3, который считает новые TCP/TLS соединения"""
+
+    class CountingPool(base_class):
+        def _new_conn(self):
+            counter.connection_opened()
+            return super()._new_conn()
+
+    return CountingPool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter с учетом переиспользования соединений"""
+
+    def __init__(self, counter: _ConnectionCounter, **kwargs):
+        self.counter = counter
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self.counter),
+            "https": _counting_pool(HTTPSConnectionPool, self.counter)
+        }
+
+    def send(self, request, **kwargs):
+        self.counter.request_sent()
+        return super().send(request, **kwargs)
+
+
+class SharedHTTPClient:
+    """Долгоживущая requests.Session с пулом соединений, общая для всех потоков"""
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 20, pool_block: bool = False):
+        self.counter = _ConnectionCounter()
+        self.session = requests.Session()
+        # Заголовок Connection: keep-alive requests выставляет по умолчанию
+        adapter = PooledHTTPAdapter(
+            self.counter,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.session.get(url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.session.post(url, **kwargs)
+
+    def stats(self) -> Dict[str, int]:
+        return self.counter.snapshot()
+
+    def close(self):
+        self.session.close()
+
+
+_shared_client: Optional[SharedHTTPClient] = None
+_shared_client_lock = threading.Lock()
+
+
+def get_http_client() -> SharedHTTPClient:
+    """Возвращает общий для процесса HTTP клиент (создается при первом обращении)"""
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = SharedHTTPClient(**HTTP_POOL_CONFIG)
+    return _shared_client
@@ -66,6 +66,11 @@ if ! command -v python3 &> /dev/null; then
     apt-get update
     apt-get install -y python3 python3-pip python3-venv
 fi
+# Нужен Python 3.10+: типизированные записи Globalping используют dataclass(slots=True)
+if ! python3 -c 'import sys; sys.exit(sys.version_info < (3, 10))'; then
+    log_error "Требуется Python 3.10 или новее, установлен $(python3 --version 2>&1)"
+    exit 1
+fi
 
 # 5. Создаем виртуальное окружение
 log_info "🔧 Создание виртуального окружения..."
@@ -88,6 +93,8 @@ chmod 755 "$INSTALL_DIR/logs"
 # 7. Копируем и устанавливаем systemd service
 log_info "⚙️ Установка systemd service..."
 cp "$CURRENT_DIR/slack-ai-bot.service" "/etc/systemd/system/"
+# Шаблон для нескольких экземпляров (slack-ai-bot@1, slack-ai-bot@2, ...), по умолчанию не включается
+cp "$CURRENT_DIR/slack-ai-bot@.service" "/etc/systemd/system/"
 systemctl daemon-reload
 systemctl enable "$SERVICE_NAME"
 log_success "Systemd service установлен и включен"
@@ -0,0 +1,233 @@
+"""
+Ограниченная очередь диагностических задач с пулом воркеров и справедливостью по каналам
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+
+
+class QueueFull(Exception):
+    """Очередь достигла максимальной глубины"""
+
+
+def _next_round_robin(channels: "OrderedDict[str, Deque[Any]]") -> Any:
+    """Берет задачу из первого канала и переносит канал в конец круга"""
+    channel, jobs = next(iter(channels.items()))
+    item = jobs.popleft()
+    del channels[channel]
+    if jobs:
+        channels[channel] = jobs
+    return item
+
+
+class DiagnosticsQueue:
+    """Фиксированный пул воркеров с очередью на каждый канал.
+
+    Воркеры берут задачи из каналов по кругу, поэтому всплеск сообщений
+    в одном канале не задерживает отчеты в остальных.
+    """
+
+    def __init__(self, workers: int, max_depth: int, name: str = "diagnostics"):
+        self.workers = max(1, workers)
+        self.max_depth = max_depth
+        self.name = name
+        self._channels: "OrderedDict[str, Deque[Tuple[float, Callable[[], Any]]]]" = OrderedDict()
+        self._condition = threading.Condition()
+        self._depth = 0
+        self._active = 0
+        self._stopped = False
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"{name}-{index}", daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, channel: str, job: Callable[[], Any]) -> int:
+        """Ставит задачу в очередь канала и возвращает позицию ожидания (0 - сразу в работу)"""
+        with self._condition:
+            if self._depth >= self.max_depth:
+                self.rejected += 1
+                raise QueueFull(self._depth)
+
+            self._channels.setdefault(channel, deque()).append((time.monotonic(), job))
+            self._depth += 1
+            self.submitted += 1
+            idle = self.workers - self._active
+            position = max(0, self._depth - idle)
+            self._condition.notify()
+            return position
+
+    def _next_job(self) -> Tuple[float, Callable[[], Any]]:
+        self._depth -= 1
+        return _next_round_robin(self._channels)
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._depth and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                enqueued_at, job = self._next_job()
+                self._active += 1
+                waited = time.monotonic() - enqueued_at
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+
+            succeeded = False
+            try:
+                job()
+                succeeded = True
+            except Exception as e:
+                print(f"❌ Ошибка задачи в очереди {self.name}: {e}")
+            finally:
+                with self._condition:
+                    self._active -= 1
+                    if succeeded:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+                    # drain ждет на том же условии
+                    self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            started = self.completed + self.failed + self._active
+            return {
+                "depth": self._depth,
+                "max_depth": self.max_depth,
+                "active": self._active,
+                "workers": self.workers,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+                "wait_avg": round(self._wait_total / started, 3) if started else 0.0,
+                "wait_max": round(self._wait_max, 3),
+                "channels": {channel: len(jobs) for channel, jobs in self._channels.items()}
+            }
+
+    def drain(self, timeout: float) -> bool:
+        """Ждет, пока очередь опустеет и текущие задачи завершатся; False - не успели за timeout"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._depth or self._active:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def shutdown(self, timeout: float = 5):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+class AsyncDiagnosticsQueue:
+    """Очередь для асинхронного режима: те же глубина, круг по каналам и статистика.
+
+    Воркеры - задачи одного цикла событий, поэтому их число ограничивает
+    одновременные отчеты, а не потоки. start() вызывается внутри цикла.
+    """
+
+    def __init__(self, workers: int, max_depth: int, name: str = "diagnostics"):
+        self.workers = max(1, workers)
+        self.max_depth = max_depth
+        self.name = name
+        self._channels: "OrderedDict[str, Deque[Tuple[float, Callable[[], Awaitable[Any]]]]]" = OrderedDict()
+        self._depth = 0
+        self._active = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._ready: asyncio.Semaphore = None
+        self._idle: asyncio.Event = None
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    def start(self):
+        self._ready = asyncio.Semaphore(0)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, channel: str, job: Callable[[], Awaitable[Any]]) -> int:
+        """Ставит корутинную функцию в очередь канала и возвращает позицию ожидания (0 - сразу в работу)"""
+        if self._depth >= self.max_depth:
+            self.rejected += 1
+            raise QueueFull(self._depth)
+
+        self._channels.setdefault(channel, deque()).append((time.monotonic(), job))
+        self._depth += 1
+        self.submitted += 1
+        self._idle.clear()
+        self._ready.release()
+        return max(0, self._depth - (self.workers - self._active))
+
+    async def _worker(self):
+        while True:
+            await self._ready.acquire()
+            enqueued_at, job = _next_round_robin(self._channels)
+            self._depth -= 1
+            self._active += 1
+            waited = time.monotonic() - enqueued_at
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+            succeeded = False
+            try:
+                await job()
+                succeeded = True
+            except Exception as e:
+                print(f"❌ Ошибка задачи в очереди {self.name}: {e}")
+            finally:
+                self._active -= 1
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                if not self._depth and not self._active:
+                    self._idle.set()
+
+    def stats(self) -> Dict[str, Any]:
+        started = self.completed + self.failed + self._active
+        return {
+            "depth": self._depth,
+            "max_depth": self.max_depth,
+            "active": self._active,
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_avg": round(self._wait_total / started, 3) if started else 0.0,
+            "wait_max": round(self._wait_max, 3),
+            "channels": {channel: len(jobs) for channel, jobs in self._channels.items()}
+        }
+
+    async def drain(self, timeout: float) -> bool:
+        """Ждет, пока очередь опустеет и текущие задачи завершатся; False - не успели за timeout"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
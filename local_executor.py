@@ -0,0 +1,149 @@
+"""
+Ограничение одновременных локальных диагностических команд на хосте
+"""
+
+import asyncio
+import os
+import shlex
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
+
+# Сколько процессов каждого вида может работать одновременно во всех отчетах.
+# ping и mtr используют raw-сокеты, поэтому для них лимиты ниже.
+COMMAND_CONCURRENCY_LIMITS = {
+    "ping": 4,
+    "mtr": 2,
+    "traceroute": 2, "tracert": 2,
+    "pathping": 1,
+    "dig": 8, "nslookup": 8,
+    "curl": 6,
+    "default": 4
+}
+
+
+def _load_limits() -> Dict[str, int]:
+    """Применяет переопределения из LOCAL_COMMAND_LIMITS (формат: mtr=1,ping=2)"""
+    limits = dict(COMMAND_CONCURRENCY_LIMITS)
+    for item in os.getenv("LOCAL_COMMAND_LIMITS", "").split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        try:
+            limits[name.strip().lower()] = max(1, int(value))
+        except ValueError:
+            continue
+    return limits
+
+
+class CommandSlotTimeout(Exception):
+    """Не удалось дождаться свободного слота до дедлайна"""
+
+
+class CommandLimiter:
+    """Семафоры на каждый вид команды, общие для всех отчетов процесса"""
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = limits
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self._active: Dict[str, int] = {}
+        self._waiting: Dict[str, int] = {}
+
+    def _kind(self, cmd_name: str) -> str:
+        return cmd_name if cmd_name in self.limits else "default"
+
+    def _semaphore(self, kind: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if kind not in self._semaphores:
+                self._semaphores[kind] = threading.BoundedSemaphore(self.limits[kind])
+            return self._semaphores[kind]
+
+    def _change(self, counters: Dict[str, int], kind: str, delta: int):
+        with self._lock:
+            counters[kind] = counters.get(kind, 0) + delta
+
+    @contextmanager
+    def slot(self, cmd_name: str, deadline: Optional[float] = None) -> Iterator[None]:
+        """Занимает слот для команды; deadline - момент time.monotonic()"""
+        kind = self._kind(cmd_name)
+        semaphore = self._semaphore(kind)
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        self._change(self._waiting, kind, 1)
+        try:
+            acquired = semaphore.acquire(timeout=timeout)
+        finally:
+            self._change(self._waiting, kind, -1)
+        if not acquired:
+            raise CommandSlotTimeout(kind)
+
+        self._change(self._active, kind, 1)
+        try:
+            yield
+        finally:
+            self._change(self._active, kind, -1)
+            semaphore.release()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                kind: {"limit": self.limits[kind], "active": self._active.get(kind, 0), "waiting": self._waiting.get(kind, 0)}
+                for kind in self._semaphores
+            }
+
+
+class AsyncCommandLimiter(CommandLimiter):
+    """Те же лимиты для асинхронного режима: asyncio.Semaphore на вид команды в цикле событий"""
+
+    def _semaphore(self, kind: str) -> asyncio.Semaphore:
+        with self._lock:
+            if kind not in self._semaphores:
+                self._semaphores[kind] = asyncio.Semaphore(self.limits[kind])
+            return self._semaphores[kind]
+
+    @asynccontextmanager
+    async def slot(self, cmd_name: str, deadline: Optional[float] = None) -> AsyncIterator[None]:
+        """Занимает слот для команды; deadline - момент time.monotonic()"""
+        kind = self._kind(cmd_name)
+        semaphore = self._semaphore(kind)
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        self._change(self._waiting, kind, 1)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise CommandSlotTimeout(kind)
+        finally:
+            self._change(self._waiting, kind, -1)
+
+        self._change(self._active, kind, 1)
+        try:
+            yield
+        finally:
+            self._change(self._active, kind, -1)
+            semaphore.release()
+
+
+async def run_process_async(command: str, timeout: float, encoding: str = "utf-8") -> Optional[Tuple[int, str, str]]:
+    """Запускает команду без оболочки; (код, stdout, stderr) или None по таймауту (процесс убивается)"""
+    proc = await asyncio.create_subprocess_exec(
+        *shlex.split(command),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return None
+    except asyncio.CancelledError:
+        # Этап завершился по общему лимиту: процесс не должен пережить отмененную задачу
+        proc.kill()
+        raise
+    return proc.returncode, stdout.decode(encoding, "replace"), stderr.decode(encoding, "replace")
+
+
+command_limiter = CommandLimiter(_load_limits())
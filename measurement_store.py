@@ -0,0 +1,303 @@
+"""
+История измерений в SQLite и изменения относительно последнего исправного запуска
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+HISTORY_DEFAULTS = {
+    # Сдвиг задержки считается изменением, если он больше rtt_shift мс и rtt_ratio от базовой
+    "rtt_shift": 20.0,
+    "rtt_ratio": 0.5,
+    # Изменение потерь, в процентных пунктах
+    "loss_shift": 10.0,
+    # Запуск не считается исправным при потерях от этого процента
+    "unhealthy_loss": 20.0
+}
+
+_STATUS_RE = re.compile(r"\b\d{3}\b")
+
+
+def _country(location: str) -> str:
+    """Пробы Globalping выбираются заново при каждом запуске: сравниваем по стране"""
+    return location.rsplit(",", 1)[-1].strip()
+
+
+def _mean(values: List[float]) -> Optional[float]:
+    return round(sum(values) / len(values), 1) if values else None
+
+
+def _path_hosts(item: Dict[str, Any]) -> List[str]:
+    hosts = [hop.get("host") for hop in item.get("notable", [])] + [item.get("final", {}).get("host")]
+    return sorted({host for host in hosts if host})
+
+
+def _globalping_facts(test_type: str, probes: List[Dict[str, Any]]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    if test_type == "dns":
+        answers = sorted({probe["answer"] for probe in probes if "error" not in probe and probe.get("answer")})
+        yield "globalping dns", {"answers": answers}
+        return
+    by_country: Dict[str, List[Dict[str, Any]]] = {}
+    for probe in probes:
+        by_country.setdefault(_country(probe.get("location", "")), []).append(probe)
+    for country, items in by_country.items():
+        ok = [item for item in items if "error" not in item]
+        facts: Dict[str, Any] = {"error": len(ok) < len(items) and not ok}
+        if test_type == "ping":
+            facts["rtt"] = _mean([item["avg"] for item in ok if item.get("avg") is not None])
+            facts["loss"] = max((item["loss"] for item in ok if item.get("loss") is not None), default=None)
+        elif test_type == "http":
+            facts["status"] = " / ".join(sorted({str(item.get("status")) for item in ok})) or None
+            facts["rtt"] = _mean([item["total"] for item in ok if item.get("total") is not None])
+        else:
+            facts["hops"] = sorted({host for item in ok for host in _path_hosts(item)})
+            facts["final"] = " / ".join(sorted({item.get("final", {}).get("host") or "*" for item in ok})) or None
+        yield f"globalping {test_type} {country}", facts
+
+
+def _local_facts(item: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    kind = item.get("kind")
+    facts: Dict[str, Any] = {"error": item.get("error")}
+    if kind == "ping":
+        facts.update({"rtt": item.get("avg"), "loss": item.get("loss")})
+    elif kind in ("dns", "dns_soa"):
+        facts["answers"] = sorted(item.get("answers", []))
+    elif kind == "curl":
+        facts.update({"status": " → ".join(item.get("statuses", [])) or None, "tls": item.get("tls")})
+    elif "hops" in item:
+        facts.update({"hops": _path_hosts(item), "final": item.get("final", {}).get("host")})
+    return f"local {kind}", facts
+
+
+def summary_facts(summary: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Сравнимые признаки сводки compact_results, сгруппированные по тесту и стране пробы"""
+    facts: Dict[str, Dict[str, Any]] = {}
+    for test_type, probes in summary.get("globalping", {}).items():
+        facts.update(_globalping_facts(test_type, probes))
+    for item in summary.get("local", []):
+        key, values = _local_facts(item)
+        facts[key] = values
+    return facts
+
+
+def is_healthy(summary: Dict[str, Any], config: Optional[Dict[str, float]] = None) -> bool:
+    """Исправный запуск: нет ошибок тестов, HTTP статусы ниже 400 и потери ниже порога"""
+    config = {**HISTORY_DEFAULTS, **(config or {})}
+    if summary.get("errors"):
+        return False
+    for key, facts in summary_facts(summary).items():
+        if facts.get("error"):
+            return False
+        loss = facts.get("loss")
+        if loss is not None and loss >= config["unhealthy_loss"]:
+            return False
+        if "status" in facts:
+            # Цепочка редиректов curl или статусы проб одной страны
+            codes = _STATUS_RE.findall(facts["status"] or "")
+            if not codes or any(int(code) >= 400 for code in codes):
+                return False
+    return True
+
+
+def _fmt(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:g}"
+    return "нет" if value is None else str(value)
+
+
+def diff_facts(
+    baseline: Dict[str, Dict[str, Any]],
+    current: Dict[str, Dict[str, Any]],
+    config: Optional[Dict[str, float]] = None
+) -> List[str]:
+    """Изменения признаков: смена статуса, новые и пропавшие хопы и ответы, сдвиги задержки и потерь.
+
+    Сравниваются только группы, которые есть в обоих запусках.
+    """
+    config = {**HISTORY_DEFAULTS, **(config or {})}
+    changes: List[str] = []
+    for key in current:
+        if key not in baseline:
+            continue
+        old, new = baseline[key], current[key]
+        if bool(old.get("error")) != bool(new.get("error")):
+            changes.append(f"[{key}] ошибка: {_fmt(new.get('error')) if new.get('error') else 'исчезла'}")
+            continue
+        for field in ("status", "final", "tls"):
+            if field in new and old.get(field) != new.get(field):
+                changes.append(f"[{key}] {field}: {_fmt(old.get(field))} → {_fmt(new.get(field))}")
+        for field in ("answers", "hops"):
+            added = sorted(set(new.get(field) or ()) - set(old.get(field) or ()))
+            removed = sorted(set(old.get(field) or ()) - set(new.get(field) or ()))
+            if added:
+                changes.append(f"[{key}] новые {'ответы' if field == 'answers' else 'хопы'}: {', '.join(added)}")
+            if removed:
+                changes.append(f"[{key}] пропали {'ответы' if field == 'answers' else 'хопы'}: {', '.join(removed)}")
+        rtt_old, rtt_new = old.get("rtt"), new.get("rtt")
+        if rtt_old is not None and rtt_new is not None:
+            if abs(rtt_new - rtt_old) >= max(config["rtt_shift"], rtt_old * config["rtt_ratio"]):
+                changes.append(f"[{key}] rtt: {_fmt(rtt_old)} → {_fmt(rtt_new)}ms")
+        loss_old, loss_new = old.get("loss"), new.get("loss")
+        if loss_old is not None and loss_new is not None and abs(loss_new - loss_old) >= config["loss_shift"]:
+            changes.append(f"[{key}] loss: {_fmt(loss_old)} → {_fmt(loss_new)}%")
+    return changes
+
+
+class Delta(NamedTuple):
+    """Изменения относительно последнего исправного запуска; без базы baseline_age None"""
+    baseline_age: Optional[float]
+    changes: List[str]
+
+
+def render_delta(delta: Delta, target: Optional[str] = None) -> str:
+    """Текст изменений для Slack; пустая строка, если сравнивать не с чем"""
+    if delta.baseline_age is None:
+        return ""
+    age = int(delta.baseline_age)
+    when = f"{age // 3600}ч назад" if age >= 3600 else f"{age // 60}мин назад"
+    where = f" `{target}`" if target else ""
+    if not delta.changes:
+        return f"📈 *Без изменений*{where} относительно последнего исправного состояния ({when})"
+    return f"📈 *Изменения*{where} относительно последнего исправного состояния ({when}):\n" + "\n".join(
+        f"• {change}" for change in delta.changes
+    )
+
+
+class MeasurementStore:
+    """История разобранных результатов по запускам с хранением по сроку и числу запусков на цель"""
+
+    def __init__(
+        self,
+        path: str,
+        retention: float = 30 * 86400,
+        max_runs: int = 200,
+        compact_every: int = 100,
+        config: Optional[Dict[str, float]] = None
+    ):
+        self.path = path
+        self.retention = retention
+        self.max_runs = max_runs
+        self.compact_every = compact_every
+        self.config = {**HISTORY_DEFAULTS, **(config or {})}
+        self.recorded = 0
+        self.baselines = 0
+        self._since_prune = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                target TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                healthy INTEGER NOT NULL,
+                facts TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                run_id INTEGER NOT NULL,
+                target TEXT NOT NULL,
+                test_type TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                data TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_target ON runs(target, healthy, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_created ON runs(created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_target ON results(target, test_type, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_run ON results(run_id)")
+        self._conn.commit()
+
+    def record(self, target: str, summary: Dict[str, Any], created_at: Optional[float] = None) -> int:
+        """Сохраняет сводку запуска: по строке на тест Globalping и локальную команду"""
+        now = time.time() if created_at is None else created_at
+        healthy = is_healthy(summary, self.config)
+        rows = [(f"globalping:{test_type}", probes) for test_type, probes in summary.get("globalping", {}).items()]
+        rows += [(f"local:{item.get('kind')}", item) for item in summary.get("local", [])]
+        if summary.get("errors"):
+            rows.append(("errors", summary["errors"]))
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (target, created_at, healthy, facts) VALUES (?, ?, ?, ?)",
+                (target, now, int(healthy), json.dumps(summary_facts(summary), ensure_ascii=False))
+            )
+            run_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO results (run_id, target, test_type, created_at, data) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, target, test_type, now, json.dumps(data, ensure_ascii=False)) for test_type, data in rows]
+            )
+            self.recorded += 1
+            self._since_prune += 1
+            if self._since_prune >= self.compact_every:
+                self._prune(now)
+            self._conn.commit()
+        return run_id
+
+    def baseline(self, target: str) -> Optional[Tuple[float, Dict[str, Dict[str, Any]]]]:
+        """(время, признаки) последнего исправного запуска цели или None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at, facts FROM runs WHERE target = ? AND healthy = 1 AND created_at >= ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (target, time.time() - self.retention)
+            ).fetchone()
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def delta(self, target: str, summary: Dict[str, Any]) -> Delta:
+        """Изменения сводки относительно последнего исправного запуска цели"""
+        baseline = self.baseline(target)
+        if baseline is None:
+            return Delta(None, [])
+        self.baselines += 1
+        created_at, facts = baseline
+        return Delta(max(0.0, time.time() - created_at), diff_facts(facts, summary_facts(summary), self.config))
+
+    def history(self, target: str, test_type: str, since: float = 0.0, limit: int = 50) -> List[Tuple[float, Any]]:
+        """Последние результаты одного теста цели, новые первыми: [(время, данные)]"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT created_at, data FROM results WHERE target = ? AND test_type = ? AND created_at >= ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (target, test_type, since, limit)
+            ).fetchall()
+        return [(created_at, json.loads(data)) for created_at, data in rows]
+
+    def _prune(self, now: float) -> int:
+        self._since_prune = 0
+        deleted = self._conn.execute("DELETE FROM runs WHERE created_at < ?", (now - self.retention,)).rowcount
+        deleted += self._conn.execute(
+            """DELETE FROM runs WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY target ORDER BY created_at DESC) AS position FROM runs
+                ) WHERE position > ?
+            )""",
+            (self.max_runs,)
+        ).rowcount
+        if deleted:
+            self._conn.execute("DELETE FROM results WHERE run_id NOT IN (SELECT id FROM runs)")
+        return deleted
+
+    def compact(self) -> int:
+        """Удаляет устаревшие запуски и освобождает место в файле; возвращает число удаленных запусков"""
+        with self._lock:
+            deleted = self._prune(time.time())
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            runs, healthy = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(healthy), 0) FROM runs").fetchone()
+            return {"runs": runs, "healthy": healthy, "recorded": self.recorded, "baselines": self.baselines}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
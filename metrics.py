@@ -0,0 +1,371 @@
+"""
+Трассировка этапов диагностики: гистограммы длительностей в формате Prometheus и JSON лог отчетов
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Границы корзин (сек): от быстрых DNS проб до mtr и генерации AI заключения
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    """Кумулятивная гистограмма с метками, как в Prometheus"""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: Dict[LabelKey, Dict[str, Any]] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def quantile(self, q: float, **labels: Any) -> Optional[float]:
+        """Оценка квантиля по корзинам с линейной интерполяцией, как histogram_quantile"""
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            if not series or not series["count"]:
+                return None
+            rank = q * series["count"]
+            lower, previous = 0.0, 0
+            for bound, cumulative in zip(self.buckets, series["counts"]):
+                if cumulative >= rank:
+                    inside = cumulative - previous
+                    return lower + (bound - lower) * ((rank - previous) / inside if inside else 1.0)
+                lower, previous = bound, cumulative
+            return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+def _metric_name(key: Any) -> str:
+    return "".join(char if char.isalnum() else "_" for char in str(key)).strip("_").lower()
+
+
+def _flatten(prefix: str, value: Any, labels: Optional[Dict[str, str]] = None) -> Iterator[Tuple[str, LabelKey, float]]:
+    """Разворачивает вложенный словарь статистики в числовые метрики.
+
+    Словари из labels (ключ статистики → имя метки) отдаются одной метрикой с меткой,
+    а не отдельным именем на каждый ключ: их ключи - данные (например, id каналов Slack).
+    """
+    labels = labels or {}
+    if isinstance(value, bool):
+        yield prefix, (), float(value)
+    elif isinstance(value, (int, float)):
+        yield prefix, (), float(value)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            name = _metric_name(key)
+            metric = f"{prefix}_{name}" if name else prefix
+            if key in labels and isinstance(item, dict):
+                for label_value, number in item.items():
+                    if isinstance(number, (int, float)):
+                        yield metric, _label_key({labels[key]: label_value}), float(number)
+            else:
+                yield from _flatten(metric, item, labels)
+
+
+class MetricsRegistry:
+    """Метрики этапов и снимки существующих счетчиков (пул HTTP, кеши, очередь) для /metrics"""
+
+    def __init__(self, namespace: str = "slackbot", buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.stage_duration = Histogram(f"{namespace}_stage_duration_seconds", "Длительность этапов и попыток диагностики", buckets)
+        self.stage_attempts = Counter(f"{namespace}_stage_attempts_total", "Число попыток (спанов *.attempt) по этапам")
+        self.stage_bytes = Counter(f"{namespace}_stage_bytes_total", "Байт получено по этапам")
+        self.reports = Counter(f"{namespace}_reports_total", "Завершенные отчеты по исходу")
+        self._collectors: Dict[str, Tuple[Callable[[], Dict[str, Any]], Dict[str, str]]] = {}
+        self._lock = threading.Lock()
+
+    def add_collector(self, name: str, collect: Callable[[], Dict[str, Any]], labels: Optional[Dict[str, str]] = None):
+        """Регистрирует функцию stats(), числа из которой отдаются как gauge.
+
+        labels - вложенные словари, ключи которых становятся значением метки (см. _flatten).
+        """
+        with self._lock:
+            self._collectors[name] = (collect, labels or {})
+
+    def record_span(self, span: "Span"):
+        labels = {"stage": span.stage, "outcome": span.outcome}
+        self.stage_duration.observe(span.duration, **labels)
+        if span.stage.endswith(".attempt"):
+            self.stage_attempts.inc(1, stage=span.stage)
+        if span.bytes:
+            self.stage_bytes.inc(span.bytes, stage=span.stage)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in (self.stage_duration, self.stage_attempts, self.stage_bytes, self.reports):
+            lines.extend(metric.render())
+        with self._lock:
+            collectors = list(self._collectors.items())
+        for name, (collect, labels) in collectors:
+            try:
+                values = list(_flatten(f"{self.namespace}_{name}", collect(), labels))
+            except Exception as e:
+                lines.append(f"# {name}: ошибка сбора: {e}")
+                continue
+            typed = set()
+            for metric, label_key, value in values:
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric}{_format_labels(label_key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+_current_report: contextvars.ContextVar[Optional["ReportTrace"]] = contextvars.ContextVar("current_report", default=None)
+
+
+class Span:
+    """Один этап, тест или попытка: длительность, исход, номер попытки и объем данных"""
+
+    __slots__ = ("stage", "attrs", "started", "duration", "outcome", "attempt", "bytes", "report", "finished")
+
+    def __init__(self, stage: str, attempt: int = 1, **attrs: Any):
+        self.stage = stage
+        self.attrs = attrs
+        self.started = time.monotonic()
+        self.duration = 0.0
+        self.outcome = "ok"
+        self.attempt = attempt
+        self.bytes = 0
+        # Отчет запоминается при создании: завершиться спан может в другом потоке
+        self.report = _current_report.get()
+        self.finished = False
+
+    def set(self, outcome: Optional[str] = None, bytes: Optional[int] = None, **attrs: Any):
+        if outcome is not None:
+            self.outcome = outcome
+        if bytes is not None:
+            self.bytes = bytes
+        self.attrs.update(attrs)
+
+    def finish(self, outcome: Optional[str] = None, bytes: Optional[int] = None, registry: "MetricsRegistry" = None, **attrs: Any):
+        """Завершает спан и записывает его; повторные вызовы игнорируются"""
+        if self.finished:
+            return
+        self.finished = True
+        self.set(outcome, bytes, **attrs)
+        self.duration = time.monotonic() - self.started
+        (registry or metrics).record_span(self)
+        if self.report is not None:
+            self.report.add(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stage": self.stage,
+            "duration": round(self.duration, 3),
+            "outcome": self.outcome,
+            "attempt": self.attempt,
+            "bytes": self.bytes,
+            **self.attrs
+        }
+
+
+class ReportTrace:
+    """Все спаны одного отчета; по завершении пишется одной JSON строкой"""
+
+    def __init__(self, target: str, **attrs: Any):
+        self.id = uuid.uuid4().hex[:12]
+        self.target = target
+        self.attrs = attrs
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.spans: List[Span] = []
+        # Суммы за отчет (например, потраченные кредиты), пишутся вместе со спанами
+        self.counters: Dict[str, float] = {}
+        # Ошибка, перехваченная внутри отчета, не доходит до report_trace
+        self.failed = False
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def count(self, name: str, amount: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def fail(self):
+        """Помечает отчет как завершенный с ошибкой"""
+        self.failed = True
+
+    def to_dict(self, outcome: str) -> Dict[str, Any]:
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+            counters = dict(self.counters)
+        record = {
+            "report_id": self.id,
+            "target": self.target,
+            "started_at": round(self.started_at, 3),
+            "duration": round(time.monotonic() - self.started, 3),
+            "outcome": outcome,
+            **self.attrs,
+            "spans": spans
+        }
+        if counters:
+            record["counters"] = counters
+        return record
+
+
+@contextmanager
+def span(stage: str, attempt: int = 1, registry: MetricsRegistry = None, **attrs: Any) -> Iterator[Span]:
+    """Измеряет блок кода; исключение помечает спан как error и пробрасывается дальше"""
+    current = Span(stage, attempt=attempt, **attrs)
+    try:
+        yield current
+    except BaseException:
+        current.outcome = "error"
+        raise
+    finally:
+        current.finish(registry=registry)
+
+
+@contextmanager
+def report_trace(
+    target: str,
+    log_path: Optional[str] = None,
+    registry: MetricsRegistry = None,
+    **attrs: Any
+) -> Iterator[ReportTrace]:
+    """Делает отчет текущим для спанов этого потока и задач, запущенных через run_ordered"""
+    registry = registry or metrics
+    report = ReportTrace(target, **attrs)
+    token = _current_report.set(report)
+    outcome = "ok"
+    try:
+        yield report
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        _current_report.reset(token)
+        if report.failed:
+            outcome = "error"
+        total = Span("report")
+        total.started = report.started
+        total.duration = time.monotonic() - report.started
+        total.outcome = outcome
+        registry.record_span(total)
+        registry.reports.inc(1, outcome=outcome)
+        if log_path:
+            write_report_log(log_path, report.to_dict(outcome))
+
+
+def current_report() -> Optional[ReportTrace]:
+    return _current_report.get()
+
+
+_log_lock = threading.Lock()
+
+
+def write_report_log(path: str, record: Dict[str, Any]):
+    """Дописывает одну JSON строку на отчет"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+    with _log_lock:
+        with open(path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = metrics
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Не засоряем вывод бота запросами скрейпера
+        pass
+
+
+def start_metrics_server(host: str, port: int, registry: MetricsRegistry = None) -> ThreadingHTTPServer:
+    """Поднимает /metrics в фоновом потоке"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry or metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,325 @@
+"""
+Встроенные сетевые пробы без запуска процессов: DNS по UDP, TCP connect, TLS + HTTP HEAD
+"""
+
+import ipaddress
+import random
+import socket
+import ssl
+import struct
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Префикс, по которому локальные проверки отличаются от shell-команд
+NATIVE_PREFIX = "native-"
+
+QTYPES = {"A": 1, "NS": 2, "CNAME": 5, "SOA": 6, "AAAA": 28}
+RCODES = {0: "NOERROR", 1: "FORMERR", 2: "SERVFAIL", 3: "NXDOMAIN", 4: "NOTIMP", 5: "REFUSED"}
+
+
+class ProbeError(Exception):
+    """Ошибка сетевой пробы с понятным описанием"""
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+def system_nameserver(default: str = "8.8.8.8") -> str:
+    """Первый DNS сервер из /etc/resolv.conf или значение по умолчанию"""
+    try:
+        with open("/etc/resolv.conf", encoding="utf-8") as resolv:
+            for line in resolv:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    return parts[1]
+    except OSError:
+        pass
+    return default
+
+
+def _encode_name(name: str) -> bytes:
+    encoded = b""
+    for label in name.rstrip(".").split("."):
+        raw = label.encode("idna")
+        if not raw or len(raw) > 63:
+            raise ProbeError(f"Некорректное имя: {name}")
+        encoded += bytes([len(raw)]) + raw
+    return encoded + b"\x00"
+
+
+def build_dns_query(name: str, qtype: str, query_id: int) -> bytes:
+    """Собирает DNS запрос с флагом рекурсии"""
+    header = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0)
+    return header + _encode_name(name) + struct.pack("!HH", QTYPES[qtype], 1)
+
+
+def _read_name(packet: bytes, offset: int) -> Tuple[str, int]:
+    """Читает имя с учетом сжатия, возвращает (имя, смещение после имени)"""
+    labels: List[str] = []
+    end_offset = None
+    for _ in range(128):
+        length = packet[offset]
+        if length & 0xC0 == 0xC0:
+            if end_offset is None:
+                end_offset = offset + 2
+            offset = ((length & 0x3F) << 8) | packet[offset + 1]
+            continue
+        if length == 0:
+            offset += 1
+            break
+        labels.append(packet[offset + 1:offset + 1 + length].decode("ascii", "replace"))
+        offset += 1 + length
+    else:
+        raise ProbeError("Цикл сжатия имен в ответе DNS")
+    return ".".join(labels) + ".", end_offset if end_offset is not None else offset
+
+
+def parse_dns_response(packet: bytes, query_id: int) -> Dict[str, Any]:
+    """Разбирает ответ DNS: код ответа и записи секции answer"""
+    if len(packet) < 12:
+        raise ProbeError("Слишком короткий ответ DNS")
+    response_id, flags, qdcount, ancount, _, _ = struct.unpack("!HHHHHH", packet[:12])
+    if response_id != query_id:
+        raise ProbeError("ID ответа DNS не совпадает с запросом")
+
+    # Усеченный или поврежденный ответ не должен ронять пробу исключением разбора
+    try:
+        offset = 12
+        for _ in range(qdcount):
+            _, offset = _read_name(packet, offset)
+            offset += 4
+
+        answers = []
+        for _ in range(ancount):
+            _, offset = _read_name(packet, offset)
+            rtype, _, ttl, rdlength = struct.unpack("!HHIH", packet[offset:offset + 10])
+            offset += 10
+            rdata = packet[offset:offset + rdlength]
+            if rtype == QTYPES["A"] and rdlength == 4:
+                value = socket.inet_ntoa(rdata)
+            elif rtype == QTYPES["AAAA"] and rdlength == 16:
+                value = socket.inet_ntop(socket.AF_INET6, rdata)
+            elif rtype in (QTYPES["CNAME"], QTYPES["NS"]):
+                value = _read_name(packet, offset)[0]
+            elif rtype == QTYPES["SOA"]:
+                mname, position = _read_name(packet, offset)
+                rname, position = _read_name(packet, position)
+                serial, refresh, retry, expire, minimum = struct.unpack("!IIIII", packet[position:position + 20])
+                value = f"{mname} {rname} {serial} {refresh} {retry} {expire} {minimum}"
+            else:
+                value = rdata.hex()
+            answers.append({"type": rtype, "ttl": ttl, "value": value})
+            offset += rdlength
+    except (struct.error, IndexError, ValueError) as e:
+        raise ProbeError(f"Некорректный ответ DNS: {e}")
+
+    return {
+        "rcode": RCODES.get(flags & 0x000F, str(flags & 0x000F)),
+        "truncated": bool(flags & 0x0200),
+        "answers": answers
+    }
+
+
+def dns_query(name: str, qtype: str = "A", server: Optional[str] = None, port: int = 53, timeout: float = 3.0) -> Dict[str, Any]:
+    """DNS запрос по UDP с замером времени ответа"""
+    server = server or system_nameserver()
+    query_id = random.randint(0, 0xFFFF)
+    query = build_dns_query(name, qtype, query_id)
+    family = socket.AF_INET6 if ":" in server else socket.AF_INET
+
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        started = time.monotonic()
+        try:
+            sock.sendto(query, (server, port))
+            packet, _ = sock.recvfrom(4096)
+        except socket.timeout:
+            raise ProbeError(f"DNS сервер {server} не ответил за {timeout}с")
+        except OSError as e:
+            raise ProbeError(f"DNS сервер {server}: {e}")
+        elapsed = time.monotonic() - started
+
+    result = parse_dns_response(packet, query_id)
+    result.update({"server": server, "qtype": qtype, "time_ms": _ms(elapsed)})
+    return result
+
+
+def tcp_connect(host: str, port: int, timeout: float = 5.0) -> Dict[str, Any]:
+    """Время резолва и установки TCP соединения"""
+    started = time.monotonic()
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ProbeError(f"Не удалось разрешить {host}: {e}")
+    resolved = time.monotonic()
+
+    family, socktype, proto, _, address = infos[0]
+    sock = socket.socket(family, socktype, proto)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except OSError as e:
+        sock.close()
+        raise ProbeError(f"TCP {address[0]}:{port}: {e}")
+    connected = time.monotonic()
+    sock.close()
+    return {"ip": address[0], "port": port, "dns_ms": _ms(resolved - started), "connect_ms": _ms(connected - resolved)}
+
+
+def http_head(url: str, timeout: float = 10.0, verify: bool = True) -> Dict[str, Any]:
+    """HEAD запрос с раздельными таймингами DNS, TCP, TLS и первого байта.
+
+    Для замера рукопожатия соединение всегда новое.
+    """
+    parts = urlsplit(url if "://" in url else f"http://{url}")
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ""
+    port = parts.port or (443 if scheme == "https" else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += f"?{parts.query}"
+
+    started = time.monotonic()
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ProbeError(f"Не удалось разрешить {host}: {e}")
+    resolved = time.monotonic()
+
+    family, socktype, proto, _, address = infos[0]
+    sock = socket.socket(family, socktype, proto)
+    sock.settimeout(timeout)
+    result: Dict[str, Any] = {"host": host, "ip": address[0], "port": port, "dns_ms": _ms(resolved - started)}
+    try:
+        sock.connect(address)
+        connected = time.monotonic()
+        result["connect_ms"] = _ms(connected - resolved)
+
+        if scheme == "https":
+            context = ssl.create_default_context()
+            if not verify:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            try:
+                sock = context.wrap_socket(sock, server_hostname=host)
+            except ssl.SSLCertVerificationError as e:
+                raise ProbeError(f"SSL certificate problem: {e.verify_message}")
+            except ssl.SSLError as e:
+                raise ProbeError(f"TLS handshake: {e}")
+            handshaken = time.monotonic()
+            result["tls_ms"] = _ms(handshaken - connected)
+            result["tls_version"] = sock.version()
+            result["cipher"] = (sock.cipher() or ("",))[0]
+            certificate = sock.getpeercert() or {}
+            if certificate.get("notAfter"):
+                result["cert_expire"] = certificate["notAfter"]
+        else:
+            handshaken = connected
+
+        host_header = host if port in (80, 443) else f"{host}:{port}"
+        if ":" in host and not host.startswith("["):
+            host_header = f"[{host}]" if port in (80, 443) else f"[{host}]:{port}"
+        request = (
+            f"HEAD {path} HTTP/1.1\r\nHost: {host_header}\r\n"
+            f"User-Agent: slack-ai-bot-probe\r\nAccept: */*\r\nConnection: close\r\n\r\n"
+        )
+        sock.sendall(request.encode("ascii"))
+
+        response = b""
+        while b"\r\n\r\n" not in response:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            if not response:
+                result["ttfb_ms"] = _ms(time.monotonic() - handshaken)
+            response += chunk
+        result["total_ms"] = _ms(time.monotonic() - started)
+    except socket.timeout:
+        raise ProbeError(f"Таймаут {timeout}с при запросе {url}")
+    except OSError as e:
+        raise ProbeError(f"{address[0]}:{port}: {e}")
+    finally:
+        sock.close()
+
+    head = response.split(b"\r\n\r\n", 1)[0].decode("iso-8859-1")
+    lines = head.split("\r\n")
+    if not lines or not lines[0].startswith("HTTP/"):
+        raise ProbeError("Сервер не вернул HTTP ответ")
+    result["status_line"] = lines[0]
+    result["status"] = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    result["headers"] = {name: headers[name] for name in ("server", "location", "content-type") if name in headers}
+    return result
+
+
+def native_commands(target: str, domain: str) -> List[str]:
+    """Встроенные аналоги dig SOA, dig, telnet host port и curl -I для цели"""
+    parts = urlsplit(target if "//" in target else f"//{target}")
+    try:
+        port = parts.port or (80 if parts.scheme == "http" else 443)
+    except ValueError:
+        port = 443
+    checks = [f"{NATIVE_PREFIX}tcp {domain} {port}", f"{NATIVE_PREFIX}http {target}"]
+    try:
+        ipaddress.ip_address(domain)
+    except ValueError:
+        checks = [f"{NATIVE_PREFIX}dns {domain} SOA", f"{NATIVE_PREFIX}dns {domain} A"] + checks
+    return checks
+
+
+def is_native_command(command: str) -> bool:
+    return command.startswith(NATIVE_PREFIX)
+
+
+def run_native_command(command: str, timeout: float = 10.0, dns_server: Optional[str] = None, dns_port: int = 53) -> str:
+    """Выполняет встроенную пробу и возвращает текст в стиле вывода dig/curl -v"""
+    kind, *args = command[len(NATIVE_PREFIX):].split()
+    try:
+        if kind == "dns":
+            name, qtype = args[0], (args[1] if len(args) > 1 else "A")
+            if qtype == "SOA":
+                # SOA ищем для зоны: поднимаемся по домену, пока сервер не вернет запись
+                labels = name.rstrip(".").split(".")
+                for index in range(len(labels) - 1):
+                    result = dns_query(".".join(labels[index:]), "SOA", server=dns_server, port=dns_port, timeout=min(timeout, 3.0))
+                    if any(answer["type"] == QTYPES["SOA"] for answer in result["answers"]):
+                        break
+            else:
+                result = dns_query(name, qtype, server=dns_server, port=dns_port, timeout=min(timeout, 3.0))
+            lines = [answer["value"] for answer in result["answers"] if answer["type"] == QTYPES[qtype]]
+            if result["rcode"] != "NOERROR":
+                return f"❌ DNS {qtype} {name}: {result['rcode']} (сервер {result['server']}, {result['time_ms']}ms)"
+            lines.append(f";; {result['rcode']}, сервер {result['server']}, время {result['time_ms']}ms")
+            return "\n".join(lines)
+
+        if kind == "tcp":
+            host, port = args[0], int(args[1])
+            result = tcp_connect(host, port, timeout=timeout)
+            return f"* Connected to {host} ({result['ip']}) port {port}\n* timings: dns={result['dns_ms']}ms connect={result['connect_ms']}ms"
+
+        if kind == "http":
+            result = http_head(args[0], timeout=timeout)
+            lines = [f"* Connected to {result['host']} ({result['ip']}) port {result['port']}"]
+            if "tls_version" in result:
+                lines.append(f"* SSL connection using {result['tls_version']} / {result['cipher']}")
+            if "cert_expire" in result:
+                lines.append(f"*  expire date: {result['cert_expire']}")
+            timings = " ".join(
+                f"{name}={result[f'{name}_ms']}ms" for name in ("dns", "connect", "tls", "ttfb", "total") if f"{name}_ms" in result
+            )
+            lines.append(f"* timings: {timings}")
+            lines.append(result["status_line"])
+            lines.extend(f"{name}: {value}" for name, value in result["headers"].items())
+            return "\n".join(lines)
+
+        return f"❌ Неизвестная встроенная проба: {kind}"
+    except ProbeError as e:
+        return f"❌ {e}"
+    except (IndexError, ValueError) as e:
+        return f"❌ Некорректная проба {command}: {e}"
@@ -0,0 +1,128 @@
+"""
+Параллельное выполнение диагностических задач с сохранением порядка результатов
+"""
+
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+
+def run_ordered(
+    tasks: Sequence[Tuple[str, Callable[[], Any]]],
+    max_workers: int,
+    deadline: Optional[float] = None,
+    on_timeout: Optional[Callable[[str], Any]] = None,
+    on_error: Optional[Callable[[str, Exception], Any]] = None,
+    on_result: Optional[Callable[[str, Any], None]] = None,
+) -> List[Any]:
+    """Запускает задачи параллельно и возвращает результаты в исходном порядке.
+
+    tasks - список пар (имя, функция без аргументов); deadline - общий лимит
+    времени на весь этап в секундах. Задачи, не уложившиеся в лимит,
+    получают результат on_timeout(имя). on_result(имя, результат) вызывается
+    сразу по завершении каждой задачи.
+    """
+    results: List[Any] = [None] * len(tasks)
+    if not tasks:
+        return results
+
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks))))
+    # Задачи выполняются в контексте вызывающего потока (например, текущий отчет для трассировки)
+    futures = {executor.submit(contextvars.copy_context().run, func): index for index, (_, func) in enumerate(tasks)}
+    pending = set(futures)
+
+    try:
+        while pending:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
+
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                name = tasks[index][0]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    results[index] = on_error(name, e) if on_error else f"❌ {name}: {e}"
+                if on_result:
+                    on_result(name, results[index])
+    finally:
+        # Не ждем зависшие задачи: их результат уже не попадет в отчет
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for future in pending:
+        index = futures[future]
+        name = tasks[index][0]
+        results[index] = on_timeout(name) if on_timeout else f"⏱️ {name}: превышен общий лимит времени"
+        if on_result:
+            on_result(name, results[index])
+
+    return results
+
+
+async def run_ordered_async(
+    tasks: Sequence[Tuple[str, Callable[[], Awaitable[Any]]]],
+    max_workers: Optional[int] = None,
+    deadline: Optional[float] = None,
+    on_timeout: Optional[Callable[[str], Any]] = None,
+    on_error: Optional[Callable[[str, Exception], Any]] = None,
+    on_result: Optional[Callable[[str, Any], None]] = None,
+) -> List[Any]:
+    """Асинхронный вариант run_ordered: tasks - пары (имя, корутинная функция).
+
+    Задачи, не уложившиеся в deadline, отменяются. max_workers ограничивает
+    число одновременно выполняемых задач, None - без ограничения.
+    """
+    results: List[Any] = [None] * len(tasks)
+    if not tasks:
+        return results
+
+    semaphore = asyncio.Semaphore(max_workers) if max_workers else None
+
+    async def limited(func):
+        if semaphore is None:
+            return await func()
+        async with semaphore:
+            return await func()
+
+    # Задачи asyncio наследуют контекст (текущий отчет для трассировки) при создании
+    futures = {asyncio.ensure_future(limited(func)): index for index, (_, func) in enumerate(tasks)}
+    pending = set(futures)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        while pending:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - (loop.time() - started)
+                if remaining <= 0:
+                    break
+
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                name = tasks[index][0]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    results[index] = on_error(name, e) if on_error else f"❌ {name}: {e}"
+                if on_result:
+                    on_result(name, results[index])
+    finally:
+        for future in pending:
+            future.cancel()
+
+    for future in pending:
+        index = futures[future]
+        name = tasks[index][0]
+        results[index] = on_timeout(name) if on_timeout else f"⏱️ {name}: превышен общий лимит времени"
+        if on_result:
+            on_result(name, results[index])
+
+    return results
@@ -0,0 +1,347 @@
+"""
+Адаптивные пробы Globalping: дешевый первый проход и расширение только там, где есть проблемы
+"""
+
+import statistics
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from globalping_models import Measurement, Probe
+
+# Тесты первого прохода и тесты пути, которые запускаются только из проблемных локаций
+BASIC_TESTS = ("ping", "http", "dns")
+PATH_TESTS = ("traceroute", "mtr")
+
+ESCALATION_DEFAULTS = {
+    "initial_locations": ("RU", "EU"),
+    "initial_limit": 2,
+    "escalation_locations": ("RU", "EU", "US", "GB", "Asia"),
+    "escalation_limit": 6,
+    # Трассировки запускаются не более чем из стольких проблемных локаций
+    "max_path_locations": 3,
+    # Потери пакетов, в процентах
+    "loss_threshold": 5.0,
+    # Выброс задержки: в rtt_factor раз и на rtt_min_delta мс больше медианы остальных проб
+    "rtt_factor": 3.0,
+    "rtt_min_delta": 100.0,
+    # Статусы выше считаются ошибкой; редиректы 3xx - нормальный ответ
+    "http_ok_max": 399,
+    "dns_mismatch": True
+}
+
+STAGE_LABELS = {
+    "standard": "стандартный набор",
+    "initial": "первый проход",
+    "escalation": "расширение",
+    "path": "трассировки"
+}
+
+
+class ProbeRequest(NamedTuple):
+    """Какие пробы запросить: значения magic локаций, число проб и этап для учета кредитов"""
+    locations: Tuple[str, ...]
+    limit: int
+    stage: str = "standard"
+
+    def for_attempt(self, attempt: int) -> "ProbeRequest":
+        """Повторные попытки - из тех же локаций, но вдвое меньшим числом проб"""
+        if attempt == 1:
+            return self
+        return self._replace(limit=max(1, self.limit // 2))
+
+    @property
+    def key(self) -> tuple:
+        return self.locations, self.limit
+
+
+class Problem(NamedTuple):
+    """Проблема первого прохода; probe None - тест не дал результатов целиком"""
+    test_type: str
+    probe: Optional[Probe]
+    reason: str
+
+    def render(self) -> str:
+        where = self.probe.location if self.probe is not None else "все пробы"
+        return f"{self.test_type} {where}: {self.reason}"
+
+
+def probe_magic(probe: Probe) -> str:
+    """Локация, попадающая в ту же пробу: город и сеть (или страна, если сеть неизвестна)"""
+    parts = [probe.city, f"AS{probe.asn}" if probe.asn else probe.country]
+    return "+".join(part for part in parts if part and part != "Unknown")
+
+
+def _rtt_outliers(values: List[Tuple[Probe, Optional[float]]], factor: float, min_delta: float) -> List[Tuple[Probe, str]]:
+    """Пробы, задержка которых намного выше медианы остальных"""
+    outliers = []
+    measured = [(probe, value) for probe, value in values if value is not None]
+    for index, (probe, value) in enumerate(measured):
+        others = [other for other_index, (_, other) in enumerate(measured) if other_index != index]
+        if not others:
+            continue
+        base = statistics.median(others)
+        if value > base * factor and value - base >= min_delta:
+            outliers.append((probe, f"задержка {value:g}ms при {base:g}ms у остальных проб"))
+    return outliers
+
+
+class EscalationPolicy:
+    """Решает, какие тесты повторить шире и откуда запускать трассировки"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = {**ESCALATION_DEFAULTS, **(config or {})}
+
+    def initial_request(self) -> ProbeRequest:
+        return ProbeRequest(tuple(self.config["initial_locations"]), self.config["initial_limit"], "initial")
+
+    def escalation_request(self) -> ProbeRequest:
+        return ProbeRequest(tuple(self.config["escalation_locations"]), self.config["escalation_limit"], "escalation")
+
+    def find_problems(self, test_types: Sequence[str], measurements: Dict[str, Measurement]) -> List[Problem]:
+        """Потери, ошибки проб, статусы не 2xx/3xx, расхождения DNS и выбросы задержки"""
+        config = self.config
+        problems: List[Problem] = []
+        for test_type in test_types:
+            measurement = measurements.get(test_type)
+            if measurement is None:
+                problems.append(Problem(test_type, None, "тест не выполнен"))
+                continue
+            if not measurement.probes:
+                problems.append(Problem(test_type, None, "нет результатов проб"))
+                continue
+
+            for probe in measurement.probes:
+                if probe.error:
+                    problems.append(Problem(test_type, probe, probe.error))
+                elif test_type == "ping":
+                    if probe.loss is not None and probe.loss >= config["loss_threshold"]:
+                        problems.append(Problem(test_type, probe, f"потери {probe.loss:g}%"))
+                    elif probe.avg is None:
+                        problems.append(Problem(test_type, probe, "нет ответа на ping"))
+                elif test_type == "http":
+                    # Без statusCode в поле может оказаться статус измерения ("finished")
+                    if not isinstance(probe.status, int):
+                        problems.append(Problem(test_type, probe, "нет HTTP ответа"))
+                    elif not 200 <= probe.status <= config["http_ok_max"]:
+                        problems.append(Problem(test_type, probe, f"HTTP {probe.status}"))
+                elif test_type == "dns" and not probe.answers:
+                    problems.append(Problem(test_type, probe, "пустой ответ DNS"))
+
+            if test_type in ("ping", "http"):
+                values = [
+                    (probe, probe.avg if test_type == "ping" else (probe.timings.total if probe.timings else None))
+                    for probe in measurement.probes if not probe.error
+                ]
+                problems.extend(
+                    Problem(test_type, probe, reason)
+                    for probe, reason in _rtt_outliers(values, config["rtt_factor"], config["rtt_min_delta"])
+                )
+            elif test_type == "dns" and config["dns_mismatch"]:
+                answered = [probe for probe in measurement.probes if probe.answers and not probe.error]
+                if len(answered) > 1:
+                    common, _ = Counter(frozenset(probe.answers) for probe in answered).most_common(1)[0]
+                    problems.extend(
+                        Problem(test_type, probe, "ответы DNS расходятся: " + ", ".join(probe.answers[:3]))
+                        for probe in answered if common.isdisjoint(probe.answers)
+                    )
+        return problems
+
+    def retests(self, problems: Sequence[Problem]) -> List[str]:
+        """Тесты первого прохода с проблемами - их повторяют на расширенном наборе проб"""
+        return [test_type for test_type in BASIC_TESTS if any(problem.test_type == test_type for problem in problems)]
+
+    def path_request(self, problems: Sequence[Problem]) -> Optional[ProbeRequest]:
+        """Трассировки из проблемных локаций; None - проблем нет и трассировки не нужны.
+
+        Если тест не дал результатов целиком, трассировки идут из локаций первого прохода.
+        """
+        if not problems:
+            return None
+        locations: List[str] = []
+        for problem in problems:
+            if problem.probe is None:
+                continue
+            magic = probe_magic(problem.probe)
+            if magic and magic not in locations:
+                locations.append(magic)
+        locations = locations[:self.config["max_path_locations"]]
+        if not locations:
+            return self.initial_request()._replace(stage="path")
+        return ProbeRequest(tuple(locations), len(locations), "path")
+
+
+class CreditLedger:
+    """Кредиты Globalping одной цели: проба свежего измерения - один кредит.
+
+    Результаты из кеша кредитов не тратят; неудачные измерения не учитываются,
+    потому что число отработавших проб неизвестно.
+    """
+
+    def __init__(self, stats: Optional["EscalationStats"] = None, report=None):
+        self._lock = threading.Lock()
+        self.by_stage: Dict[str, int] = {}
+        self.stats = stats
+        self.report = report
+
+    def add(self, stage: str, probes: int):
+        with self._lock:
+            self.by_stage[stage] = self.by_stage.get(stage, 0) + probes
+        if self.stats is not None:
+            self.stats.record_credits(stage, probes)
+        if self.report is not None:
+            self.report.count("globalping_credits", probes)
+            self.report.count(f"globalping_credits.{stage}", probes)
+
+    @property
+    def total(self) -> int:
+        with self._lock:
+            return sum(self.by_stage.values())
+
+    def render(self) -> str:
+        with self._lock:
+            stages = dict(self.by_stage)
+        text = f"💳 Кредиты Globalping: {sum(stages.values())}"
+        if stages:
+            text += " (" + ", ".join(f"{STAGE_LABELS.get(stage, stage)} {count}" for stage, count in stages.items()) + ")"
+        return text
+
+
+class Stage(NamedTuple):
+    """Этап адаптивного запуска: тесты, набор проб и колбэк готовых результатов"""
+    test_types: List[str]
+    request: ProbeRequest
+    on_result: Optional[Callable[[str, str], Any]]
+
+
+class AdaptiveRun:
+    """Ход адаптивного запуска одной цели без ввода-вывода.
+
+    Решает, какие этапы запускать, и собирает результаты; сами измерения выполняет драйвер
+    (синхронный или асинхронный), передавая тексты этапа в next_stage:
+
+        stage = run.first_stage()
+        while stage is not None:
+            stage = run.next_stage(run_stage(stage))
+
+    measurements - общий с драйвером словарь типизированных измерений, его заполняют этапы.
+    on_result(test_type, text, skipped=False) получает готовые результаты; пропущенные
+    трассировки приходят с skipped=True.
+    """
+
+    def __init__(self, policy: EscalationPolicy, target: str, test_types: Sequence[str], measurements: Dict[str, Measurement],
+                 on_result: Optional[Callable[..., Any]] = None, stats: Optional["EscalationStats"] = None):
+        self.policy = policy
+        self.target = target
+        self.test_types = list(test_types)
+        self.measurements = measurements
+        self.on_result = on_result
+        self.stats = stats
+        self.basic = [test_type for test_type in self.test_types if test_type not in PATH_TESTS]
+        self.path = [test_type for test_type in self.test_types if test_type in PATH_TESTS]
+        self.results: Dict[str, str] = {}
+        self.problems: List[Problem] = []
+        self.retests: List[str] = []
+        self.path_request: Optional[ProbeRequest] = None
+        self._step = "initial"
+        self._initial: Dict[str, Optional[Measurement]] = {}
+
+    def first_stage(self) -> Stage:
+        return Stage(self.basic, self.policy.initial_request(), self.on_result)
+
+    def next_stage(self, texts: Sequence[str]) -> Optional[Stage]:
+        """Принимает результаты текущего этапа (в порядке его тестов) и возвращает следующий; None - запуск завершен"""
+        if self._step == "initial":
+            self.results.update(zip(self.basic, texts))
+            self.problems = self.policy.find_problems(self.basic, self.measurements)
+            self.retests = self.policy.retests(self.problems)
+            if self.retests:
+                return self._escalation_stage()
+        elif self._step == "escalation":
+            refreshed = []
+            for test_type, text in zip(self.retests, texts):
+                if test_type in self.measurements:
+                    self.results[test_type] = text
+                    refreshed.append(test_type)
+                elif self._initial[test_type] is not None:
+                    self.measurements[test_type] = self._initial[test_type]
+            # Свежие проблемы расширенного набора - первыми в очереди на трассировки;
+            # восстановленные измерения первого прохода уже учтены и заново не оцениваются
+            self.problems = self.policy.find_problems(refreshed, self.measurements) + self.problems
+        elif self._step == "path":
+            self.results.update(zip(self.path, texts))
+            return self._finish()
+        else:
+            return None
+        return self._path_stage()
+
+    def ordered_results(self) -> List[str]:
+        """Результаты в исходном порядке тестов"""
+        return [self.results[test_type] for test_type in self.test_types]
+
+    def _escalation_stage(self) -> Stage:
+        print(f"🔎 Globalping {self.target}: " + "; ".join(problem.render() for problem in self.problems[:5]) + f" → расширенные пробы: {', '.join(self.retests)}")
+        # Если расширенный повтор не удался, остается результат первого прохода
+        self._initial = {test_type: self.measurements.pop(test_type, None) for test_type in self.retests}
+        self._step = "escalation"
+        on_result = None
+        if self.on_result:
+            on_result = lambda test_type, text: self.on_result(test_type, text) if test_type in self.measurements else None
+        return Stage(self.retests, self.policy.escalation_request(), on_result)
+
+    def _path_stage(self) -> Optional[Stage]:
+        self.path_request = self.policy.path_request(self.problems) if self.path else None
+        if self.path_request is not None:
+            print(f"🧭 Globalping {self.target}: {', '.join(self.path)} из {', '.join(self.path_request.locations)}")
+            self._step = "path"
+            return Stage(self.path, self.path_request, self.on_result)
+        for test_type in self.path:
+            self.results[test_type] = f"⏭️ **{test_type.upper()}**: пропущен - первый проход не нашел проблем"
+            if self.on_result:
+                self.on_result(test_type, self.results[test_type], skipped=True)
+        return self._finish()
+
+    def _finish(self) -> None:
+        self._step = "done"
+        if self.stats is not None:
+            self.stats.record_run(bool(self.retests), None if not self.path else self.path_request is not None)
+        return None
+
+
+class EscalationStats:
+    """Счетчики адаптивного режима: кредиты по этапам, расширения и пропущенные трассировки"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.credits: Dict[str, int] = {}
+        self.runs = 0
+        self.escalated = 0
+        self.path_runs = 0
+        self.path_skipped = 0
+
+    def record_credits(self, stage: str, probes: int):
+        with self._lock:
+            self.credits[stage] = self.credits.get(stage, 0) + probes
+
+    def record_run(self, escalated: bool, path: Optional[bool]):
+        """path None - трассировки не запрашивались"""
+        with self._lock:
+            self.runs += 1
+            self.escalated += int(escalated)
+            if path is True:
+                self.path_runs += 1
+            elif path is False:
+                self.path_skipped += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "credits": dict(self.credits),
+                "runs": self.runs,
+                "escalated": self.escalated,
+                "path_runs": self.path_runs,
+                "path_skipped": self.path_skipped
+            }
+
+
+escalation_stats = EscalationStats()
@@ -0,0 +1,138 @@
+"""
+Сообщение о ходе диагностики, обновляемое на месте через chat.update
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+PENDING = "⏳"
+SUCCESS = "✅"
+FAILURE = "❌"
+SKIPPED = "⏭️"
+
+
+class ThrottledMessage:
+    """Одно сообщение Slack, обновления которого объединяются и отправляются не чаще min_interval.
+
+    post(text) публикует сообщение и возвращает его ts, update(ts, text) меняет текст.
+    """
+
+    def __init__(self, post: Optional[Callable[[str], str]], update: Callable[[str, str], Any], min_interval: float = 1.0):
+        self._post = post
+        self._update = update
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        # Упорядочивает вызовы chat.update; _lock на время запроса к Slack не держится
+        self._send_lock = threading.Lock()
+        self._sending = False
+        self._ts: Optional[str] = None
+        self._pending: Optional[str] = None
+        self._sent: Optional[str] = None
+        self._last_sent_at = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self.updates_sent = 0
+        self.updates_coalesced = 0
+
+    def start(self, text: str, ts: Optional[str] = None):
+        """Публикует сообщение; ts - уже опубликованное (например, асинхронным клиентом), тогда post не вызывается"""
+        self._ts = ts if ts is not None else self._post(text)
+        self._sent = text
+        self._last_sent_at = time.monotonic()
+
+    def set_text(self, text: str):
+        """Запрашивает обновление; частые изменения объединяются в одно"""
+        with self._lock:
+            if self._pending is not None:
+                self.updates_coalesced += 1
+            self._pending = text
+            if self._sending:
+                # Отправляющий поток заберет новое состояние сразу после текущего запроса
+                return
+            delay = self.min_interval - (time.monotonic() - self._last_sent_at)
+            if self._timer is not None:
+                return
+            if delay > 0:
+                self._timer = threading.Timer(delay, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+        self.flush()
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+    def flush(self):
+        """Отправляет последнее запрошенное состояние, если оно еще не отправлено"""
+        with self._send_lock:
+            while True:
+                with self._lock:
+                    if self._timer is not None:
+                        self._timer.cancel()
+                        self._timer = None
+                    text, self._pending = self._pending, None
+                    ts = self._ts
+                    if text is None or text == self._sent or ts is None:
+                        self._sending = False
+                        return
+                    self._sending = True
+                sent = False
+                try:
+                    self._update(ts, text)
+                    sent = True
+                except Exception as e:
+                    print(f"⚠️ Не удалось обновить сообщение: {e}")
+                with self._lock:
+                    if sent:
+                        self._sent = text
+                        self.updates_sent += 1
+                    self._last_sent_at = time.monotonic()
+
+
+class ProgressBoard:
+    """Разделы с плейсхолдерами для каждого теста: ⏳ → ✅/❌/⏭️ по мере завершения"""
+
+    def __init__(self, message: ThrottledMessage, title: str):
+        self.message = message
+        self.title = title
+        self._lock = threading.Lock()
+        self._sections: "OrderedDict[str, OrderedDict[str, Tuple[str, str]]]" = OrderedDict()
+
+    def add_section(self, header: str, items: List[str]):
+        with self._lock:
+            self._sections[header] = OrderedDict((item, (PENDING, "")) for item in items)
+
+    def start(self, ts: Optional[str] = None):
+        self.message.start(self.render(), ts)
+
+    def finish_item(self, header: str, item: str, text: str, ok: Optional[bool] = None, skipped: bool = False):
+        """ok None - исход определяется по значку в начале текста; skipped - тест не запускался"""
+        if ok is None and not skipped:
+            skipped = text.lstrip().startswith(SKIPPED)
+            ok = not text.lstrip().startswith((FAILURE, "⏱️"))
+        state = SKIPPED if skipped else SUCCESS if ok else FAILURE
+        # Не дублируем значок, если результат уже начинается с него
+        if text.startswith(state):
+            text = text[len(state):].lstrip()
+        with self._lock:
+            self._sections[header][item] = (state, text)
+        self.message.set_text(self.render())
+
+    def render(self) -> str:
+        with self._lock:
+            parts = [self.title]
+            for header, items in self._sections.items():
+                lines = [header]
+                for item, (state, text) in items.items():
+                    lines.append(f"{state} {text}" if text else f"{state} `{item}`")
+                parts.append("\n\n".join(lines))
+            return "\n\n".join(parts)
+
+    def close(self):
+        self.message.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {"updates_sent": self.message.updates_sent, "updates_coalesced": self.message.updates_coalesced}
@@ -0,0 +1,416 @@
+"""
+Сжатие результатов тестов в компактную структурированную сводку для AI промпта
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from globalping_models import Hop, Measurement
+from result_cache import strip_cache_marks
+
+PROMPT_CONFIG_DEFAULTS = {
+    # Хоп считается заметным, если задержка выросла на столько мс относительно предыдущего
+    "hop_rtt_jump": 20.0,
+    # или потери на нем не меньше этого процента
+    "hop_loss": 10.0
+}
+
+_GLOBALPING_HEADER_RE = re.compile(r"^(?:✅ )?🌍 \*{1,2}(\w+)\*{1,2} для `([^`]*)`")
+_LOCAL_HEADER_RE = re.compile(r"^💻 `([^`]+)`:\s*(.*)$")
+_PING_PROBE_RE = re.compile(r"^📍 (.+?): ([\d.]+|N/A)ms \(потерь: ([\d.]+|N/A)%\)")
+_HTTP_PROBE_RE = re.compile(r"^📍 (.+?): HTTP (\S+) \(([\d.]+|N/A)ms\)")
+_DNS_PROBE_RE = re.compile(r"^📍 (.+?): (.+)$")
+_PATH_PROBE_RE = re.compile(r"^📍 (.+?) (?:TRACEROUTE|MTR):$")
+_PATH_HOP_RE = re.compile(r"^\s*(\d+)\. (.+?) - ([\d.]+|N/A)ms(?: \(([\d.]+)% loss\))?$")
+_PATH_TIMEOUT_RE = re.compile(r"^\s*(\d+)\. \* \* \* \(timeout\)$")
+
+_LOCAL_PING_STATS_RE = re.compile(r"(\d+) packets transmitted, (\d+) (?:packets )?received.*?([\d.]+)% packet loss")
+_LOCAL_PING_RTT_RE = re.compile(r"= ([\d.]+)/([\d.]+)/([\d.]+)/([\d.]+) ms")
+_CURL_STATUS_RE = re.compile(r"^<?\s*(HTTP/[\d.]+) (\d{3})", re.MULTILINE)
+_CURL_CONNECTED_RE = re.compile(r"Connected to (\S+) \(([^)]+)\) port (\d+)")
+_CURL_TLS_RE = re.compile(r"SSL connection using (\S+) / (\S+)")
+_CURL_EXPIRE_RE = re.compile(r"expire date: (.+)")
+_CURL_ERROR_RE = re.compile(r"curl: \(\d+\) (.+)")
+_PROBE_TIMINGS_RE = re.compile(r"\* timings: (.+)")
+_MTR_HOP_RE = re.compile(
+    r"^\s*(\d+)\.\s*(?:\|--)?\s*(?:AS\S+\s+)?(.+?)\s+([\d.]+)%\s+(\d+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)"
+)
+
+
+def count_tokens(text: str) -> int:
+    """Считает токены промпта: tiktoken, если установлен, иначе приблизительная оценка"""
+    try:
+        import tiktoken
+        return len(tiktoken.encoding_for_model("gpt-4o").encode(text))
+    except Exception:
+        # ~3 символа на токен для смеси кириллицы, латиницы и цифр
+        return max(1, len(text) // 3)
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def split_result_blocks(all_results: str) -> List[Tuple[str, str, List[str]]]:
+    """Разбивает объединенный текст результатов на блоки (вид, заголовок, строки)"""
+    blocks: List[Tuple[str, str, List[str]]] = []
+    for line in strip_cache_marks(all_results).splitlines():
+        globalping = _GLOBALPING_HEADER_RE.match(line)
+        local = _LOCAL_HEADER_RE.match(line)
+        if globalping:
+            blocks.append(("globalping", globalping.group(1).lower(), []))
+        elif local:
+            blocks.append(("local", local.group(1), [local.group(2)] if local.group(2) else []))
+        elif line.startswith("⏭️"):
+            # Тест не запускался (например, трассировка без найденных проблем)
+            blocks.append(("skipped", line, []))
+        elif line.startswith(("❌", "⏱️")) and not (blocks and blocks[-1][0] == "local"):
+            blocks.append(("error", line, []))
+        elif blocks:
+            blocks[-1][2].append(line)
+    return blocks
+
+
+def _notable_hops(hops: List[Dict[str, Any]], config: Dict[str, float]) -> List[Dict[str, Any]]:
+    """Оставляет только хопы со скачком задержки или заметными потерями"""
+    notable = []
+    previous_rtt = None
+    for hop in hops[:-1]:
+        rtt, loss = hop.get("rtt"), hop.get("loss") or 0
+        jump = rtt is not None and previous_rtt is not None and rtt - previous_rtt >= config["hop_rtt_jump"]
+        if jump or loss >= config["hop_loss"]:
+            notable.append(hop)
+        if rtt is not None:
+            previous_rtt = rtt
+    return notable
+
+
+def _summarize_path(hops: List[Dict[str, Any]], config: Dict[str, float]) -> Dict[str, Any]:
+    final = hops[-1] if hops else {}
+    return {
+        "hops": len(hops),
+        "timeouts": sum(1 for hop in hops if hop.get("host") is None),
+        "final": final,
+        "notable": _notable_hops(hops, config)
+    }
+
+
+def _parse_globalping(test_type: str, lines: List[str], config: Dict[str, float]) -> List[Dict[str, Any]]:
+    probes: List[Dict[str, Any]] = []
+    if test_type in ("traceroute", "mtr"):
+        current: Optional[Dict[str, Any]] = None
+        for line in lines:
+            header = _PATH_PROBE_RE.match(line)
+            hop = _PATH_HOP_RE.match(line)
+            if header:
+                current = {"location": header.group(1), "hops": []}
+                probes.append(current)
+            elif current is not None and hop:
+                current["hops"].append({
+                    "n": int(hop.group(1)),
+                    "host": hop.group(2),
+                    "rtt": _number(hop.group(3)),
+                    "loss": _number(hop.group(4)) or 0.0
+                })
+            elif current is not None and _PATH_TIMEOUT_RE.match(line):
+                current["hops"].append({"n": len(current["hops"]) + 1, "host": None, "rtt": None, "loss": 100.0})
+            elif line.startswith("📍 "):
+                probes.append({"location": line[2:].split(":")[0].strip(), "error": line.split(":", 1)[-1].strip()})
+        for probe in probes:
+            if "hops" in probe:
+                probe.update(_summarize_path(probe.pop("hops"), config))
+        return probes
+
+    for line in lines:
+        if test_type == "ping" and _PING_PROBE_RE.match(line):
+            match = _PING_PROBE_RE.match(line)
+            probes.append({"location": match.group(1), "avg": _number(match.group(2)), "loss": _number(match.group(3))})
+        elif test_type == "http" and _HTTP_PROBE_RE.match(line):
+            match = _HTTP_PROBE_RE.match(line)
+            probes.append({"location": match.group(1), "status": match.group(2), "total": _number(match.group(3))})
+        elif test_type == "dns" and _DNS_PROBE_RE.match(line):
+            match = _DNS_PROBE_RE.match(line)
+            probes.append({"location": match.group(1), "answer": match.group(2)})
+    return probes
+
+
+def _hop_summary(hop: Hop) -> Dict[str, Any]:
+    return {"n": hop.index, "host": hop.host, "rtt": hop.rtt, "loss": hop.loss}
+
+
+def summarize_measurement(measurement: Measurement, config: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+    """Сводка проб из типизированных записей: числа берутся как есть, без разбора текста"""
+    config = {**PROMPT_CONFIG_DEFAULTS, **(config or {})}
+    probes: List[Dict[str, Any]] = []
+    for probe in measurement.probes:
+        item: Dict[str, Any] = {"location": probe.location}
+        if probe.error:
+            item["error"] = probe.error
+        elif measurement.test_type == "ping":
+            item.update({"avg": probe.avg, "loss": probe.loss})
+        elif measurement.test_type == "http":
+            total = probe.timings.total if probe.timings else None
+            item.update({"status": str(probe.status) if probe.status is not None else "N/A", "total": total})
+        elif measurement.test_type == "dns":
+            item["answer"] = probe.answers[0] if probe.answers else "No DNS response"
+        elif probe.hops:
+            item.update(_summarize_path([_hop_summary(hop) for hop in probe.hops], config))
+        else:
+            item["error"] = "данные недоступны"
+        probes.append(item)
+    return probes
+
+
+def _parse_local(command: str, lines: List[str], config: Dict[str, float]) -> Dict[str, Any]:
+    output = "\n".join(lines).replace("```", "").strip()
+    name = command.split()[0].lower()
+    summary: Dict[str, Any] = {"command": command, "kind": name}
+
+    if output.startswith(("❌", "⏱️", "⚠️")):
+        summary["error"] = output.splitlines()[0][:200]
+        return summary
+
+    if name == "ping":
+        stats = _LOCAL_PING_STATS_RE.search(output)
+        rtt = _LOCAL_PING_RTT_RE.search(output)
+        if stats:
+            summary.update({"sent": int(stats.group(1)), "received": int(stats.group(2)), "loss": _number(stats.group(3))})
+        if rtt:
+            summary.update({"min": _number(rtt.group(1)), "avg": _number(rtt.group(2)), "max": _number(rtt.group(3))})
+    elif name in ("dig", "nslookup", "native-dns"):
+        summary["kind"] = "dns_soa" if "SOA" in command.upper() else "dns"
+        summary["answers"] = [line.strip() for line in output.splitlines() if line.strip() and not line.startswith(";;")][:5]
+    elif name in ("curl", "native-http"):
+        summary["kind"] = "curl"
+        timings = _PROBE_TIMINGS_RE.search(output)
+        if timings:
+            summary["timings"] = timings.group(1)
+        statuses = _CURL_STATUS_RE.findall(output)
+        connected = _CURL_CONNECTED_RE.search(output)
+        tls = _CURL_TLS_RE.search(output)
+        expire = _CURL_EXPIRE_RE.search(output)
+        error = _CURL_ERROR_RE.search(output)
+        # С -v статус виден и в отладочном выводе (<), и в заголовках ответа
+        summary["statuses"] = []
+        for proto, code in statuses:
+            status = f"{proto} {code}"
+            if not summary["statuses"] or summary["statuses"][-1] != status:
+                summary["statuses"].append(status)
+        if connected:
+            summary["connected"] = f"{connected.group(2)}:{connected.group(3)}"
+        if tls:
+            summary["tls"] = f"{tls.group(1)} {tls.group(2)}"
+        if expire:
+            summary["cert_expire"] = expire.group(1).strip()
+        if error:
+            summary["error"] = error.group(1).strip()
+    elif name == "native-tcp":
+        summary["kind"] = "tcp"
+        connected = _CURL_CONNECTED_RE.search(output)
+        timings = _PROBE_TIMINGS_RE.search(output)
+        if connected:
+            summary["connected"] = f"{connected.group(2)}:{connected.group(3)}"
+        if timings:
+            summary["timings"] = timings.group(1)
+    elif name in ("mtr", "traceroute", "tracert", "pathping"):
+        hops = []
+        for line in output.splitlines():
+            hop = _MTR_HOP_RE.match(line)
+            if hop:
+                host = hop.group(2).strip()
+                hops.append({
+                    "n": int(hop.group(1)),
+                    "host": None if host.startswith("???") else host,
+                    "loss": _number(hop.group(3)),
+                    "rtt": _number(hop.group(6))
+                })
+        summary.update(_summarize_path(hops, config))
+    else:
+        summary["output"] = output.splitlines()[0][:200] if output else ""
+    return summary
+
+
+def compact_results(
+    all_results: str,
+    config: Optional[Dict[str, float]] = None,
+    measurements: Optional[Dict[str, Measurement]] = None
+) -> Dict[str, Any]:
+    """Превращает текст результатов Globalping и локальных команд в структурированную сводку.
+
+    Для тестов из measurements сводка строится по типизированным записям, остальные разбираются из текста.
+    """
+    config = {**PROMPT_CONFIG_DEFAULTS, **(config or {})}
+    measurements = measurements or {}
+    summary: Dict[str, Any] = {"globalping": {}, "local": [], "errors": []}
+    for kind, header, lines in split_result_blocks(all_results):
+        if kind == "globalping" and header in measurements:
+            summary["globalping"][header] = summarize_measurement(measurements[header], config)
+        elif kind == "globalping":
+            summary["globalping"][header] = _parse_globalping(header, lines, config)
+        elif kind == "local":
+            summary["local"].append(_parse_local(header, lines, config))
+        elif kind == "skipped":
+            continue
+        else:
+            summary["errors"].append(header[:200])
+    return summary
+
+
+def _fmt(value: Any, unit: str = "") -> str:
+    if value is None:
+        return "N/A"
+    if isinstance(value, float):
+        value = f"{value:g}"
+    return f"{value}{unit}"
+
+
+def _render_hop(hop: Dict[str, Any]) -> str:
+    if not hop:
+        return "нет данных"
+    loss = f" loss {_fmt(hop.get('loss'), '%')}" if hop.get("loss") else ""
+    return f"#{hop.get('n')} {hop.get('host') or '*'} {_fmt(hop.get('rtt'), 'ms')}{loss}"
+
+
+def _render_path(path: Dict[str, Any], with_hops: bool) -> str:
+    line = f"хопов {path['hops']}, таймаутов {path['timeouts']}, финал {_render_hop(path['final'])}"
+    if with_hops and path["notable"]:
+        line += "; заметные: " + ", ".join(_render_hop(hop) for hop in path["notable"])
+    return line
+
+
+def render_compact(summary: Dict[str, Any], detail: int = 2) -> str:
+    """Рендерит сводку в текст промпта; detail 2 - с заметными хопами, 1 - без них"""
+    lines: List[str] = []
+    for test_type, probes in summary["globalping"].items():
+        lines.append(f"[globalping {test_type}]")
+        for probe in probes:
+            where = probe["location"]
+            if "error" in probe:
+                lines.append(f"- {where}: {probe['error']}")
+            elif test_type == "ping":
+                lines.append(f"- {where}: avg {_fmt(probe['avg'], 'ms')}, loss {_fmt(probe['loss'], '%')}")
+            elif test_type == "http":
+                lines.append(f"- {where}: HTTP {probe['status']}, {_fmt(probe['total'], 'ms')}")
+            elif test_type == "dns":
+                lines.append(f"- {where}: {probe['answer']}")
+            else:
+                lines.append(f"- {where}: {_render_path(probe, detail >= 2)}")
+        if not probes:
+            lines.append("- нет результатов")
+
+    for item in summary["local"]:
+        prefix = f"[local {item['command']}]"
+        if "error" in item and item["kind"] != "curl":
+            lines.append(f"{prefix} {item['error']}")
+        elif item["kind"] == "ping":
+            lines.append(f"{prefix} {item.get('received', 'N/A')}/{item.get('sent', 'N/A')} ответов, loss {_fmt(item.get('loss'), '%')}, "
+                         f"rtt {_fmt(item.get('min'))}/{_fmt(item.get('avg'))}/{_fmt(item.get('max'))}ms")
+        elif item["kind"] in ("dns", "dns_soa"):
+            lines.append(f"{prefix} {'; '.join(item['answers']) or 'пустой ответ'}")
+        elif item["kind"] == "curl":
+            parts = [" → ".join(item["statuses"]) or "нет HTTP ответа"]
+            for key in ("connected", "tls", "timings", "cert_expire", "error"):
+                if key in item:
+                    parts.append(f"{key}: {item[key]}")
+            lines.append(f"{prefix} {', '.join(parts)}")
+        elif item["kind"] == "tcp":
+            lines.append(f"{prefix} " + ", ".join(f"{key}: {item[key]}" for key in ("connected", "timings") if key in item))
+        elif "hops" in item:
+            lines.append(f"{prefix} {_render_path(item, detail >= 2)}")
+        else:
+            lines.append(f"{prefix} {item.get('output', '')}")
+
+    for error in summary["errors"]:
+        lines.append(f"[ошибка] {error}")
+    return "\n".join(lines)
+
+
+def build_compact_results(
+    all_results: str,
+    token_budget: int,
+    config: Optional[Dict[str, float]] = None,
+    measurements: Optional[Dict[str, Measurement]] = None,
+    max_detail: int = 2
+) -> Tuple[str, Dict[str, int]]:
+    """Строит сжатую сводку в пределах бюджета токенов.
+
+    Возвращает текст и статистику: токены исходного и сжатого вида.
+    """
+    summary = compact_results(all_results, config, measurements)
+    text = render_compact(summary, detail=max_detail)
+    tokens = count_tokens(text)
+    if tokens > token_budget and max_detail > 1:
+        # Сначала отказываемся от заметных хопов, затем обрезаем по бюджету
+        text = render_compact(summary, detail=1)
+        tokens = count_tokens(text)
+    if tokens > token_budget:
+        ratio = token_budget / tokens
+        text = text[:int(len(text) * ratio)].rsplit("\n", 1)[0] + "\n[сводка обрезана по бюджету токенов]"
+        tokens = count_tokens(text)
+    return text, {"raw_tokens": count_tokens(all_results), "compact_tokens": tokens}
+
+
+# Общая часть промптов одной цели и сравнения нескольких целей
+ANALYST_INSTRUCTIONS = """
+        Вы - специалист по диагностике сетевых проблем.
+        Будьте конкретны, точны.
+        "Пиши, сокращай". 
+        Используй форматирование markdown для Slack.
+        Используй только русский язык.
+
+        Учитывай для MTR и Traceroute: Потеря пакетов на промежуточных узлах может быть нормальной из-за:
+        - Низкого приоритета ICMP трафика на маршрутизаторах
+        - Блокировки ICMP на промежуточных узлах
+        - Rate limiting на сетевом оборудовании
+        НЕ УКАЗЫВАЙ это в заключении ЕСЛИ НЕТ потерь на финальном узле.
+    
+        Не давай рекомендаций, по устранению причин и проблем. Только точная диагностика.
+"""
+
+
+def format_changes(changes: Optional[List[str]]) -> str:
+    """Раздел промпта с изменениями относительно истории; пустой, если истории нет"""
+    if changes is None:
+        return ""
+    if not changes:
+        return "Изменений относительно последнего исправного состояния нет.\n"
+    return "Изменения относительно последнего исправного состояния:\n" + "\n".join(f"- {change}" for change in changes) + "\n"
+
+
+def build_analysis_prompt(target: str, results_text: str, changes: Optional[List[str]] = None) -> str:
+    """Собирает промпт AI анализа из сводки результатов и изменений относительно истории"""
+    #Фокус на конечной доступности и стабильности финального узла.
+    return f"""{ANALYST_INSTRUCTIONS}
+        Проведен комплексный анализ ресурса '{target}'. 
+        
+        Результаты тестов:
+        {results_text}
+        
+        {format_changes(changes)}
+        Проанализируйте результаты и дайте краткое заключение:
+        1. Статус ресурса (работает/не работает/проблемы)
+        2. Выявленные проблемы (если есть)
+        3. Причины проблем (если есть проблемы)
+        
+        """
+
+
+def build_comparison_prompt(results_by_target: List[Tuple[str, str]]) -> str:
+    """Собирает общий промпт AI анализа нескольких целей из их сводок"""
+    targets = ", ".join(f"'{target}'" for target, _ in results_by_target)
+    sections = "\n\n".join(f"### {target}\n{results_text}" for target, results_text in results_by_target)
+    return f"""{ANALYST_INSTRUCTIONS}
+        Проведен комплексный анализ связанных ресурсов из одного сообщения: {targets}. 
+        
+        Результаты тестов по каждому ресурсу:
+        {sections}
+        
+        Сравните ресурсы и дайте краткое заключение:
+        1. Статус каждого ресурса (работает/не работает/проблемы)
+        2. Общие проблемы для нескольких ресурсов и проблемы только одного из них
+        3. Вероятное место проблемы (DNS, общий хостинг или CDN, маршрут, сам сервис)
+        
+        """
@@ -0,0 +1,182 @@
+"""
+TTL кеш результатов диагностики с LRU вытеснением и объединением одновременных запросов
+"""
+
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+def normalize_target(target: str) -> str:
+    """Приводит цель к виду для ключа кеша: без схемы, пути и регистра"""
+    host = target.strip().lower()
+    for prefix in ("https://", "http://"):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    return host.split("/")[0].rstrip(".")
+
+
+class _Flight:
+    """Выполняющийся расчет, результата которого ждут остальные запросы"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class TTLCache:
+    """Потокобезопасный кеш с ограничением по времени жизни и размеру.
+
+    get_or_compute выполняет не более одного расчета на ключ одновременно:
+    повторные запросы ждут результат уже идущего расчета.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._async_inflight: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def _lookup(self, key: Hashable) -> Optional[Tuple[float, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(
+        self,
+        key: Hashable,
+        compute: Callable[[], Any],
+        should_cache: Callable[[Any], bool] = lambda value: True,
+        wait_timeout: Optional[float] = None
+    ) -> Tuple[Any, Optional[float]]:
+        """Возвращает (значение, возраст в секундах); возраст None - значение свежее"""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[1], time.monotonic() - entry[0]
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not flight.done.wait(wait_timeout):
+                raise TimeoutError(f"Не дождались результата для {key}")
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, None
+
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None and should_cache(flight.value):
+                    self._store(key, flight.value)
+                del self._inflight[key]
+            flight.done.set()
+
+        return flight.value, None
+
+    async def get_or_compute_async(
+        self,
+        key: Hashable,
+        compute: Callable[[], Awaitable[Any]],
+        should_cache: Callable[[Any], bool] = lambda value: True
+    ) -> Tuple[Any, Optional[float]]:
+        """Асинхронный вариант get_or_compute: те же записи, повторные запросы ждут future лидера"""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[1], time.monotonic() - entry[0]
+
+            flight = self._async_inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = asyncio.get_running_loop().create_future()
+                self._async_inflight[key] = flight
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            # shield: отмена одного ожидающего не отменяет общий результат
+            return await asyncio.shield(flight), None
+
+        try:
+            value = await compute()
+        except BaseException as e:
+            # Отмена лидера не должна отменять ожидающих: они получают обычную ошибку
+            flight.set_exception(e if isinstance(e, Exception) else RuntimeError(f"Расчет для {key} отменен"))
+            flight.exception()
+            raise
+        finally:
+            with self._lock:
+                del self._async_inflight[key]
+
+        with self._lock:
+            if should_cache(value):
+                self._store(key, value)
+        flight.set_result(value)
+        return value, None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "inflight": len(self._inflight) + len(self._async_inflight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions
+            }
+
+
+def format_cache_age(age: Optional[float]) -> str:
+    """Пометка для результатов, взятых из кеша"""
+    if age is None:
+        return ""
+    return f"\n♻️ _Из кеша, получено {int(age)}с назад_"
+
+
+_CACHE_MARK_RE = re.compile(r"\n♻️ _Из кеша, получено \d+с назад_")
+
+
+def strip_cache_marks(text: str) -> str:
+    """Убирает пометки о возрасте, чтобы они не влияли на ключи кеша"""
+    return _CACHE_MARK_RE.sub("", text)
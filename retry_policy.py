@@ -0,0 +1,233 @@
+"""
+Повторы с экспоненциальной задержкой и общим дедлайном отчета
+"""
+
+import asyncio
+import contextvars
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Tuple
+
+# Ошибки, которые повтор не исправит: команды нет на хосте, домен не существует, цель отклонена API
+FATAL_PATTERNS = re.compile(
+    r"command not found|not recognized as an internal|No such file or directory"
+    r"|NXDOMAIN|Name or service not known|Non-existent domain|can't find .*: Non-existent"
+    r"|Could not resolve host|Unknown host|cannot resolve|nodename nor servname"
+    r"|HTTP 40[0-4]\b|HTTP 422\b|Invalid target",
+    re.IGNORECASE
+)
+
+RETRYABLE = "retryable"
+FATAL = "fatal"
+
+
+def classify_error(error: Any) -> str:
+    """retryable или fatal по тексту ошибки или исключению.
+
+    Исключения с атрибутом retryable = False не повторяются.
+    """
+    if getattr(error, "retryable", True) is False or isinstance(error, (FileNotFoundError, PermissionError)):
+        return FATAL
+    return FATAL if FATAL_PATTERNS.search(str(error)) else RETRYABLE
+
+
+class Deadline:
+    """Момент time.monotonic(), к которому должны уложиться все вложенные вызовы"""
+
+    __slots__ = ("at", "_clock")
+
+    def __init__(self, seconds: Optional[float], clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.at = None if seconds is None else clock() + seconds
+
+    def remaining(self) -> float:
+        if self.at is None:
+            return float("inf")
+        return max(0.0, self.at - self._clock())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def cap(self, timeout: float) -> float:
+        """Таймаут операции, не выходящий за дедлайн"""
+        return min(timeout, self.remaining())
+
+    def earliest(self, seconds: Optional[float]) -> "Deadline":
+        """Дедлайн этапа внутри отчета: раньше из двух"""
+        if seconds is None:
+            return self
+        stage = Deadline(seconds, self._clock)
+        return stage if self.at is None or stage.at < self.at else self
+
+
+_NO_DEADLINE = Deadline(None)
+_current_deadline: contextvars.ContextVar[Deadline] = contextvars.ContextVar("current_deadline", default=_NO_DEADLINE)
+
+
+def current_deadline() -> Deadline:
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[Deadline]:
+    """Делает дедлайн текущим; вложенная область не может его продлить"""
+    deadline = current_deadline().earliest(seconds)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+class RetryStats:
+    """Счетчики попыток и времени, потраченного на повторы, по операциям"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, name: str, attempts: int, outcome: str, retry_seconds: float):
+        with self._lock:
+            stats = self._stats.setdefault(name, {
+                "calls": 0, "attempts": 0, "retries": 0, "retry_seconds": 0.0,
+                "ok": 0, "fatal": 0, "exhausted": 0, "deadline": 0
+            })
+            stats["calls"] += 1
+            stats["attempts"] += attempts
+            stats["retries"] += attempts - 1
+            stats["retry_seconds"] += retry_seconds
+            stats[outcome] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: {**values, "retry_seconds": round(values["retry_seconds"], 3)} for name, values in self._stats.items()}
+
+
+retry_stats = RetryStats()
+
+
+class RetryPolicy:
+    """Повторяет операцию с jitter-задержкой, пока ошибка повторяемая и хватает дедлайна.
+
+    operation(attempt, timeout_scale) возвращает (результат, ошибка): ошибка None
+    означает успех, иначе это текст или исключение для классификации.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 8.0,
+        multiplier: float = 2.0,
+        jitter: float = 0.5,
+        timeout_factor: float = 1.5,
+        min_attempt_time: float = 1.0,
+        classify: Callable[[Any], str] = classify_error,
+        stats: Optional[RetryStats] = None,
+        sleep: Callable[[float], None] = time.sleep,
+        rng: Optional[random.Random] = None
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.timeout_factor = timeout_factor
+        # Меньше этого времени до дедлайна - новую попытку не начинаем
+        self.min_attempt_time = min_attempt_time
+        self.classify = classify
+        self.stats = stats if stats is not None else retry_stats
+        self._sleep = sleep
+        self._rng = rng or random.Random()
+
+    def backoff(self, attempt: int) -> float:
+        """Задержка после attempt-й неудачи: экспонента с потолком, случайно уменьшенная на долю jitter"""
+        delay = min(self.max_delay, self.base_delay * (self.multiplier ** (attempt - 1)))
+        return delay * (1 - self.jitter * self._rng.random())
+
+    def timeout_scale(self, attempt: int) -> float:
+        return self.timeout_factor ** (attempt - 1)
+
+    def _decide(self, attempt: int, error: Any, max_attempts: int, deadline: Deadline) -> Tuple[Optional[str], float]:
+        """Исход попытки (ok/fatal/exhausted/deadline) или (None, задержка перед следующей)"""
+        if error is None:
+            return "ok", 0.0
+        if self.classify(error) == FATAL:
+            return "fatal", 0.0
+        if attempt >= max_attempts:
+            return "exhausted", 0.0
+        delay = self.backoff(attempt)
+        if deadline.remaining() < delay + self.min_attempt_time:
+            return "deadline", 0.0
+        return None, delay
+
+    def run(
+        self,
+        name: str,
+        operation: Callable[[int, float], Tuple[Any, Any]],
+        deadline: Optional[Deadline] = None,
+        max_attempts: Optional[int] = None
+    ) -> Any:
+        """Возвращает результат успешной попытки или последней неудачной.
+
+        Исключения операции классифицируются так же, как тексты ошибок;
+        исключение последней попытки пробрасывается.
+        """
+        deadline = deadline or current_deadline()
+        max_attempts = max_attempts or self.max_attempts
+        first_finished = None
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result, error = operation(attempt, self.timeout_scale(attempt))
+                raised = None
+            except Exception as e:
+                result, error, raised = None, e, e
+            if first_finished is None:
+                first_finished = time.monotonic()
+
+            outcome, delay = self._decide(attempt, error, max_attempts, deadline)
+            if outcome is None:
+                self._sleep(delay)
+                continue
+
+            self.stats.record(name, attempt, outcome, time.monotonic() - first_finished)
+            if raised is not None:
+                raise raised
+            return result
+
+    async def run_async(
+        self,
+        name: str,
+        operation: Callable[[int, float], Awaitable[Tuple[Any, Any]]],
+        deadline: Optional[Deadline] = None,
+        max_attempts: Optional[int] = None
+    ) -> Any:
+        """Асинхронный вариант run: operation - корутинная функция, задержка - asyncio.sleep"""
+        deadline = deadline or current_deadline()
+        max_attempts = max_attempts or self.max_attempts
+        first_finished = None
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result, error = await operation(attempt, self.timeout_scale(attempt))
+                raised = None
+            except Exception as e:
+                result, error, raised = None, e, e
+            if first_finished is None:
+                first_finished = time.monotonic()
+
+            outcome, delay = self._decide(attempt, error, max_attempts, deadline)
+            if outcome is None:
+                await asyncio.sleep(delay)
+                continue
+
+            self.stats.record(name, attempt, outcome, time.monotonic() - first_finished)
+            if raised is not None:
+                raise raised
+            return result
@@ -0,0 +1,199 @@
+"""
+Параллельный опрос сервисов скриншотов с проверкой по первым байтам и статистикой провайдеров
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from http_pool import get_http_client
+
+# Сигнатуры изображений, по которым проверяется ответ без полной загрузки
+IMAGE_SIGNATURES = (
+    b"\x89PNG\r\n\x1a\n",
+    b"\xff\xd8\xff",
+    b"GIF87a", b"GIF89a",
+    b"RIFF"
+)
+
+
+def _thum_io(url: str, cache_bust: str) -> str:
+    # thum.io с force refresh
+    return f"https://image.thum.io/get/width/480/crop/360/noanimate/{url}?cache={cache_bust}"
+
+
+def _s_shot(url: str, cache_bust: str) -> str:
+    # s-shot.ru с timestamp
+    return f"https://mini.s-shot.ru/480x360/JPEG/480/Z100/?{url}&_={cache_bust}"
+
+
+def _screenshotapi(url: str, cache_bust: str) -> str:
+    # screenshotapi.net с fresh параметром
+    return (
+        f"https://shot.screenshotapi.net/screenshot?url={url}&output=image&file_type=png"
+        f"&wait_for_event=load&width=480&height=360&fresh=true&cache_bust={cache_bust}"
+    )
+
+
+SCREENSHOT_PROVIDERS: List[Tuple[str, Callable[[str, str], str]]] = [
+    ("thum.io", _thum_io),
+    ("s-shot.ru", _s_shot),
+    ("screenshotapi.net", _screenshotapi)
+]
+
+
+class ProviderStats:
+    """Доля успехов и сглаженная задержка каждого провайдера"""
+
+    def __init__(self, alpha: float = 0.3, default_latency: float = 3.0):
+        self.alpha = alpha
+        self.default_latency = default_latency
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, name: str, success: bool, latency: float):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"success": 0, "failure": 0, "latency": self.default_latency})
+            stats["success" if success else "failure"] += 1
+            if success:
+                stats["latency"] = self.alpha * latency + (1 - self.alpha) * stats["latency"]
+
+    def record_lost(self, name: str, latency: float):
+        """Провайдер проиграл гонку: учитываем только то, что он был не быстрее победителя"""
+        with self._lock:
+            stats = self._stats.setdefault(name, {"success": 0, "failure": 0, "latency": self.default_latency})
+            stats["latency"] = max(stats["latency"], self.alpha * latency + (1 - self.alpha) * stats["latency"])
+
+    def score(self, name: str) -> float:
+        """Ожидаемое время до годного скриншота: меньше - лучше"""
+        with self._lock:
+            stats = self._stats.get(name, {"success": 0, "failure": 0, "latency": self.default_latency})
+            # Сглаживание Лапласа, чтобы новый провайдер не считался заведомо плохим
+            success_rate = (stats["success"] + 1) / (stats["success"] + stats["failure"] + 2)
+            return stats["latency"] / success_rate
+
+    def ranking(self, names: List[str]) -> List[str]:
+        return sorted(names, key=self.score)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: {**values, "latency": round(values["latency"], 3)} for name, values in self._stats.items()}
+
+
+def is_image_response(response: requests.Response, min_size: int = 1000) -> bool:
+    """Проверяет ответ по заголовкам и первым байтам, не скачивая изображение целиком"""
+    if response.status_code != 200:
+        return False
+    content_type = response.headers.get("Content-Type", "")
+    if content_type and not content_type.startswith("image/"):
+        return False
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) < min_size:
+        return False
+    head = next(response.iter_content(chunk_size=16), b"")
+    return head.startswith(IMAGE_SIGNATURES)
+
+
+class ScreenshotRacer:
+    """Запускает провайдеров наперегонки и возвращает первый годный URL.
+
+    Провайдеры с худшей статистикой стартуют с задержкой stagger * место,
+    поэтому медленные и ненадежные сервисы со временем отодвигаются.
+    concurrency - число одновременных захватов: на каждый выделяется поток на провайдера.
+    """
+
+    def __init__(
+        self,
+        providers: List[Tuple[str, Callable[[str, str], str]]] = None,
+        timeout: float = 7.0,
+        stagger: float = 0.5,
+        concurrency: int = 4,
+        fetch: Optional[Callable[..., requests.Response]] = None
+    ):
+        self.providers = dict(providers or SCREENSHOT_PROVIDERS)
+        self.timeout = timeout
+        self.stagger = stagger
+        self.stats = ProviderStats()
+        self._fetch = fetch
+        # Отложенные провайдеры одновременных отчетов не должны ждать свободного потока
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.providers) * concurrency), thread_name_prefix="screenshot")
+        # Отдельный пул для фоновых гонок, чтобы они не ждали слотов своих же попыток
+        self._background = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="screenshot-race")
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        if self._fetch is not None:
+            return self._fetch(url, **kwargs)
+        return get_http_client().get(url, **kwargs)
+
+    def _try_provider(self, name: str, url: str, delay: float, cache_bust: str, winner: Future, cancel: threading.Event):
+        """cancel выставляется, когда победитель найден: отложенный провайдер не запускается,
+        а ответ уже идущего запроса закрывается без чтения тела
+        """
+        # Ожидание прерывается сразу после победы другого провайдера и не держит поток пула
+        if cancel.wait(delay) if delay else cancel.is_set():
+            return
+        started = time.monotonic()
+        success = False
+        try:
+            # Заголовки против кеширования
+            headers = {
+                "Cache-Control": "no-cache, no-store, must-revalidate",
+                "Pragma": "no-cache",
+                "Expires": "0",
+                "User-Agent": f"SlackBot-Screenshot-{cache_bust}"
+            }
+            response = self._get(url, timeout=self.timeout, allow_redirects=True, headers=headers, stream=True)
+            try:
+                success = not cancel.is_set() and is_image_response(response)
+            finally:
+                response.close()
+        except requests.RequestException:
+            success = False
+        finally:
+            elapsed = time.monotonic() - started
+            if success or not cancel.is_set():
+                self.stats.record(name, success, elapsed)
+            else:
+                self.stats.record_lost(name, elapsed)
+        if success and not cancel.is_set():
+            try:
+                winner.set_result(url)
+            except Exception:
+                pass
+
+    def capture(self, target: str) -> str:
+        """Возвращает URL скриншота первого ответившего провайдера или пустую строку"""
+        url = target if target.startswith(("http://", "https://")) else f"https://{target}"
+        # Уникальные параметры против кеширования
+        cache_bust = f"{int(time.time())}{random.randint(10000, 99999)}"
+
+        winner: Future = Future()
+        cancel = threading.Event()
+        winner.add_done_callback(lambda _: cancel.set())
+        attempts = []
+        for rank, name in enumerate(self.stats.ranking(list(self.providers))):
+            service_url = self.providers[name](url, cache_bust)
+            attempts.append(self._executor.submit(self._try_provider, name, service_url, rank * self.stagger, cache_bust, winner, cancel))
+
+        def resolve_when_all_failed(_):
+            if all(attempt.done() for attempt in attempts) and not winner.done():
+                try:
+                    winner.set_result("")
+                except Exception:
+                    pass
+
+        for attempt in attempts:
+            attempt.add_done_callback(resolve_when_all_failed)
+
+        try:
+            return winner.result(timeout=self.timeout + self.stagger * len(attempts) + 1)
+        except Exception:
+            return ""
+
+    def capture_async(self, target: str) -> Future:
+        """Запускает поиск скриншота в фоне"""
+        return self._background.submit(self.capture, target)
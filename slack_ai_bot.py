@@ -1,15 +1,45 @@
 import os
 import json
+import hashlib
 import subprocess
-import re
 import requests
 import time
 import platform
+import signal
+import threading
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from dotenv import load_dotenv
 from openai import OpenAI
-from globalping_with_token import GlobalpingTokenClient
+from globalping_with_token import get_token_client
+from globalping_budget import BudgetExhausted, EndpointBudget, GlobalpingScheduler, TokenFallback
+from http_pool import get_http_client
+from globalping_polling import poll_measurement, poll_stats
+from globalping_models import Measurement, parse_measurement
+from parallel_tasks import run_ordered
+from local_executor import command_limiter, CommandSlotTimeout
+from slack_metadata import SlackMetadata
+from job_queue import DiagnosticsQueue, QueueFull
+from cluster_lease import LeaseCoordinator, event_keys, open_lease_store
+from progress_message import ProgressBoard, ThrottledMessage
+from ai_stream import format_summary, stream_completion, stream_timings
+from metrics import Span, current_report, metrics, report_trace, span, start_metrics_server
+from prompt_builder import build_analysis_prompt, build_comparison_prompt, build_compact_results, compact_results, format_changes
+from target_extraction import TargetExtractor, extract_domain, unique_hosts
+from verdict_cache import VerdictCache, verdict_fingerprint
+from measurement_store import MeasurementStore, render_delta
+from native_probes import is_native_command, native_commands, run_native_command
+from screenshot import ScreenshotRacer
+from diagnostic_steps import (
+    COMMAND_ENCODING, command_failed, command_name, command_not_started, command_outcome,
+    command_span_fields, command_timeout, globalping_cache_key, globalping_error, globalping_result,
+    globalping_stage_timeout, local_error, local_result, local_result_ok, local_stage_timeout,
+    native_outcome, native_span_fields
+)
+from probe_escalation import AdaptiveRun, CreditLedger, EscalationPolicy, ProbeRequest, escalation_stats
+from hedging import Hedger
+from retry_policy import Deadline, RetryPolicy, current_deadline, deadline_scope, retry_stats
+from result_cache import TTLCache, normalize_target, format_cache_age, strip_cache_marks
 
 load_dotenv()
 
@@ -20,138 +50,468 @@ GLOBALPING_API_TOKEN = os.getenv("GLOBALPING_API_TOKEN")
 
 app = App(token=SLACK_BOT_TOKEN)
 client = OpenAI(api_key=OPENAI_API_KEY)
+slack_metadata = SlackMetadata(app.client)
 
 # Конфигурация для восстановления после ошибок
 ERROR_RECOVERY_CONFIG = {
     "max_retries": 3,
+    # Базовая задержка перед повтором; растет экспоненциально до max_retry_delay со случайным разбросом
     "retry_delay": 2,
+    "max_retry_delay": float(os.getenv("RETRY_MAX_DELAY", "8")),
+    "retry_jitter": float(os.getenv("RETRY_JITTER", "0.5")),
     "timeout_increase_factor": 1.5,
     "fallback_locations": ["RU", "EU", "US", "GB"],
-    "emergency_fallback": True
+    "emergency_fallback": True,
+    # Общий лимит времени на отчет: все этапы и повторы внутри него
+    "report_deadline": float(os.getenv("REPORT_DEADLINE", "240"))
 }
 
-def run_command_with_recovery(command, attempt=1):
-    """Выполнение команд с восстановлением после ошибок"""
-    # Настройки таймаутов для разных команд
-    base_timeouts = {
-        "tracert": 20, "traceroute": 20,
-        "pathping": 25, "mtr": 25,
-        "telnet": 8,
-        "ping": 12,
-        "dig": 8, "nslookup": 8,
-        "default": 10
-    }
-    
-    cmd_name = command.split()[0].lower()
-    base_timeout = base_timeouts.get(cmd_name, base_timeouts["default"])
-    
-    # Увеличиваем таймаут с каждой попыткой
-    timeout = int(base_timeout * (ERROR_RECOVERY_CONFIG["timeout_increase_factor"] ** (attempt - 1)))
+retry_policy = RetryPolicy(
+    max_attempts=ERROR_RECOVERY_CONFIG["max_retries"],
+    base_delay=ERROR_RECOVERY_CONFIG["retry_delay"],
+    max_delay=ERROR_RECOVERY_CONFIG["max_retry_delay"],
+    jitter=ERROR_RECOVERY_CONFIG["retry_jitter"],
+    timeout_factor=ERROR_RECOVERY_CONFIG["timeout_increase_factor"]
+)
+
+# Конфигурация параллельного выполнения Globalping тестов
+CONCURRENCY_CONFIG = {
+    "globalping_parallel": os.getenv("GLOBALPING_PARALLEL", "true").lower() == "true",
+    "globalping_max_workers": int(os.getenv("GLOBALPING_MAX_WORKERS", "5")),
+    "globalping_stage_deadline": int(os.getenv("GLOBALPING_STAGE_DEADLINE", "120")),
+    "local_parallel": os.getenv("LOCAL_COMMANDS_PARALLEL", "true").lower() == "true",
+    "local_max_workers": int(os.getenv("LOCAL_MAX_WORKERS", "5")),
+    "local_stage_deadline": int(os.getenv("LOCAL_STAGE_DEADLINE", "60"))
+}
+
+# Кеш результатов: повторные отчеты по той же цели в течение TTL не запускают тесты заново
+RESULT_CACHE_CONFIG = {
+    "enabled": os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true",
+    "ttl": int(os.getenv("RESULT_CACHE_TTL", "60")),
+    "max_entries": int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+}
+
+result_cache = TTLCache(RESULT_CACHE_CONFIG["ttl"], RESULT_CACHE_CONFIG["max_entries"])
+
+def _is_cacheable(result) -> bool:
+    """Ошибки и таймауты не кешируются, чтобы следующий запрос повторил проверку"""
+    if isinstance(result, Measurement):
+        return bool(result.probes)
+    return isinstance(result, str) and not result.startswith(("❌", "⏱️"))
+
+def cached_call(key: tuple, compute):
+    """Возвращает (результат, возраст кеша) с объединением одновременных запросов"""
+    if not RESULT_CACHE_CONFIG["enabled"]:
+        return compute(), None
+    return result_cache.get_or_compute(key, compute, should_cache=_is_cacheable)
+
+# Бюджет проб Globalping, общий для всех отчетов: часовые лимиты API, кредиты и ведро токенов
+GLOBALPING_BUDGET_CONFIG = {
+    "token_rate_per_hour": float(os.getenv("GLOBALPING_TOKEN_RATE_PER_HOUR", "500")),
+    "public_rate_per_hour": float(os.getenv("GLOBALPING_PUBLIC_RATE_PER_HOUR", "250")),
+    "burst": float(os.getenv("GLOBALPING_BURST", "40")),
+    "min_limit": int(os.getenv("GLOBALPING_MIN_LIMIT", "1")),
+    # Доля часового лимита, ниже которой измерения запускаются с минимальным числом проб
+    "low_fraction": float(os.getenv("GLOBALPING_LOW_BUDGET_FRACTION", "0.2")),
+    "max_wait": float(os.getenv("GLOBALPING_BUDGET_MAX_WAIT", "20"))
+}
+
+globalping_scheduler = GlobalpingScheduler(
+    {
+        "token": EndpointBudget("token", GLOBALPING_BUDGET_CONFIG["token_rate_per_hour"], GLOBALPING_BUDGET_CONFIG["burst"]),
+        "public": EndpointBudget("public", GLOBALPING_BUDGET_CONFIG["public_rate_per_hour"], GLOBALPING_BUDGET_CONFIG["burst"])
+    },
+    min_limit=GLOBALPING_BUDGET_CONFIG["min_limit"],
+    low_fraction=GLOBALPING_BUDGET_CONFIG["low_fraction"]
+)
+
+# Хеджирование: если токен-тест не завершился за перцентиль обычной задержки, параллельно запускается публичный
+HEDGE_CONFIG = {
+    "enabled": os.getenv("GLOBALPING_HEDGING", "true").lower() == "true",
+    "percentile": float(os.getenv("GLOBALPING_HEDGE_PERCENTILE", "0.9")),
+    "min_delay": float(os.getenv("GLOBALPING_HEDGE_MIN_DELAY", "3")),
+    "max_delay": float(os.getenv("GLOBALPING_HEDGE_MAX_DELAY", "20")),
+    "default_delay": float(os.getenv("GLOBALPING_HEDGE_DEFAULT_DELAY", "8"))
+}
+
+globalping_hedger = Hedger(
+    percentile=HEDGE_CONFIG["percentile"],
+    min_delay=HEDGE_CONFIG["min_delay"],
+    max_delay=HEDGE_CONFIG["max_delay"],
+    default_delay=HEDGE_CONFIG["default_delay"]
+) if HEDGE_CONFIG["enabled"] and GLOBALPING_API_TOKEN else None
+
+# Поиск целей в сообщениях: игнорируемые домены (вместе с поддоменами) и лимит просматриваемого текста
+TARGET_CONFIG = {
+    "ignore": [host for host in os.getenv("TARGET_IGNORE", "backup03.itsoft.ru,slack.com").split(",") if host.strip()],
+    "max_scan_bytes": int(os.getenv("TARGET_MAX_SCAN_BYTES", "65536"))
+}
+
+target_extractor = TargetExtractor(TARGET_CONFIG["ignore"], TARGET_CONFIG["max_scan_bytes"])
+
+# Несколько целей в одном сообщении (сайт, API, CDN) проверяются параллельно с общим AI анализом
+MULTI_TARGET_CONFIG = {
+    "enabled": os.getenv("MULTI_TARGET", "true").lower() == "true",
+    "max_targets": max(1, int(os.getenv("MULTI_TARGET_MAX", "3")))
+}
+
+GLOBALPING_TESTS = ["ping", "http", "dns", "traceroute", "mtr"]
+
+# Адаптивные пробы: ping/http/dns с дешевого набора, расширение и трассировки только при проблемах
+PROBE_ESCALATION_CONFIG = {
+    "enabled": os.getenv("GLOBALPING_ADAPTIVE", "true").lower() == "true",
+    "initial_locations": [loc.strip() for loc in os.getenv("GLOBALPING_INITIAL_LOCATIONS", "RU,EU").split(",") if loc.strip()],
+    "initial_limit": int(os.getenv("GLOBALPING_INITIAL_PROBES", "2")),
+    "escalation_locations": [loc.strip() for loc in os.getenv("GLOBALPING_ESCALATION_LOCATIONS", "RU,EU,US,GB,Asia").split(",") if loc.strip()],
+    "escalation_limit": int(os.getenv("GLOBALPING_ESCALATION_PROBES", "6")),
+    "max_path_locations": int(os.getenv("GLOBALPING_PATH_MAX_LOCATIONS", "3")),
+    "loss_threshold": float(os.getenv("GLOBALPING_ESCALATE_LOSS", "5")),
+    "rtt_factor": float(os.getenv("GLOBALPING_ESCALATE_RTT_FACTOR", "3")),
+    "rtt_min_delta": float(os.getenv("GLOBALPING_ESCALATE_RTT_MIN_DELTA", "100")),
+    # Статусы выше считаются проблемой (399 - редиректы в норме)
+    "http_ok_max": int(os.getenv("GLOBALPING_ESCALATE_HTTP_OK_MAX", "399")),
+    "dns_mismatch": os.getenv("GLOBALPING_ESCALATE_DNS_MISMATCH", "true").lower() == "true"
+}
+
+escalation_policy = EscalationPolicy(
+    {key: value for key, value in PROBE_ESCALATION_CONFIG.items() if key != "enabled"}
+) if PROBE_ESCALATION_CONFIG["enabled"] else None
+
+# Пункт статус-сообщения с кредитами, потраченными на цель
+CREDITS_ITEM = "кредиты"
+
+# Очередь между приемом событий и диагностикой
+QUEUE_CONFIG = {
+    "workers": int(os.getenv("DIAGNOSTICS_WORKERS", "4")),
+    "max_depth": int(os.getenv("DIAGNOSTICS_MAX_QUEUE", "20"))
+}
+
+diagnostics_queue = DiagnosticsQueue(QUEUE_CONFIG["workers"], QUEUE_CONFIG["max_depth"])
+
+# Несколько экземпляров бота: событие диагностирует тот узел, который первым захватил его аренду
+CLUSTER_CONFIG = {
+    # memory:// - только повторные доставки в этот процесс, sqlite:///путь - процессы одного хоста, пусто - отключено
+    "lease_store": os.getenv("CLUSTER_LEASE_STORE", "memory://"),
+    "node_id": os.getenv("CLUSTER_NODE_ID") or None,
+    "lease_ttl": float(os.getenv("CLUSTER_LEASE_TTL", "60")),
+    # Сколько обработанное событие остается занятым для повторных доставок
+    "done_ttl": float(os.getenv("CLUSTER_DONE_TTL", "3600")),
+    # Сколько при остановке ждать текущих диагностик
+    "drain_timeout": float(os.getenv("CLUSTER_DRAIN_TIMEOUT", "240"))
+}
+
+lease_coordinator = LeaseCoordinator(
+    open_lease_store(CLUSTER_CONFIG["lease_store"]),
+    owner=CLUSTER_CONFIG["node_id"],
+    ttl=CLUSTER_CONFIG["lease_ttl"],
+    done_ttl=CLUSTER_CONFIG["done_ttl"]
+) if CLUSTER_CONFIG["lease_store"] else None
+
+# Потоковый режим: один статус-ответ, обновляемый через chat.update по мере завершения тестов
+PROGRESS_CONFIG = {
+    "streaming": os.getenv("PROGRESS_STREAMING", "true").lower() == "true",
+    "min_update_interval": float(os.getenv("PROGRESS_MIN_UPDATE_INTERVAL", "1.5")),
+    "ai_streaming": os.getenv("AI_STREAMING", "true").lower() == "true"
+}
+
+# Сжатие результатов перед отправкой в AI
+PROMPT_CONFIG = {
+    "compact": os.getenv("PROMPT_COMPACT", "true").lower() == "true",
+    "token_budget": int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+}
+
+# Постоянный кеш AI заключений по отпечатку нормализованных результатов
+VERDICT_CACHE_CONFIG = {
+    "enabled": os.getenv("VERDICT_CACHE_ENABLED", "true").lower() == "true",
+    "path": os.getenv("VERDICT_CACHE_PATH", "logs/verdict_cache.sqlite3"),
+    "max_entries": int(os.getenv("VERDICT_CACHE_MAX_ENTRIES", "1000")),
+    "max_age": int(os.getenv("VERDICT_CACHE_MAX_AGE", "21600"))
+}
+
+verdict_cache = VerdictCache(
+    VERDICT_CACHE_CONFIG["path"],
+    max_entries=VERDICT_CACHE_CONFIG["max_entries"],
+    max_age=VERDICT_CACHE_CONFIG["max_age"]
+) if VERDICT_CACHE_CONFIG["enabled"] else None
+
+# История измерений: изменения относительно последнего исправного запуска цели
+HISTORY_CONFIG = {
+    "enabled": os.getenv("HISTORY_ENABLED", "true").lower() == "true",
+    "path": os.getenv("HISTORY_PATH", "logs/measurements.sqlite3"),
+    "retention_days": float(os.getenv("HISTORY_RETENTION_DAYS", "30")),
+    "max_runs": int(os.getenv("HISTORY_MAX_RUNS_PER_TARGET", "200")),
+    # Изменения публикуются в треде перед AI анализом
+    "post_delta": os.getenv("HISTORY_POST_DELTA", "true").lower() == "true"
+}
+
+measurement_store = MeasurementStore(
+    HISTORY_CONFIG["path"],
+    retention=HISTORY_CONFIG["retention_days"] * 86400,
+    max_runs=HISTORY_CONFIG["max_runs"]
+) if HISTORY_CONFIG["enabled"] else None
+
+# Встроенные DNS/HTTP пробы вместо запуска dig/nslookup/curl
+NATIVE_PROBES_CONFIG = {
+    "enabled": os.getenv("NATIVE_PROBES", "true").lower() == "true",
+    "timeout": float(os.getenv("NATIVE_PROBE_TIMEOUT", "10")),
+    "dns_server": os.getenv("NATIVE_DNS_SERVER") or None
+}
+
+# Скриншот: провайдеры опрашиваются параллельно, худшие стартуют с задержкой
+SCREENSHOT_CONFIG = {
+    "timeout": float(os.getenv("SCREENSHOT_TIMEOUT", "7")),
+    "stagger": float(os.getenv("SCREENSHOT_STAGGER", "0.5")),
+    # Одновременных захватов: по умолчанию - по одному на обработчик очереди диагностики
+    "concurrency": int(os.getenv("SCREENSHOT_CONCURRENCY", str(QUEUE_CONFIG["workers"])))
+}
+
+screenshot_racer = ScreenshotRacer(
+    timeout=SCREENSHOT_CONFIG["timeout"],
+    stagger=SCREENSHOT_CONFIG["stagger"],
+    concurrency=SCREENSHOT_CONFIG["concurrency"]
+)
+
+# Метрики этапов: /metrics для Prometheus и JSON строка на каждый отчет
+METRICS_CONFIG = {
+    "host": os.getenv("METRICS_HOST", "127.0.0.1"),
+    # 0 - не поднимать HTTP endpoint
+    "port": int(os.getenv("METRICS_PORT", "9108")),
+    "report_log": os.getenv("METRICS_REPORT_LOG", "logs/reports.jsonl")
+}
+
+metrics.add_collector("http_pool", lambda: get_http_client().stats())
+metrics.add_collector("result_cache", result_cache.stats)
+metrics.add_collector("queue", diagnostics_queue.stats, labels={"channels": "channel"})
+metrics.add_collector("local_commands", command_limiter.stats)
+metrics.add_collector("globalping_polls", lambda: poll_stats.snapshot()["by_test_type"])
+metrics.add_collector("screenshot_providers", screenshot_racer.stats.snapshot)
+metrics.add_collector("ai_stream", stream_timings.snapshot)
+metrics.add_collector("slack_api", slack_metadata.stats)
+metrics.add_collector("globalping_budget", globalping_scheduler.stats)
+metrics.add_collector("retries", retry_stats.snapshot)
+metrics.add_collector("globalping_escalation", escalation_stats.snapshot)
+if globalping_hedger is not None:
+    metrics.add_collector("globalping_hedging", globalping_hedger.stats.snapshot)
+if verdict_cache is not None:
+    metrics.add_collector("verdict_cache", verdict_cache.stats)
+if measurement_store is not None:
+    metrics.add_collector("history", measurement_store.stats)
+if lease_coordinator is not None:
+    metrics.add_collector("cluster", lease_coordinator.stats)
+
+def run_command_with_recovery(command, deadline: Deadline = None):
+    """Выполнение команд с восстановлением после ошибок.
+
+    deadline - Deadline, к которому должны уложиться все попытки; по умолчанию дедлайн отчета.
+    """
+    cmd_name = command_name(command)
+    deadline = deadline or current_deadline()
     
-    try:
-        # Определяем кодировку в зависимости от ОС
-        encoding = 'cp866' if platform.system().lower() == 'windows' else 'utf-8'
-            
-        proc = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=True,
-            encoding=encoding,
-            errors='replace'
-        )
+    def attempt_once(attempt, timeout_scale):
+        timeout = command_timeout(cmd_name, timeout_scale, deadline)
+        if timeout <= 0:
+            return command_not_started(cmd_name)
         
         try:
-            stdout, stderr = proc.communicate(timeout=timeout)
-            
-            # Проверяем успешность выполнения
-            if proc.returncode == 0 and stdout.strip():
-                return stdout
-            elif stderr.strip():
-                # Если есть ошибка, пробуем повторить
-                if attempt < ERROR_RECOVERY_CONFIG["max_retries"]:
-                    time.sleep(ERROR_RECOVERY_CONFIG["retry_delay"])
-                    return run_command_with_recovery(command, attempt + 1)
-                return f"❌ Ошибка после {attempt} попыток: {stderr.strip()}"
-            else:
-                return stdout if stdout else "⚠️ Команда выполнена, но результат пуст"
-                
-        except subprocess.TimeoutExpired:
-            proc.kill()
-            
-            # Пробуем повторить с увеличенным таймаутом
-            if attempt < ERROR_RECOVERY_CONFIG["max_retries"]:
-                time.sleep(ERROR_RECOVERY_CONFIG["retry_delay"])
-                return run_command_with_recovery(command, attempt + 1)
-                
-            return f"⏱️ {cmd_name.title()} прерван по таймауту ({timeout}с) после {attempt} попыток"
-
-    except FileNotFoundError:
-        return f"❌ Команда не найдена: {cmd_name} (возможно, не установлена в системе)"
-    except Exception as e:
-        if attempt < ERROR_RECOVERY_CONFIG["max_retries"]:
-            time.sleep(ERROR_RECOVERY_CONFIG["retry_delay"])
-            return run_command_with_recovery(command, attempt + 1)
-        return f"❌ Критическая ошибка {cmd_name}: {str(e)}"
+            with span(f"local.{cmd_name}.attempt", attempt=attempt, command=command) as attempt_span:
+                # Ограничиваем число одновременных процессов этого вида на хосте
+                with command_limiter.slot(cmd_name, deadline.at):
+                    proc = subprocess.Popen(
+                        command,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        shell=True,
+                        encoding=COMMAND_ENCODING,
+                        errors='replace'
+                    )
+                    
+                    try:
+                        stdout, stderr = proc.communicate(timeout=timeout)
+                        finished = (proc.returncode, stdout, stderr)
+                    except subprocess.TimeoutExpired:
+                        proc.kill()
+                        proc.communicate()
+                        finished = None
+                attempt_span.set(**command_span_fields(finished))
+        except CommandSlotTimeout:
+            return command_not_started(cmd_name, slots_busy=True)
+        except Exception as e:
+            return command_failed(cmd_name, e)
+        
+        return command_outcome(cmd_name, attempt, timeout, finished)
+    
+    return retry_policy.run(f"local.{cmd_name}", attempt_once, deadline=deadline)
 
-def globalping_test_with_recovery(target: str, test_type: str, attempt=1) -> str:
-    """Выполнение Globalping тестов с восстановлением после ошибок"""
+def run_native_with_recovery(command, deadline: Deadline = None):
+    """Встроенная проба с теми же повторами и дедлайном, что у системных команд"""
+    cmd_name = command_name(command)
+    deadline = deadline or current_deadline()
+    
+    def attempt_once(attempt, timeout_scale):
+        timeout = command_timeout(cmd_name, timeout_scale, deadline, base_timeout=NATIVE_PROBES_CONFIG["timeout"])
+        if timeout <= 0:
+            return command_not_started(cmd_name)
+        with span(f"local.{cmd_name}.attempt", attempt=attempt, command=command) as attempt_span:
+            output = run_native_command(command, timeout=timeout, dns_server=NATIVE_PROBES_CONFIG["dns_server"])
+            attempt_span.set(**native_span_fields(output))
+        return native_outcome(output)
+    
+    return retry_policy.run(f"local.{cmd_name}", attempt_once, deadline=deadline)
+
+def run_local_commands(commands: list, on_result=None) -> list:
+    """Выполняет локальные команды (параллельно или последовательно) в исходном порядке"""
+    # Все попытки всех команд укладываются в дедлайн этапа, но не позже дедлайна отчета
+    deadline = current_deadline().earliest(CONCURRENCY_CONFIG["local_stage_deadline"])
+    stage_deadline = int(deadline.remaining())
+    
+    def run_one(command):
+        with span(f"local.{command_name(command)}", command=command) as command_span:
+            try:
+                if is_native_command(command):
+                    compute = lambda: run_native_with_recovery(command, deadline=deadline)
+                else:
+                    compute = lambda: run_command_with_recovery(command, deadline=deadline)
+                output, age = cached_call(("local", command), compute)
+                text, outcome = local_result(command, output, age)
+                command_span.set(outcome=outcome, bytes=len(output))
+                return text
+            except Exception as e:
+                command_span.set(outcome="error")
+                return local_error(command, e)
+    
+    if not CONCURRENCY_CONFIG["local_parallel"]:
+        results = []
+        for command in commands:
+            results.append(run_one(command))
+            if on_result:
+                on_result(command, results[-1])
+        return results
+    
+    tasks = [(command, lambda command=command: run_one(command)) for command in commands]
+    return run_ordered(
+        tasks,
+        max_workers=CONCURRENCY_CONFIG["local_max_workers"],
+        # Небольшой запас, чтобы команды успели вернуть свой таймаут
+        deadline=stage_deadline + 5,
+        on_timeout=lambda command: local_stage_timeout(command, stage_deadline),
+        on_result=on_result
+    )
+
+def globalping_locations(attempt: int) -> list:
+    """Локации измерения: расширенные для лучшего покрытия, на повторах - запасные"""
+    return ["RU", "EU", "US", "GB"] if attempt == 1 else list(ERROR_RECOVERY_CONFIG["fallback_locations"])
+
+def globalping_request(attempt: int, request: ProbeRequest = None) -> ProbeRequest:
+    """Пробы попытки: заданные адаптивным режимом или стандартный набор (4 пробы, на повторах - 2)"""
+    if request is not None:
+        return request.for_attempt(attempt)
+    return ProbeRequest(tuple(globalping_locations(attempt)), 4 if attempt == 1 else 2)
+
+def token_fallback() -> TokenFallback:
+    """Переход с токена на публичный API для одного теста"""
+    return TokenFallback(
+        globalping_scheduler,
+        use_token=bool(GLOBALPING_API_TOKEN),
+        enabled=ERROR_RECOVERY_CONFIG["emergency_fallback"],
+        min_limit=GLOBALPING_BUDGET_CONFIG["min_limit"]
+    )
+
+def globalping_test_with_recovery(target: str, test_type: str, request: ProbeRequest = None):
+    """Выполнение Globalping тестов с восстановлением после ошибок.
+
+    Каждая попытка берет разрешение у планировщика бюджета; после ошибки токена
+    следующие попытки идут через публичный API, если у него есть запас, а если токен
+    отклонен (HTTP 401/403/429) - публичный API запрашивается в той же попытке.
+    request задает локации и число проб, по умолчанию - стандартный набор.
+    Возвращает Measurement при успехе или текст ошибки.
+    """
     
     # Очищаем цель от протокола
-    clean_target = target
-    if target.startswith(("http://", "https://")):
-        clean_target = target.replace("https://", "").replace("http://", "").split("/")[0]
+    clean_target = extract_domain(target)
+    
+    deadline = current_deadline()
+    fallback = token_fallback()
     
-    # Приоритет 1: API Token (если есть)
-    if GLOBALPING_API_TOKEN:
+    def attempt_once(attempt, timeout_scale):
+        # Токен используется, пока у него есть запас; публичный API - только если запас есть у него
+        probes = globalping_request(attempt, request)
         try:
-            token_client = GlobalpingTokenClient(GLOBALPING_API_TOKEN)
-            
-            # Выбираем метод в зависимости от типа теста
-            test_methods = {
-                "ping": token_client.ping,
-                "http": token_client.http,
-                "dns": token_client.dns,
-                "traceroute": token_client.traceroute,
-                "mtr": token_client.mtr
-            }
-            
-            if test_type in test_methods:
-                # Используем расширенные локации для лучшего покрытия
-                locations = "RU,EU,US,GB" if attempt == 1 else ",".join(ERROR_RECOVERY_CONFIG["fallback_locations"])
-                limit = 4 if attempt == 1 else 2
-                
-                result = test_methods[test_type](clean_target, locations, limit)
-                
-                if result["success"]:
-                    return f"✅ {result['result']}"
-                else:
-                    # Если токен не сработал, пробуем fallback
-                    if attempt < ERROR_RECOVERY_CONFIG["max_retries"] and ERROR_RECOVERY_CONFIG["emergency_fallback"]:
-                        time.sleep(ERROR_RECOVERY_CONFIG["retry_delay"])
-                        return public_api_fallback(clean_target, test_type, attempt + 1)
-                    return f"❌ **Ошибка {test_type}** (токен): {result['error']}"
-                    
-        except Exception as e:
-            # Если токен полностью не работает, переходим к публичному API
-            if attempt == 1 and ERROR_RECOVERY_CONFIG["emergency_fallback"]:
-                return public_api_fallback(clean_target, test_type, attempt)
-            return f"❌ **Критическая ошибка {test_type}**: {str(e)}"
+            grant = globalping_scheduler.acquire(probes.limit, order=fallback.order, max_wait=deadline.cap(GLOBALPING_BUDGET_CONFIG["max_wait"]))
+        except BudgetExhausted as e:
+            return f"❌ **Ошибка {test_type}**: бюджет Globalping исчерпан, {e}", e
+        if grant.reduced or grant.waited > 0.5:
+            print(f"🚦 Globalping {test_type}: {grant.endpoint}, проб {grant.limit} из {grant.requested}, ожидание {grant.waited:.1f}с")
+        
+        if grant.endpoint == "public":
+            return _public_api_attempt(clean_target, test_type, attempt, timeout_scale, grant, deadline, probes=probes)
+        
+        # Приоритет 1: API Token
+        token_client = get_token_client(GLOBALPING_API_TOKEN, scheduler=globalping_scheduler)
+        test_methods = {
+            "ping": token_client.ping,
+            "http": token_client.http,
+            "dns": token_client.dns,
+            "traceroute": token_client.traceroute,
+            "mtr": token_client.mtr
+        }
+        if test_type not in test_methods:
+            return _public_api_attempt(clean_target, test_type, attempt, timeout_scale, grant, deadline, probes=probes)
+        
+        locations = ",".join(probes.locations)
+        public_attempt = lambda cancel=None: _public_api_attempt(clean_target, test_type, attempt, timeout_scale, None, deadline, cancel=cancel, probes=probes)
+        
+        def token_attempt(cancel=None):
+            with span(f"globalping.{test_type}.attempt", attempt=attempt, source="token") as attempt_span:
+                result = test_methods[test_type](
+                    clean_target, locations, grant.limit,
+                    max_wait=deadline.cap(token_client.max_wait * timeout_scale), cancel=cancel
+                )
+                outcome = "ok" if result["success"] else ("cancelled" if result["error"] == "Cancelled" else "error")
+                attempt_span.set(outcome=outcome, bytes=result.get("bytes", 0), polls=result.get("polls", 0))
+            if result["success"]:
+                return result["measurement"], None
+            return f"❌ **Ошибка {test_type}** (токен): {result['error']}", result["error"]
+        
+        def hedged_attempt():
+            if globalping_hedger is None or not ERROR_RECOVERY_CONFIG["emergency_fallback"]:
+                return token_attempt()
+            # Задержавшийся токен-тест дублируется через публичный API, берется первый результат
+            result, error, winner = globalping_hedger.run(
+                test_type,
+                token_attempt,
+                public_attempt,
+                can_hedge=lambda: globalping_scheduler.has_headroom("public", GLOBALPING_BUDGET_CONFIG["min_limit"]),
+                timeout=None if deadline.at is None else deadline.remaining() + 5
+            )
+            if winner == "secondary":
+                print(f"🏁 Globalping {test_type}: публичный API опередил токен")
+            return result, error
+        
+        # Если токен не сработал, следующие попытки идут через публичный API, а при отказе токена - эта же
+        return fallback.run(hedged_attempt, public_attempt)
     
-    # Приоритет 2: Публичный API (если нет токена или токен не работает)
-    return public_api_fallback(clean_target, test_type, attempt)
+    try:
+        return retry_policy.run(f"globalping.{test_type}", attempt_once, deadline=deadline)
+    except Exception as e:
+        return globalping_error(test_type, e)
+
+def _public_api_attempt(target: str, test_type: str, attempt: int, timeout_scale: float, grant, deadline: Deadline, cancel=None, probes: ProbeRequest = None):
+    """Одна попытка через публичный API: возвращает (результат, ошибка) для RetryPolicy.
 
-def public_api_fallback(target: str, test_type: str, attempt=1) -> str:
-    """Fallback к публичному API с восстановлением после ошибок"""
+    cancel прерывает ожидание результатов, если хеджирующий запрос проиграл.
+    """
+    attempt_span = Span(f"globalping.{test_type}.attempt", attempt=attempt, source="public")
     try:
-        # Настройка локаций в зависимости от попытки
-        if attempt == 1:
-            locations = [{"magic": "RU"}, {"magic": "EU"}, {"magic": "US"}, {"magic": "GB"}]
-            limit = 4
-        else:
-            # Упрощенная конфигурация для повторных попыток
-            locations = [{"magic": loc} for loc in ERROR_RECOVERY_CONFIG["fallback_locations"]]
-            limit = len(locations)
+        probes = probes or globalping_request(attempt)
+        locations = [{"magic": loc} for loc in probes.locations]
+        
+        if grant is None or grant.endpoint != "public":
+            try:
+                grant = globalping_scheduler.acquire(min(probes.limit, len(locations)), order=("public",), max_wait=deadline.cap(GLOBALPING_BUDGET_CONFIG["max_wait"]))
+            except BudgetExhausted as e:
+                attempt_span.finish("throttled")
+                return f"❌ **Ошибка {test_type}**: бюджет публичного API исчерпан, {e}", e
+        limit = min(grant.limit, len(locations))
         
         payload = {
             "type": test_type,
@@ -166,212 +526,216 @@ def public_api_fallback(target: str, test_type: str, attempt=1) -> str:
         elif test_type == "dns":
             payload["measurementOptions"] = {"query": {"type": "A"}}
         
-        # Увеличиваем таймаут для повторных попыток
-        timeout = 10 * (ERROR_RECOVERY_CONFIG["timeout_increase_factor"] ** (attempt - 1))
+        # Увеличиваем таймаут для повторных попыток, но не дольше дедлайна отчета
+        timeout = max(1, deadline.cap(10 * timeout_scale))
         
-        response = requests.post(
+        http_client = get_http_client()
+        response = http_client.post(
             "https://api.globalping.io/v1/measurements", 
             json=payload, 
             timeout=timeout
         )
+        globalping_scheduler.update("public", response)
         
         if response.status_code != 202:
-            if attempt < ERROR_RECOVERY_CONFIG["max_retries"]:
-                time.sleep(ERROR_RECOVERY_CONFIG["retry_delay"])
-                return public_api_fallback(target, test_type, attempt + 1)
-            return f"❌ **Ошибка {test_type}**: HTTP {response.status_code} после {attempt} попыток"
+            attempt_span.finish("error", bytes=len(response.content), http_status=response.status_code)
+            error = f"HTTP {response.status_code}"
+            return f"❌ **Ошибка {test_type}**: {error} после {attempt} попыток", error
         
         measurement_id = response.json().get("id")
         if not measurement_id:
-            return f"❌ **Ошибка {test_type}**: Нет ID измерения"
+            attempt_span.finish("error", bytes=len(response.content))
+            return f"❌ **Ошибка {test_type}**: Нет ID измерения", "no measurement id"
         
         # Ждем результаты с увеличенным таймаутом для повторных попыток
-        max_wait_cycles = 20 + (5 * attempt)
+        max_wait = deadline.cap(20 + (5 * attempt))
         
-        for cycle in range(max_wait_cycles):
-            time.sleep(1)
-            try:
-                result_response = requests.get(
-                    f"https://api.globalping.io/v1/measurements/{measurement_id}", 
-                    timeout=timeout
-                )
-                
-                if result_response.status_code == 200:
-                    data = result_response.json()
-                    status = data.get("status", "unknown")
-                    
-                    if status == "finished":
-                        return format_public_results(data, test_type, target)
-                    elif status == "failed":
-                        error_msg = data.get("error", "Неизвестная ошибка")
-                        if attempt < ERROR_RECOVERY_CONFIG["max_retries"]:
-                            time.sleep(ERROR_RECOVERY_CONFIG["retry_delay"])
-                            return public_api_fallback(target, test_type, attempt + 1)
-                        return f"❌ **Ошибка {test_type}**: Тест завершился с ошибкой: {error_msg}"
-                        
-            except requests.RequestException as e:
-                # Игнорируем временные сетевые ошибки и продолжаем ждать
-                if cycle > max_wait_cycles - 5:  # Только в конце показываем ошибки
-                    print(f"⚠️ Сетевая ошибка при получении результатов: {e}")
-                continue
+        def report_poll_error(error, remaining):
+            # Только в конце показываем ошибки
+            if remaining < 5:
+                print(f"⚠️ Сетевая ошибка при получении результатов: {error}")
+        
+        poll = poll_measurement(
+            http_client.session,
+            f"https://api.globalping.io/v1/measurements/{measurement_id}",
+            measurement_id,
+            test_type,
+            max_wait=max_wait,
+            request_timeout=timeout,
+            on_error=report_poll_error,
+            cancel=cancel
+        )
+        attempt_span.finish(
+            "ok" if poll["status"] == "finished" else (poll["status"] if poll["status"] in ("timeout", "cancelled") else "error"),
+            bytes=len(response.content) + poll["bytes"],
+            polls=poll["polls"]
+        )
+        
+        if poll["status"] == "finished":
+            return parse_measurement(poll["data"], test_type, target), None
+        elif poll["status"] == "failed":
+            error_msg = poll["data"].get("error", "Неизвестная ошибка")
+            return f"❌ **Ошибка {test_type}**: Тест завершился с ошибкой: {error_msg}", error_msg
+        elif poll["status"] == "cancelled":
+            return f"❌ **Ошибка {test_type}**: Измерение отменено", "cancelled"
+        elif poll["status"] == "rejected":
+            return f"❌ **Ошибка {test_type}**: HTTP {poll['http_status']} при получении результатов", f"HTTP {poll['http_status']}"
         
         # Таймаут ожидания результатов
-        if attempt < ERROR_RECOVERY_CONFIG["max_retries"]:
-            time.sleep(ERROR_RECOVERY_CONFIG["retry_delay"])
-            return public_api_fallback(target, test_type, attempt + 1)
-        return f"❌ **Ошибка {test_type}**: Таймаут ожидания после {attempt} попыток"
+        return f"❌ **Ошибка {test_type}**: Таймаут ожидания после {attempt} попыток", "timeout"
         
     except Exception as e:
-        if attempt < ERROR_RECOVERY_CONFIG["max_retries"]:
-            time.sleep(ERROR_RECOVERY_CONFIG["retry_delay"])
-            return public_api_fallback(target, test_type, attempt + 1)
-        return f"❌ **Критическая ошибка {test_type}**: {str(e)} (попытка {attempt})"
-
-def format_public_results(result_data: dict, test_type: str, target: str) -> str:
-    """Форматирование результатов публичного API"""
-    results = []
+        attempt_span.finish("error")
+        return f"❌ **Критическая ошибка {test_type}**: {str(e)} (попытка {attempt})", e
+
+def cached_globalping_test(target: str, test_type: str, measurements: dict = None, request: ProbeRequest = None, ledger: CreditLedger = None) -> str:
+    """Globalping тест через кеш результатов по нормализованной цели и набору проб.
+
+    В кеше хранятся типизированные записи; в measurements они передаются дальше для AI анализа.
+    Пробы свежих измерений записываются в ledger как потраченные кредиты.
+    """
+    with span(f"globalping.{test_type}", probe_set=request.stage if request else "standard") as test_span:
+        result, age = cached_call(globalping_cache_key(target, test_type, request), lambda: globalping_test_with_recovery(target, test_type, request))
+        text, fields = globalping_result(test_type, result, age, request, measurements, ledger)
+        test_span.set(**fields)
+    return text
+
+def cached_analysis(target: str, all_results: str, on_text=None, measurements: dict = None, changes: list = None) -> tuple:
+    """AI анализ через кеш: повторно используется только для тех же результатов и изменений"""
+    ai_span = Span("ai")
+    fingerprint = None
+    if verdict_cache is not None:
+        # Существенно не изменившиеся результаты не требуют нового вызова модели
+        fingerprint = verdict_fingerprint(
+            normalize_target(target), compact_results(all_results, measurements=measurements), changes=changes
+        )
+        cached = verdict_cache.get(fingerprint)
+        if cached is not None:
+            ai_span.finish("verdict_cache", bytes=len(cached[0].encode("utf-8")))
+            return cached
     
-    for result in result_data.get("results", []):
-        probe = result.get("probe", {})
-        country = probe.get("country", "Unknown")
-        city = probe.get("city", "Unknown")
-        location = f"{city}, {country}"
-        
+    digest = hashlib.sha256(f"{strip_cache_marks(all_results)}\n{changes}".encode("utf-8")).hexdigest()
+    analysis, age = cached_call(
+        ("analysis", normalize_target(target), digest),
+        lambda: analyze_all_results(target, all_results, on_text=on_text, measurements=measurements, changes=changes)
+    )
+    if fingerprint is not None and age is None and _is_cacheable(analysis):
+        verdict_cache.put(fingerprint, normalize_target(target), analysis)
+    ai_span.finish(
+        "cached" if age is not None else ("ok" if _is_cacheable(analysis) else "error"),
+        bytes=len(analysis.encode("utf-8"))
+    )
+    return analysis, age
+
+def record_history(target: str, all_results: str, measurements: dict = None):
+    """Сохраняет сводку запуска в историю и возвращает Delta относительно последнего исправного запуска.
+
+    None - история отключена или недоступна.
+    """
+    if measurement_store is None:
+        return None
+    with span("history", target=target) as history_span:
         try:
-            if test_type == "ping":
-                stats = result.get("result", {}).get("stats", {})
-                avg_time = stats.get("avg", "N/A")
-                packet_loss = stats.get("loss", "N/A")
-                results.append(f"📍 {location}: {avg_time}ms (потерь: {packet_loss}%)")
-                
-            elif test_type == "http":
-                http_result = result.get("result", {})
-                status = http_result.get("status", "N/A")
-                total_time = http_result.get("timings", {}).get("total", "N/A")
-                results.append(f"📍 {location}: HTTP {status} ({total_time}ms)")
-                
-            elif test_type == "dns":
-                dns_result = result.get("result", {})
-                answers = dns_result.get("answers", [])
-                if answers:
-                    ip = answers[0].get("value", "N/A")
-                    results.append(f"📍 {location}: {ip}")
-                else:
-                    results.append(f"📍 {location}: DNS timeout")
-                    
-            elif test_type == "traceroute":
-                trace_result = result.get("result", {})
-                hops = trace_result.get("hops", [])
-                
-                if hops:
-                    hop_details = []
-                    for hop_index, hop in enumerate(hops, 1):
-                        hop_num = hop_index  # Используем индекс как номер хопа
-                        timings = hop.get("timings", [])
-                        
-                        if timings:
-                            # Берем первый успешный timing
-                            timing = timings[0]
-                            rtt = timing.get("rtt", "N/A")
-                            
-                            # Получаем IP или hostname из правильных полей
-                            ip_or_host = hop.get("resolvedHostname") or hop.get("resolvedAddress") or "* * *"
-                            
-                            hop_details.append(f"  {hop_num:2}. {ip_or_host} - {rtt}ms")
-                        else:
-                            hop_details.append(f"  {hop_num:2}. * * * (timeout)")
-                    
-                    results.append(f"📍 {location} TRACEROUTE:\n" + "\n".join(hop_details))
-                else:
-                    results.append(f"📍 {location}: Traceroute данные недоступны")
-                    
-            elif test_type == "mtr":
-                mtr_result = result.get("result", {})
-                hops = mtr_result.get("hops", [])
-                
-                if hops:
-                    hop_details = []
-                    for hop_index, hop in enumerate(hops, 1):
-                        hop_num = hop_index  # Используем индекс как номер хопа
-                        stats = hop.get("stats", {})
-                        avg_time = stats.get("avg", "N/A")
-                        packet_loss = stats.get("loss", 0)
-                        
-                        # Получаем IP или hostname из правильных полей
-                        ip_or_host = hop.get("resolvedHostname") or hop.get("resolvedAddress") or "* * *"
-                        
-                        # Форматируем строку хопа
-                        loss_str = f" ({packet_loss}% loss)" if packet_loss > 0 else ""
-                        hop_details.append(f"  {hop_num:2}. {ip_or_host} - {avg_time}ms{loss_str}")
-                    
-                    results.append(f"📍 {location} MTR:\n" + "\n".join(hop_details))
-                else:
-                    results.append(f"📍 {location}: MTR данные недоступны")
-                    
+            summary = compact_results(all_results, measurements=measurements)
+            key = normalize_target(target)
+            # Сравнение до записи: текущий запуск не должен стать собственной базой
+            delta = measurement_store.delta(key, summary)
+            measurement_store.record(key, summary)
         except Exception as e:
-            results.append(f"📍 {location}: Ошибка обработки данных")
-    
-    if not results:
-        return f"❌ **{test_type.upper()}** для `{target}`: Нет результатов"
-    
-    return f"🌍 **{test_type.upper()}** для `{target}`:\n" + "\n".join(results)
+            history_span.set(outcome="error")
+            print(f"⚠️ История измерений недоступна: {e}")
+            return None
+        history_span.set(outcome="baseline" if delta.baseline_age is not None else "first", changes=len(delta.changes))
+    return delta
+
+def _delta_changes(delta):
+    """Изменения для промпта: None, если сравнивать не с чем"""
+    return delta.changes if delta is not None and delta.baseline_age is not None else None
+
+def post_delta(delta, say, thread_ts, target=None):
+    """Короткое сообщение с изменениями вместо сравнения полных результатов вручную"""
+    if _delta_changes(delta) is not None and HISTORY_CONFIG["post_delta"]:
+        say(render_delta(delta, target), thread_ts=thread_ts)
+
+def run_globalping_tests(target: str, test_types: list, on_result=None, measurements: dict = None, ledger: CreditLedger = None) -> list:
+    """Globalping тесты цели в исходном порядке: адаптивно или стандартным набором проб"""
+    if escalation_policy is None:
+        return run_globalping_stage(target, test_types, on_result, measurements, ledger=ledger)
+    return run_adaptive_globalping_tests(target, test_types, on_result, measurements, ledger)
+
+def run_adaptive_globalping_tests(target: str, test_types: list, on_result=None, measurements: dict = None, ledger: CreditLedger = None) -> list:
+    """Первый проход ping/http/dns на дешевом наборе проб; при проблемах - расширенные
+    повторы проблемных тестов и traceroute/mtr только из локаций, где проблемы видны.
+    """
+    run = AdaptiveRun(escalation_policy, target, test_types, {} if measurements is None else measurements, on_result, escalation_stats)
+    stage = run.first_stage()
+    while stage is not None:
+        stage = run.next_stage(run_globalping_stage(target, stage.test_types, stage.on_result, run.measurements, stage.request, ledger))
+    return run.ordered_results()
+
+def run_globalping_stage(target: str, test_types: list, on_result=None, measurements: dict = None, request: ProbeRequest = None, ledger: CreditLedger = None) -> list:
+    """Запускает Globalping тесты (параллельно или последовательно) в исходном порядке"""
+    if not test_types:
+        return []
+    if not CONCURRENCY_CONFIG["globalping_parallel"]:
+        results = []
+        for test_type in test_types:
+            try:
+                results.append(cached_globalping_test(target, test_type, measurements, request, ledger))
+            except Exception as e:
+                results.append(globalping_error(test_type, e))
+            if on_result:
+                on_result(test_type, results[-1])
+        return results
+
+    # Все измерения отправляются сразу, время этапа определяется самым медленным тестом
+    tasks = [
+        (test_type, lambda test_type=test_type: cached_globalping_test(target, test_type, measurements, request, ledger))
+        for test_type in test_types
+    ]
+    # Лимит этапа не выходит за дедлайн отчета
+    deadline = int(min(CONCURRENCY_CONFIG["globalping_stage_deadline"], current_deadline().remaining()))
+    return run_ordered(
+        tasks,
+        max_workers=CONCURRENCY_CONFIG["globalping_max_workers"],
+        deadline=deadline,
+        on_timeout=lambda test_type: globalping_stage_timeout(test_type, deadline),
+        on_error=globalping_error,
+        on_result=on_result
+    )
 
 def get_website_screenshot(target: str) -> str:
     """Создает миниатюрный скриншот веб-страницы без кеширования для актуальной диагностики"""
     try:
-        import random
-        import time
-        
-        # Очищаем URL
-        url = target
-        if not url.startswith(('http://', 'https://')):
-            url = f"https://{url}"
-        
-        # Генерируем уникальные параметры против кеширования
-        timestamp = int(time.time())
-        random_id = random.randint(10000, 99999)
-        cache_bust = f"{timestamp}{random_id}"
-        
-        # Используем бесплатные API с anti-cache параметрами
-        screenshot_services = [
-            # thum.io с force refresh
-            f"https://image.thum.io/get/width/480/crop/360/noanimate/{url}?cache={cache_bust}",
-            # s-shot.ru с timestamp
-            f"https://mini.s-shot.ru/480x360/JPEG/480/Z100/?{url}&_={cache_bust}",
-            # screenshotapi.net с fresh параметром
-            f"https://shot.screenshotapi.net/screenshot?url={url}&output=image&file_type=png&wait_for_event=load&width=480&height=360&fresh=true&cache_bust={cache_bust}"
-        ]
-        
-        for service_url in screenshot_services:
-            try:
-                # Добавляем заголовки против кеширования
-                headers = {
-                    'Cache-Control': 'no-cache, no-store, must-revalidate',
-                    'Pragma': 'no-cache',
-                    'Expires': '0',
-                    'User-Agent': f'SlackBot-Screenshot-{cache_bust}'
-                }
-                
-                response = requests.get(
-                    service_url, 
-                    timeout=7,  # Увеличиваем таймаут для свежих скриншотов
-                    allow_redirects=True,
-                    headers=headers
-                )
-                
-                if response.status_code == 200 and len(response.content) > 1000:  # Минимальный размер изображения
-                    return service_url
-            except requests.RequestException:
-                continue
-        return ""
-        
+        return screenshot_racer.capture(target)
     except Exception as e:
-        return f"📷 Скриншот недоступен: {str(e)}"
+        return ""
+
+def post_screenshot(future, say, thread_ts, screenshot_span=None):
+    """Отправляет ссылку на скриншот, когда фоновый поиск завершится"""
+    try:
+        screenshot_url = future.result()
+    except Exception:
+        screenshot_url = ""
+    if screenshot_span is not None:
+        screenshot_span.finish("ok" if screenshot_url else "error")
+    if screenshot_url:
+        say(f"📸 <{screenshot_url}|Скриншот>", thread_ts=thread_ts)
+    else:
+        say("📷 Скриншот недоступен", thread_ts=thread_ts)
+    print(f"📸 Провайдеры скриншотов: {screenshot_racer.stats.snapshot()}")
 
 def get_os_commands(target):
     """Возвращает команды в зависимости от ОС"""
     domain = extract_domain(target)
     
+    if NATIVE_PROBES_CONFIG["enabled"]:
+        # DNS, TCP и HTTP проверяются встроенными пробами, ICMP и mtr - системными утилитами
+        native = native_commands(target, domain)
+        if platform.system().lower() == 'windows':
+            return [f"ping -n 10 -l 1000 {domain}"] + native
+        return [f"ping -4 -c 10 -s 1000 -i 0.2 {domain}"] + native + [f"mtr -4 -w -c 10 -b -y 2 -z -m 20 {domain}"]
+    
     if platform.system().lower() == 'windows':
         return [
             f"ping -n 10 -l 1000 {domain}",
@@ -388,177 +752,364 @@ def get_os_commands(target):
             f"mtr -4 -w -c 10 -b -y 2 -z -m 20 {domain}"
         ]
 
-def extract_domain(target):
-    """Извлекает чистый домен из URL"""
-    return target.replace("https://", "").replace("http://", "").split("/")[0]
+def completion_request(prompt: str) -> dict:
+    """Параметры запроса к модели, общие для синхронного и асинхронного режимов"""
+    return {
+        "model": "gpt-4o",
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 1500,
+        "temperature": 0.1
+    }
 
-def extract_targets(event):
-    """Извлечение целей из различных частей сообщения Slack"""
-    targets = []
-    text = event.get('text', '')
-    targets += re.findall(r"(\b(?:\d{1,3}\.){3}\d{1,3}\b|https?://[\w.-]+|\b[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\b)", text)
+def _complete(prompt: str, on_text=None) -> str:
+    """Запрос к модели; при on_text ответ приходит потоком"""
+    request = completion_request(prompt)
+    
+    if on_text:
+        text, timings = stream_completion(client, on_text, **request)
+        print(f"🤖 AI поток: первый токен {timings['ttft']:.2f}с, генерация {timings['total']:.2f}с")
+        return text
 
-    for file in event.get('files', []):
-        plain_text = file.get('plain_text', '')
-        targets += re.findall(r"(\b(?:\d{1,3}\.){3}\d{1,3}\b|https?://[\w.-]+|\b[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\b)", plain_text)
+    response = client.chat.completions.create(**request)
 
-    for attachment in event.get('attachments', []):
-        for field in attachment.get('fields', []):
-            field_value = field.get('value', '')
-            targets += re.findall(r"(\b(?:\d{1,3}\.){3}\d{1,3}\b|https?://[\w.-]+|\b[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\b)", field_value)
+    return response.choices[0].message.content.strip()
 
-    return targets
+def _results_for_prompt(all_results: str, token_budget: int, measurements: dict = None, changes: list = None) -> str:
+    if not PROMPT_CONFIG["compact"]:
+        return all_results
+    # Вместо сырого вывода - структурированная сводка в пределах бюджета токенов;
+    # при известных изменениях новые хопы уже в них, заметные хопы не нужны
+    results_text, token_stats = build_compact_results(
+        all_results, token_budget, measurements=measurements, max_detail=1 if changes is not None else 2
+    )
+    print(f"🧮 Промпт: {token_stats['raw_tokens']} → {token_stats['compact_tokens']} токенов (сырые → сжатые результаты)")
+    return results_text
 
-def analyze_all_results(target: str, all_results: str) -> str:
-    """Анализирует все результаты тестов с помощью AI"""
-    #Фокус на конечной доступности и стабильности финального узла.
-    try:
-        prompt = f"""
-        Вы - специалист по диагностике сетевых проблем.
-        Будьте конкретны, точны.
-        "Пиши, сокращай". 
-        Используй форматирование markdown для Slack.
-        Используй только русский язык.
-
-        Учитывай для MTR и Traceroute: Потеря пакетов на промежуточных узлах может быть нормальной из-за:
-        - Низкого приоритета ICMP трафика на маршрутизаторах
-        - Блокировки ICMP на промежуточных узлах
-        - Rate limiting на сетевом оборудовании
-        НЕ УКАЗЫВАЙ это в заключении ЕСЛИ НЕТ потерь на финальном узле.
-    
-        Не давай рекомендаций, по устранению причин и проблем. Только точная диагностика.
+def analyze_all_results(target: str, all_results: str, on_text=None, measurements: dict = None, changes: list = None) -> str:
+    """Анализирует все результаты тестов с помощью AI.
 
-        Проведен комплексный анализ ресурса '{target}'. 
-        
-        Результаты тестов:
-        {all_results}
-        
-        Проанализируйте результаты и дайте краткое заключение:
-        1. Статус ресурса (работает/не работает/проблемы)
-        2. Выявленные проблемы (если есть)
-        3. Причины проблем (если есть проблемы)
+    Если передан on_text, ответ запрашивается потоком и частично
+    отформатированный текст передается в on_text по мере генерации.
+    """
+    try:
+        results_text = _results_for_prompt(all_results, PROMPT_CONFIG["token_budget"], measurements, changes)
+        return _complete(build_analysis_prompt(target, results_text, changes), on_text)
         
-        """
-
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=1500,
-            temperature=0.1
-        )
+    except Exception as e:
+        return f"❌ Ошибка AI анализа: {str(e)}\n\n📊 *Результаты доступны выше для ручного анализа*"
 
-        return response.choices[0].message.content.strip()
+def analyze_targets(results_by_target: list, on_text=None) -> str:
+    """Сравнительный AI анализ нескольких целей; бюджет токенов делится между ними"""
+    try:
+        token_budget = max(400, PROMPT_CONFIG["token_budget"] // len(results_by_target))
+        sections = [
+            (target, _results_for_prompt(all_results, token_budget, measurements, changes) + "\n" + format_changes(changes))
+            for target, all_results, measurements, changes in results_by_target
+        ]
+        return _complete(build_comparison_prompt(sections), on_text)
         
     except Exception as e:
         return f"❌ Ошибка AI анализа: {str(e)}\n\n📊 *Результаты доступны выше для ручного анализа*"
 
-def format_summary(summary):
-    """Улучшает форматирование итогового резюме"""
-    if not summary or len(summary.strip()) < 10:
-        return "📝 _Резюме недоступно_"
-    
-    formatted = summary.strip()
-    
-    # Улучшаем форматирование
-    formatted = formatted.replace("#### ", "")
-    formatted = formatted.replace("### ", "")
-    formatted = formatted.replace("**", "*")
+def cached_comparison(results_by_target: list, on_text=None) -> tuple:
+    """Сравнительный анализ через кеш: повторно используется только для тех же результатов всех целей"""
+    ai_span = Span("ai", targets=len(results_by_target))
+    digest = hashlib.sha256("\n".join(
+        f"{normalize_target(target)}\n{strip_cache_marks(all_results)}\n{changes}" for target, all_results, _, changes in results_by_target
+    ).encode("utf-8")).hexdigest()
+    analysis, age = cached_call(
+        ("comparison", digest),
+        lambda: analyze_targets(results_by_target, on_text=on_text)
+    )
+    ai_span.finish(
+        "cached" if age is not None else ("ok" if _is_cacheable(analysis) else "error"),
+        bytes=len(analysis.encode("utf-8"))
+    )
+    return analysis, age
 
-    
-    return formatted
+def _leased(job, lease):
+    """Задача, по завершении которой событие помечается обработанным для всех узлов"""
+    def run():
+        try:
+            job()
+        finally:
+            lease.complete()
+    return run
 
 @app.event("message")
-def handle_message(event, say):
+def handle_message(event, say, body=None):
     # Пропускаем дочерние сообщения в тредах
     if event.get('thread_ts') and event.get('thread_ts') != event.get('ts'):
         return
     # print(f"🔍 DEBUG EVENT: {json.dumps(event, indent=2, ensure_ascii=False)}")
     """Обработка входящих Slack-сообщений с восстановлением после ошибок"""
     try:
-        bot_user_id = app.client.auth_test()["user_id"]
-        if event.get('user') == bot_user_id:
+        # Идентичность бота запрашивается один раз при запуске, а не на каждое сообщение
+        if event.get('user') == slack_metadata.bot_user_id:
             return
 
-        targets = extract_targets(event)
+        # Цели, не входящие в список игнорируемых; в многоцелевом режиме - до max_targets разных хостов
+        max_targets = MULTI_TARGET_CONFIG["max_targets"] if MULTI_TARGET_CONFIG["enabled"] else 1
+        targets = unique_hosts(target_extractor.extract(event), max_targets)
         if not targets:
             return
-
-        target = targets[0]
-        if "backup03.itsoft.ru" in target.lower() and len(targets) > 1:
-            target = targets[1]
-
-        if "slack.com" in target.lower():
+        
+        # Повторную доставку или событие, взятое другим экземпляром, пропускаем
+        lease = None
+        if lease_coordinator is not None:
+            lease = lease_coordinator.claim(event_keys(event, (body or {}).get('event_id')))
+            if lease is None:
+                print(f"🔁 Событие {event.get('channel')}/{event.get('ts')} уже обрабатывается")
+                return
+        
+        # Диагностика выполняется в пуле воркеров, слушатель Bolt освобождается сразу
+        if len(targets) == 1:
+            job = lambda: diagnose_target(event, targets[0], say)
+        else:
+            job = lambda: diagnose_targets(event, targets, say)
+        if lease is not None:
+            job = _leased(job, lease)
+        try:
+            position = diagnostics_queue.submit(event.get('channel', ''), job)
+        except QueueFull:
+            if lease is not None:
+                lease.release()
+            say(f"🚦 *Очередь диагностики переполнена* ({QUEUE_CONFIG['max_depth']} задач). Повторите запрос через несколько минут", thread_ts=event.get('ts'))
             return
         
+        if position > 0:
+            say(f"⏳ Запрос поставлен в очередь, позиция {position}", thread_ts=event.get('ts'))
+            
+    except Exception as e:
+        # Критическая ошибка - отправляем уведомление
+        try:
+            say(f"❌ *Критическая ошибка бота*: {str(e)}\nПовторите запрос через несколько минут", thread_ts=event.get('ts'))
+        except:
+            print(f"Критическая ошибка: {e}")
+
+def diagnose_target(event, target, say):
+    """Полная диагностика цели: выполняется воркером очереди и пишет трассировку отчета"""
+    with report_trace(target, log_path=METRICS_CONFIG["report_log"] or None, channel=event.get('channel')):
+        with deadline_scope(ERROR_RECOVERY_CONFIG["report_deadline"]):
+            run_diagnostics(event, target, say)
+
+def diagnose_targets(event, targets, say):
+    """Диагностика нескольких целей одного сообщения одним отчетом"""
+    with report_trace(", ".join(targets), log_path=METRICS_CONFIG["report_log"] or None, channel=event.get('channel'), targets=len(targets)):
+        with deadline_scope(ERROR_RECOVERY_CONFIG["report_deadline"]):
+            run_multi_diagnostics(event, targets, say)
+
+def _new_board(event, say, api_calls, thread_ts, title):
+    """Сообщение со статусами тестов, обновляемое через chat.update"""
+    channel_id = event.get('channel')
+    chat_update = api_calls.wrap(app.client.chat_update, "chat.update")
+    return ProgressBoard(
+        ThrottledMessage(
+            post=lambda text: say(text, thread_ts=thread_ts)["ts"],
+            update=lambda ts, text: chat_update(channel=channel_id, ts=ts, text=text),
+            min_interval=PROGRESS_CONFIG["min_update_interval"]
+        ),
+        title=title
+    )
+
+def run_target_tests(target, globalping_header, local_header, board=None, on_stage=None) -> tuple:
+    """Globalping тесты и локальные команды одной цели.
+
+    board получает статусы по мере завершения тестов, on_stage(заголовок, результаты) - итог этапа.
+    Возвращает (результаты Globalping, результаты локальных команд, типизированные измерения).
+    """
+    # Типизированные записи Globalping для сводки AI без повторного разбора текста
+    measurements = {}
+    ledger = CreditLedger(escalation_stats, current_report())
+    with span("globalping", target=target) as globalping_span:
+        globalping_results = run_globalping_tests(
+            target, GLOBALPING_TESTS,
+            on_result=(lambda test_type, text, skipped=False: board.finish_item(globalping_header, test_type, text, skipped=skipped)) if board else None,
+            measurements=measurements,
+            ledger=ledger
+        )
+        globalping_span.set(credits=ledger.total)
+    print(f"{ledger.render()} `{target}`")
+    if board:
+        board.finish_item(globalping_header, CREDITS_ITEM, ledger.render(), ok=True)
+    if on_stage and globalping_results:
+        on_stage(globalping_header, globalping_results + [ledger.render()])
+    
+    with span("local", target=target):
+        local_results = run_local_commands(
+            get_os_commands(target),
+            on_result=(lambda command, text: board.finish_item(local_header, command, text, ok=local_result_ok(text))) if board else None
+        )
+    if on_stage and local_results:
+        on_stage(local_header, local_results)
+    return globalping_results, local_results, measurements
+
+def post_analysis(event, say, api_calls, thread_ts, analyze):
+    """Публикует AI заключение; analyze(on_text) возвращает (текст, возраст кеша)"""
+    analysis_header = "🤖 *Итоговый анализ:*"
+    try:
+        if PROGRESS_CONFIG["ai_streaming"]:
+            # Заключение появляется в сообщении по мере генерации
+            channel_id = event.get('channel')
+            chat_update = api_calls.wrap(app.client.chat_update, "chat.update")
+            ai_message = ThrottledMessage(
+                post=lambda text: say(text, thread_ts=thread_ts)["ts"],
+                update=lambda ts, text: chat_update(channel=channel_id, ts=ts, text=text),
+                min_interval=PROGRESS_CONFIG["min_update_interval"]
+            )
+            ai_message.start(f"{analysis_header}\n⏳ _Анализ результатов..._")
+            analysis, age = analyze(lambda partial: ai_message.set_text(f"{analysis_header}\n{partial}"))
+            ai_message.set_text(f"{analysis_header}\n{format_summary(analysis)}{format_cache_age(age)}")
+            ai_message.flush()
+        else:
+            analysis, age = analyze(None)
+            formatted_analysis = format_summary(analysis)
+            say(f"{analysis_header}\n{formatted_analysis}{format_cache_age(age)}", thread_ts=thread_ts)
+    except Exception as e:
+        say(f"⚠️ *AI анализ недоступен*: {str(e)}\n📊 Результаты тестов доступны выше", thread_ts=thread_ts)
+
+def start_screenshot(target, say, thread_ts):
+    """Скриншот страницы ищется в фоне, параллельно с проверками"""
+    screenshot_span = Span("screenshot", target=target)
+    screenshot_future = screenshot_racer.capture_async(target)
+    screenshot_future.add_done_callback(lambda future: post_screenshot(future, say, thread_ts, screenshot_span))
+
+def run_diagnostics(event, target, say):
+    """Этапы диагностики: скриншот, Globalping, локальные команды и AI анализ"""
+    try:
         import datetime
         current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         thread_ts = event.get('ts')
         
-        # Получаем ссылку на сообщение
+        # Ссылка на сообщение строится локально из адреса workspace
         try:
-            channel_id = event.get('channel')
-            message_ts = event.get('ts')
-            permalink = app.client.chat_getPermalink(
-                channel=channel_id,
-                message_ts=message_ts
-            )['permalink']
+            permalink = slack_metadata.permalink(event.get('channel'), event.get('ts'))
         except Exception as e:
             permalink = f"Ошибка получения ссылки: {str(e)}"
         
         print(f"🔍 {current_time} {target} {permalink}")
+        
+        # Считаем вызовы Web API, которые стоит обработка этого события
+        api_calls = slack_metadata.new_event()
+        say = api_calls.wrap(say, "chat.postMessage")
        
         # Определяем статус интеграции
         token_status = "🔑" if GLOBALPING_API_TOKEN else "🌐"
         say(f"🔍 *Диагностика ресурса:* `{target}`", thread_ts=thread_ts)
         
-        # ЧАСТЬ 0: Скриншот страницы
-        screenshot_url = get_website_screenshot(target)
-        say(f"📸 <{screenshot_url}|Скриншот>", thread_ts=thread_ts)
+        # ЧАСТЬ 0: Скриншот страницы ищется в фоне, параллельно с проверками
+        start_screenshot(target, say, thread_ts)
  
-        # ЧАСТЬ 1: Globalping тесты
-        globalping_results = []
-        globalping_tests = ["ping", "http", "dns", "traceroute", "mtr"]
+        globalping_header = f"`{token_status}` *Результаты глобальных проверок:*"
+        local_header = "💻 *Результаты локальных команд:*"
         
-        for test_type in globalping_tests:
-            try:
-                result = globalping_test_with_recovery(target, test_type)
-                globalping_results.append(result)
-            except Exception as e:
-                globalping_results.append(f"❌ **Критическая ошибка {test_type}**: {str(e)}")
-        
-        # Отправляем результаты Globalping
-        if globalping_results:
-            globalping_text = f"`{token_status}` *Результаты глобальных проверок:*\n" + "\n\n".join(globalping_results)
-            say(globalping_text, thread_ts=thread_ts)
-
-        # ЧАСТЬ 2: Локальные команды
-        local_commands = get_os_commands(target)
-        os_name = "Windows" if platform.system().lower() == 'windows' else "Linux"
+        if PROGRESS_CONFIG["streaming"]:
+            # Одно сообщение со статусами тестов, обновляемое по мере их завершения
+            board = _new_board(event, say, api_calls, thread_ts, f"📡 *Ход диагностики* `{target}`")
+            board.add_section(globalping_header, GLOBALPING_TESTS + [CREDITS_ITEM])
+            board.add_section(local_header, get_os_commands(target))
+            board.start()
+            globalping_results, local_results, measurements = run_target_tests(target, globalping_header, local_header, board=board)
+            board.close()
+            print(f"🔄 Обновления статуса: {board.stats()}")
+        else:
+            # ЧАСТЬ 1-2: Globalping тесты и локальные команды, результаты каждого этапа отправляются сразу
+            globalping_results, local_results, measurements = run_target_tests(
+                target, globalping_header, local_header,
+                on_stage=lambda header, results: say(f"{header}\n" + "\n\n".join(results), thread_ts=thread_ts)
+            )
         
-        local_results = []
-        for command in local_commands:
-            try:
-                output = run_command_with_recovery(command)
-                local_results.append(f"💻 `{command}`:\n```{output}```")
-            except Exception as e:
-                local_results.append(f"💻 `{command}`: ❌ Критическая ошибка: {str(e)}")
+        print(f"🔌 HTTP пул: {get_http_client().stats()} ♻️ Кеш: {result_cache.stats()}")
 
-        # Отправляем результаты локальных команд
-        if local_results:
-            local_text = "💻 *Результаты локальных команд:*\n" + "\n\n".join(local_results)
-            say(local_text, thread_ts=thread_ts)
+        all_results = "\n".join(globalping_results + local_results)
+        delta = record_history(target, all_results, measurements)
+        post_delta(delta, say, thread_ts)
 
         # ЧАСТЬ 3: AI анализ
-        try:
-            all_results = globalping_results + local_results
-            analysis = analyze_all_results(target, "\n".join(all_results))
-            formatted_analysis = format_summary(analysis)
-            say(f"🤖 *Итоговый анализ:*\n{formatted_analysis}", thread_ts=thread_ts)
-        except Exception as e:
-            say(f"⚠️ *AI анализ недоступен*: {str(e)}\n📊 Результаты тестов доступны выше", thread_ts=thread_ts)
+        post_analysis(
+            event, say, api_calls, thread_ts,
+            lambda on_text: cached_analysis(
+                target, all_results, on_text=on_text, measurements=measurements, changes=_delta_changes(delta)
+            )
+        )
+        
+        if verdict_cache is not None:
+            print(f"🗂️ Кеш заключений: {verdict_cache.stats()}")
+        print(f"📊 Web API вызовов за событие: {api_calls.total} {api_calls.calls} 📥 Очередь: {diagnostics_queue.stats()}")
             
     except Exception as e:
         # Критическая ошибка - отправляем уведомление
+        report = current_report()
+        if report is not None:
+            report.fail()
+        try:
+            say(f"❌ *Критическая ошибка бота*: {str(e)}\nПовторите запрос через несколько минут", thread_ts=event.get('ts'))
+        except:
+            print(f"Критическая ошибка: {e}")
+
+def run_multi_diagnostics(event, targets, say):
+    """Диагностика нескольких целей параллельно с общим сравнительным AI анализом.
+
+    Цели проверяются одновременно на общих пулах и бюджетах; совпадающие тесты
+    (одинаковый хост или команда) выполняются один раз через кеш результатов.
+    """
+    try:
+        thread_ts = event.get('ts')
+        print(f"🔍 {len(targets)} целей: {', '.join(targets)}")
+        
+        api_calls = slack_metadata.new_event()
+        say = api_calls.wrap(say, "chat.postMessage")
+        token_status = "🔑" if GLOBALPING_API_TOKEN else "🌐"
+        say(f"🔍 *Диагностика ресурсов:* " + ", ".join(f"`{target}`" for target in targets), thread_ts=thread_ts)
+        
+        for target in targets:
+            start_screenshot(target, say, thread_ts)
+        
+        headers = {
+            target: (f"`{token_status}` *Глобальные проверки* `{target}`:", f"💻 *Локальные команды* `{target}`:")
+            for target in targets
+        }
+        board = None
+        if PROGRESS_CONFIG["streaming"]:
+            board = _new_board(event, say, api_calls, thread_ts, "📡 *Ход диагностики* " + ", ".join(f"`{target}`" for target in targets))
+            for target in targets:
+                board.add_section(headers[target][0], GLOBALPING_TESTS + [CREDITS_ITEM])
+                board.add_section(headers[target][1], get_os_commands(target))
+            board.start()
+        
+        def run_one(target):
+            return run_target_tests(
+                target, *headers[target], board=board,
+                on_stage=None if board else lambda header, results: say(f"{header}\n" + "\n\n".join(results), thread_ts=thread_ts)
+            )
+        
+        # Этапы каждой цели ограничены своими дедлайнами, общий лимит - дедлайн отчета
+        outcomes = run_ordered(
+            [(target, lambda target=target: run_one(target)) for target in targets],
+            max_workers=len(targets),
+            on_error=lambda target, e: ([f"❌ **Критическая ошибка** `{target}`: {str(e)}"], [], {})
+        )
+        if board is not None:
+            board.close()
+        
+        print(f"🔌 HTTP пул: {get_http_client().stats()} ♻️ Кеш: {result_cache.stats()}")
+        
+        results_by_target = []
+        for target, (globalping_results, local_results, measurements) in zip(targets, outcomes):
+            all_results = "\n".join(globalping_results + local_results)
+            delta = record_history(target, all_results, measurements)
+            post_delta(delta, say, thread_ts, target)
+            results_by_target.append((target, all_results, measurements, _delta_changes(delta)))
+        post_analysis(
+            event, say, api_calls, thread_ts,
+            lambda on_text: cached_comparison(results_by_target, on_text=on_text)
+        )
+        print(f"📊 Web API вызовов за событие: {api_calls.total} {api_calls.calls} 📥 Очередь: {diagnostics_queue.stats()}")
+    
+    except Exception as e:
+        report = current_report()
+        if report is not None:
+            report.fail()
         try:
             say(f"❌ *Критическая ошибка бота*: {str(e)}\nПовторите запрос через несколько минут", thread_ts=event.get('ts'))
         except:
@@ -571,8 +1122,40 @@ if __name__ == "__main__":
         print(f"🤖 OpenAI API: {'✅ Настроен' if OPENAI_API_KEY else '❌ Отсутствует'}")
         print(f"⚙️ Система восстановления: ✅ Активна (макс. {ERROR_RECOVERY_CONFIG['max_retries']} попыток)")
         
+        if METRICS_CONFIG["port"]:
+            start_metrics_server(METRICS_CONFIG["host"], METRICS_CONFIG["port"])
+            print(f"📈 Метрики: http://{METRICS_CONFIG['host']}:{METRICS_CONFIG['port']}/metrics")
+        
+        if GLOBALPING_API_TOKEN:
+            credits = get_token_client(GLOBALPING_API_TOKEN, scheduler=globalping_scheduler).get_credits()
+            if credits["success"]:
+                globalping_scheduler.set_credits("token", credits["credits"].get("remaining"))
+                print(f"💰 Кредиты Globalping: {credits['credits'].get('remaining', 'N/A')}")
+        
+        if measurement_store is not None:
+            removed = measurement_store.compact()
+            print(f"🗄️ История измерений: {measurement_store.stats()}, удалено устаревших запусков: {removed}")
+        
+        identity = slack_metadata.resolve()
+        print(f"🆔 Бот: {identity['user_id']} ({identity['url']})")
+        
+        if lease_coordinator is not None:
+            print(f"🧩 Узел: {lease_coordinator.owner} (аренды: {CLUSTER_CONFIG['lease_store']})")
+        
         handler = SocketModeHandler(app, SLACK_APP_TOKEN)
-        handler.start()
+        handler.connect()
+        
+        # SIGTERM (systemctl stop/restart): новые события уходят другим узлам, текущие диагностики дописываются
+        stop_requested = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_requested.set())
+        while not stop_requested.wait(1):
+            pass
+        print("🛑 Остановка: соединение с Slack закрывается, ожидание текущих диагностик...")
+        handler.close()
+        drained = diagnostics_queue.drain(CLUSTER_CONFIG["drain_timeout"])
+        print(f"🛑 Очередь {'завершена' if drained else 'не завершена за лимит'}: {diagnostics_queue.stats()}")
+        if lease_coordinator is not None:
+            lease_coordinator.close()
     except Exception as e:
         print(f"❌ Ошибка запуска бота: {e}")
         print("Проверьте переменные окружения в .env файле")
@@ -0,0 +1,734 @@
+"""
+Асинхронный режим бота: вся диагностика в одном цикле событий asyncio (python slack_ai_bot_async.py).
+
+Конфигурация, кеши, бюджет Globalping, история и аренды общие с slack_ai_bot;
+Slack, Globalping, локальные команды и OpenAI работают без потока на каждый отчет.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import os
+import signal
+
+import aiohttp
+from openai import AsyncOpenAI
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+
+from slack_ai_bot import (
+    SLACK_APP_TOKEN, SLACK_BOT_TOKEN, OPENAI_API_KEY, GLOBALPING_API_TOKEN,
+    ERROR_RECOVERY_CONFIG, CONCURRENCY_CONFIG, RESULT_CACHE_CONFIG, GLOBALPING_BUDGET_CONFIG,
+    MULTI_TARGET_CONFIG, GLOBALPING_TESTS, CREDITS_ITEM, QUEUE_CONFIG, CLUSTER_CONFIG, PROGRESS_CONFIG,
+    PROMPT_CONFIG, HISTORY_CONFIG, NATIVE_PROBES_CONFIG, METRICS_CONFIG,
+    retry_policy, result_cache, globalping_scheduler, globalping_hedger, target_extractor,
+    lease_coordinator, verdict_cache, measurement_store, slack_metadata, escalation_policy,
+    _is_cacheable, _delta_changes, _results_for_prompt,
+    completion_request, globalping_request, token_fallback, get_os_commands, get_website_screenshot, record_history
+)
+from ai_stream import format_summary, stream_completion_async
+from cluster_lease import event_keys
+from diagnostic_steps import (
+    COMMAND_ENCODING, command_failed, command_name, command_not_started, command_outcome, command_span_fields,
+    command_timeout, globalping_cache_key, globalping_error, globalping_result, globalping_stage_timeout,
+    local_error, local_result, local_result_ok, local_stage_timeout, native_outcome, native_span_fields
+)
+from globalping_async import AsyncGlobalpingClient
+from globalping_budget import BudgetExhausted
+from job_queue import AsyncDiagnosticsQueue, QueueFull
+from local_executor import AsyncCommandLimiter, CommandSlotTimeout, command_limiter, run_process_async
+from measurement_store import render_delta
+from metrics import Span, current_report, metrics, report_trace, span, start_metrics_server
+from native_probes import is_native_command, run_native_command
+from parallel_tasks import run_ordered_async
+from probe_escalation import AdaptiveRun, CreditLedger, ProbeRequest, escalation_stats
+from progress_message import ProgressBoard, ThrottledMessage
+from prompt_builder import build_analysis_prompt, build_comparison_prompt, compact_results, format_changes
+from retry_policy import Deadline, current_deadline, deadline_scope
+from result_cache import normalize_target, format_cache_age, strip_cache_marks
+from target_extraction import extract_domain, unique_hosts
+from verdict_cache import verdict_fingerprint
+
+# Асинхронный режим: сколько отчетов выполняется одновременно и сколько соединений держит HTTP клиент
+ASYNC_CONFIG = {
+    "max_reports": int(os.getenv("ASYNC_MAX_REPORTS", "200")),
+    "http_connections": int(os.getenv("ASYNC_HTTP_CONNECTIONS", "100"))
+}
+
+app = AsyncApp(token=SLACK_BOT_TOKEN)
+ai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+async_command_limiter = AsyncCommandLimiter(command_limiter.limits)
+# Воркеры очереди - задачи цикла событий; глубина очереди та же, что в синхронном режиме
+report_queue = AsyncDiagnosticsQueue(ASYNC_CONFIG["max_reports"], QUEUE_CONFIG["max_depth"])
+# Создается в main(): сессии aiohttp нужен запущенный цикл событий
+globalping_client: AsyncGlobalpingClient = None
+
+metrics.add_collector("async_queue", report_queue.stats, labels={"channels": "channel"})
+metrics.add_collector("async_local_commands", async_command_limiter.stats)
+
+
+async def cached_call_async(key: tuple, compute):
+    """Асинхронный cached_call: тот же кеш результатов, одновременные запросы объединяются"""
+    if not RESULT_CACHE_CONFIG["enabled"]:
+        return await compute(), None
+    return await result_cache.get_or_compute_async(key, compute, should_cache=_is_cacheable)
+
+
+async def run_command_async(command, deadline: Deadline = None):
+    """Асинхронный run_command_with_recovery: процесс без оболочки, те же лимиты, таймауты и повторы"""
+    cmd_name = command_name(command)
+    deadline = deadline or current_deadline()
+
+    async def attempt_once(attempt, timeout_scale):
+        timeout = command_timeout(cmd_name, timeout_scale, deadline)
+        if timeout <= 0:
+            return command_not_started(cmd_name)
+
+        try:
+            with span(f"local.{cmd_name}.attempt", attempt=attempt, command=command) as attempt_span:
+                async with async_command_limiter.slot(cmd_name, deadline.at):
+                    finished = await run_process_async(command, timeout, COMMAND_ENCODING)
+                attempt_span.set(**command_span_fields(finished))
+        except CommandSlotTimeout:
+            return command_not_started(cmd_name, slots_busy=True)
+        except Exception as e:
+            return command_failed(cmd_name, e)
+        return command_outcome(cmd_name, attempt, timeout, finished)
+
+    return await retry_policy.run_async(f"local.{cmd_name}", attempt_once, deadline=deadline)
+
+
+async def run_native_async(command, deadline: Deadline = None):
+    """Асинхронный run_native_with_recovery: блокирующая проба в пуле потоков, те же повторы и дедлайн"""
+    cmd_name = command_name(command)
+    deadline = deadline or current_deadline()
+
+    async def attempt_once(attempt, timeout_scale):
+        timeout = command_timeout(cmd_name, timeout_scale, deadline, base_timeout=NATIVE_PROBES_CONFIG["timeout"])
+        if timeout <= 0:
+            return command_not_started(cmd_name)
+        with span(f"local.{cmd_name}.attempt", attempt=attempt, command=command) as attempt_span:
+            output = await asyncio.to_thread(run_native_command, command, timeout=timeout, dns_server=NATIVE_PROBES_CONFIG["dns_server"])
+            attempt_span.set(**native_span_fields(output))
+        return native_outcome(output)
+
+    return await retry_policy.run_async(f"local.{cmd_name}", attempt_once, deadline=deadline)
+
+
+async def run_local_commands_async(commands: list, on_result=None) -> list:
+    """Локальные команды одновременно (или по очереди) в исходном порядке"""
+    deadline = current_deadline().earliest(CONCURRENCY_CONFIG["local_stage_deadline"])
+    stage_deadline = int(deadline.remaining())
+
+    async def run_one(command):
+        with span(f"local.{command_name(command)}", command=command) as command_span:
+            try:
+                if is_native_command(command):
+                    compute = lambda: run_native_async(command, deadline=deadline)
+                else:
+                    compute = lambda: run_command_async(command, deadline=deadline)
+                output, age = await cached_call_async(("local", command), compute)
+                text, outcome = local_result(command, output, age)
+                command_span.set(outcome=outcome, bytes=len(output))
+                return text
+            except Exception as e:
+                command_span.set(outcome="error")
+                return local_error(command, e)
+
+    if not CONCURRENCY_CONFIG["local_parallel"]:
+        results = []
+        for command in commands:
+            results.append(await run_one(command))
+            if on_result:
+                on_result(command, results[-1])
+        return results
+
+    return await run_ordered_async(
+        [(command, lambda command=command: run_one(command)) for command in commands],
+        max_workers=CONCURRENCY_CONFIG["local_max_workers"],
+        deadline=stage_deadline + 5,
+        on_timeout=lambda command: local_stage_timeout(command, stage_deadline),
+        on_result=on_result
+    )
+
+
+async def _measure_async(target: str, test_type: str, attempt: int, endpoint: str, locations, limit: int, max_wait: float, request_timeout: float):
+    """Одна попытка измерения: (Measurement, None) или (текст ошибки, ошибка) для RetryPolicy"""
+    attempt_span = Span(f"globalping.{test_type}.attempt", attempt=attempt, source=endpoint)
+
+    def report_poll_error(error, remaining):
+        # Только в конце показываем ошибки
+        if remaining < 5:
+            print(f"⚠️ Сетевая ошибка при получении результатов: {error}")
+
+    try:
+        result = await globalping_client.measure(
+            target, test_type, list(locations), limit, endpoint=endpoint,
+            max_wait=max_wait, request_timeout=request_timeout, on_poll_error=report_poll_error
+        )
+    except asyncio.CancelledError:
+        # Хеджирующий запрос уже победил
+        attempt_span.finish("cancelled")
+        raise
+    attempt_span.finish(
+        "ok" if result["success"] else ("timeout" if result["error"] == "Timeout" else "error"),
+        bytes=result.get("bytes", 0),
+        polls=result.get("polls", 0)
+    )
+    if result["success"]:
+        return result["measurement"], None
+    source = " (токен)" if endpoint == "token" else ""
+    return f"❌ **Ошибка {test_type}**{source}: {result['error']} (попытка {attempt})", result["error"]
+
+
+async def _public_attempt_async(target: str, test_type: str, attempt: int, timeout_scale: float, grant, deadline: Deadline, probes: ProbeRequest = None):
+    """Попытка через публичный API; без grant разрешение берется у бюджета публичного API"""
+    probes = probes or globalping_request(attempt)
+    locations = probes.locations
+    if grant is None or grant.endpoint != "public":
+        try:
+            grant = await globalping_scheduler.acquire_async(
+                min(probes.limit, len(locations)), order=("public",), max_wait=deadline.cap(GLOBALPING_BUDGET_CONFIG["max_wait"])
+            )
+        except BudgetExhausted as e:
+            return f"❌ **Ошибка {test_type}**: бюджет публичного API исчерпан, {e}", e
+    return await _measure_async(
+        target, test_type, attempt, "public", locations, min(grant.limit, len(locations)),
+        max_wait=deadline.cap(20 + (5 * attempt)),
+        request_timeout=max(1, deadline.cap(10 * timeout_scale))
+    )
+
+
+async def globalping_test_async(target: str, test_type: str, request: ProbeRequest = None):
+    """Асинхронный globalping_test_with_recovery: бюджет, повторы, хеджирование и переход на публичный API"""
+    clean_target = extract_domain(target)
+    deadline = current_deadline()
+    fallback = token_fallback()
+
+    async def attempt_once(attempt, timeout_scale):
+        probes = globalping_request(attempt, request)
+        try:
+            grant = await globalping_scheduler.acquire_async(probes.limit, order=fallback.order, max_wait=deadline.cap(GLOBALPING_BUDGET_CONFIG["max_wait"]))
+        except BudgetExhausted as e:
+            return f"❌ **Ошибка {test_type}**: бюджет Globalping исчерпан, {e}", e
+        if grant.reduced or grant.waited > 0.5:
+            print(f"🚦 Globalping {test_type}: {grant.endpoint}, проб {grant.limit} из {grant.requested}, ожидание {grant.waited:.1f}с")
+
+        if grant.endpoint == "public":
+            return await _public_attempt_async(clean_target, test_type, attempt, timeout_scale, grant, deadline, probes)
+
+        token_attempt = lambda: _measure_async(
+            clean_target, test_type, attempt, "token", probes.locations, grant.limit,
+            max_wait=deadline.cap(globalping_client.max_wait * timeout_scale), request_timeout=10
+        )
+        public_attempt = lambda: _public_attempt_async(clean_target, test_type, attempt, timeout_scale, None, deadline, probes)
+
+        async def hedged_attempt():
+            if globalping_hedger is None or not ERROR_RECOVERY_CONFIG["emergency_fallback"]:
+                return await token_attempt()
+            # Задержавшийся токен-тест дублируется через публичный API, проигравшая задача отменяется
+            result, error, winner = await globalping_hedger.run_async(
+                test_type,
+                token_attempt,
+                public_attempt,
+                can_hedge=lambda: globalping_scheduler.has_headroom("public", GLOBALPING_BUDGET_CONFIG["min_limit"]),
+                timeout=None if deadline.at is None else deadline.remaining() + 5
+            )
+            if winner == "secondary":
+                print(f"🏁 Globalping {test_type}: публичный API опередил токен")
+            return result, error
+
+        # Отказ токена (401/403/429) - сразу публичный API в этой же попытке, как в синхронном режиме
+        return await fallback.run_async(hedged_attempt, public_attempt)
+
+    try:
+        return await retry_policy.run_async(f"globalping.{test_type}", attempt_once, deadline=deadline)
+    except Exception as e:
+        return globalping_error(test_type, e)
+
+
+async def cached_globalping_test_async(target: str, test_type: str, measurements: dict = None, request: ProbeRequest = None, ledger: CreditLedger = None) -> str:
+    """Globalping тест через кеш результатов; типизированные записи передаются в measurements, кредиты - в ledger"""
+    with span(f"globalping.{test_type}", probe_set=request.stage if request else "standard") as test_span:
+        result, age = await cached_call_async(globalping_cache_key(target, test_type, request), lambda: globalping_test_async(target, test_type, request))
+        text, fields = globalping_result(test_type, result, age, request, measurements, ledger)
+        test_span.set(**fields)
+    return text
+
+
+async def run_globalping_tests_async(target: str, test_types: list, on_result=None, measurements: dict = None, ledger: CreditLedger = None) -> list:
+    """Globalping тесты цели в исходном порядке: адаптивно или стандартным набором проб"""
+    if escalation_policy is None:
+        return await run_globalping_stage_async(target, test_types, on_result, measurements, ledger=ledger)
+    return await run_adaptive_globalping_tests_async(target, test_types, on_result, measurements, ledger)
+
+
+async def run_adaptive_globalping_tests_async(target: str, test_types: list, on_result=None, measurements: dict = None, ledger: CreditLedger = None) -> list:
+    """Асинхронный run_adaptive_globalping_tests: первый проход, расширенные повторы и трассировки из проблемных локаций"""
+    run = AdaptiveRun(escalation_policy, target, test_types, {} if measurements is None else measurements, on_result, escalation_stats)
+    stage = run.first_stage()
+    while stage is not None:
+        stage = run.next_stage(await run_globalping_stage_async(target, stage.test_types, stage.on_result, run.measurements, stage.request, ledger))
+    return run.ordered_results()
+
+async def run_globalping_stage_async(target: str, test_types: list, on_result=None, measurements: dict = None, request: ProbeRequest = None, ledger: CreditLedger = None) -> list:
+    """Globalping тесты одним набором проб одновременно (или по очереди) в исходном порядке"""
+    if not test_types:
+        return []
+    if not CONCURRENCY_CONFIG["globalping_parallel"]:
+        results = []
+        for test_type in test_types:
+            try:
+                results.append(await cached_globalping_test_async(target, test_type, measurements, request, ledger))
+            except Exception as e:
+                results.append(globalping_error(test_type, e))
+            if on_result:
+                on_result(test_type, results[-1])
+        return results
+
+    deadline = int(min(CONCURRENCY_CONFIG["globalping_stage_deadline"], current_deadline().remaining()))
+    return await run_ordered_async(
+        [
+            (test_type, lambda test_type=test_type: cached_globalping_test_async(target, test_type, measurements, request, ledger))
+            for test_type in test_types
+        ],
+        max_workers=CONCURRENCY_CONFIG["globalping_max_workers"],
+        deadline=deadline,
+        on_timeout=lambda test_type: globalping_stage_timeout(test_type, deadline),
+        on_error=globalping_error,
+        on_result=on_result
+    )
+
+
+async def post_screenshot_async(target, say, thread_ts):
+    """Скриншот ищется в пуле потоков параллельно с проверками, ссылка публикуется по готовности"""
+    screenshot_span = Span("screenshot", target=target)
+    try:
+        screenshot_url = await asyncio.to_thread(get_website_screenshot, target)
+        screenshot_span.finish("ok" if screenshot_url else "error")
+        if screenshot_url:
+            await say(f"📸 <{screenshot_url}|Скриншот>", thread_ts=thread_ts)
+        else:
+            await say("📷 Скриншот недоступен", thread_ts=thread_ts)
+    except Exception as e:
+        screenshot_span.finish("error")
+        print(f"⚠️ Скриншот не отправлен: {e}")
+
+
+async def _complete_async(prompt: str, on_text=None) -> str:
+    """Запрос к модели через AsyncOpenAI; при on_text ответ приходит потоком"""
+    request = completion_request(prompt)
+    if on_text:
+        text, timings = await stream_completion_async(ai_client, on_text, **request)
+        print(f"🤖 AI поток: первый токен {timings['ttft']:.2f}с, генерация {timings['total']:.2f}с")
+        return text
+
+    response = await ai_client.chat.completions.create(**request)
+    return response.choices[0].message.content.strip()
+
+
+async def analyze_all_results_async(target: str, all_results: str, on_text=None, measurements: dict = None, changes: list = None) -> str:
+    try:
+        results_text = _results_for_prompt(all_results, PROMPT_CONFIG["token_budget"], measurements, changes)
+        return await _complete_async(build_analysis_prompt(target, results_text, changes), on_text)
+    except Exception as e:
+        return f"❌ Ошибка AI анализа: {str(e)}\n\n📊 *Результаты доступны выше для ручного анализа*"
+
+
+async def analyze_targets_async(results_by_target: list, on_text=None) -> str:
+    try:
+        token_budget = max(400, PROMPT_CONFIG["token_budget"] // len(results_by_target))
+        sections = [
+            (target, _results_for_prompt(all_results, token_budget, measurements, changes) + "\n" + format_changes(changes))
+            for target, all_results, measurements, changes in results_by_target
+        ]
+        return await _complete_async(build_comparison_prompt(sections), on_text)
+    except Exception as e:
+        return f"❌ Ошибка AI анализа: {str(e)}\n\n📊 *Результаты доступны выше для ручного анализа*"
+
+
+async def cached_analysis_async(target: str, all_results: str, on_text=None, measurements: dict = None, changes: list = None) -> tuple:
+    """AI анализ через кеш заключений и кеш результатов, как cached_analysis"""
+    ai_span = Span("ai")
+    fingerprint = None
+    if verdict_cache is not None:
+        fingerprint = verdict_fingerprint(
+            normalize_target(target), compact_results(all_results, measurements=measurements), changes=changes
+        )
+        cached = await asyncio.to_thread(verdict_cache.get, fingerprint)
+        if cached is not None:
+            ai_span.finish("verdict_cache", bytes=len(cached[0].encode("utf-8")))
+            return cached
+
+    digest = hashlib.sha256(f"{strip_cache_marks(all_results)}\n{changes}".encode("utf-8")).hexdigest()
+    analysis, age = await cached_call_async(
+        ("analysis", normalize_target(target), digest),
+        lambda: analyze_all_results_async(target, all_results, on_text=on_text, measurements=measurements, changes=changes)
+    )
+    if fingerprint is not None and age is None and _is_cacheable(analysis):
+        await asyncio.to_thread(verdict_cache.put, fingerprint, normalize_target(target), analysis)
+    ai_span.finish(
+        "cached" if age is not None else ("ok" if _is_cacheable(analysis) else "error"),
+        bytes=len(analysis.encode("utf-8"))
+    )
+    return analysis, age
+
+
+async def cached_comparison_async(results_by_target: list, on_text=None) -> tuple:
+    ai_span = Span("ai", targets=len(results_by_target))
+    digest = hashlib.sha256("\n".join(
+        f"{normalize_target(target)}\n{strip_cache_marks(all_results)}\n{changes}" for target, all_results, _, changes in results_by_target
+    ).encode("utf-8")).hexdigest()
+    analysis, age = await cached_call_async(
+        ("comparison", digest),
+        lambda: analyze_targets_async(results_by_target, on_text=on_text)
+    )
+    ai_span.finish(
+        "cached" if age is not None else ("ok" if _is_cacheable(analysis) else "error"),
+        bytes=len(analysis.encode("utf-8"))
+    )
+    return analysis, age
+
+
+class _ChatUpdater:
+    """update для ThrottledMessage: chat.update ставится в цикл событий, обновления сообщения идут по порядку.
+
+    Таймер ThrottledMessage срабатывает в своем потоке, поэтому вызов только планирует задачу.
+    """
+
+    def __init__(self, chat_update, channel: str):
+        self._loop = asyncio.get_running_loop()
+        self._chat_update = chat_update
+        self._channel = channel
+        self._lock = asyncio.Lock()
+        self._tasks = set()
+
+    def __call__(self, ts: str, text: str):
+        self._loop.call_soon_threadsafe(self._schedule, ts, text)
+
+    def _schedule(self, ts: str, text: str):
+        task = self._loop.create_task(self._send(ts, text))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, ts: str, text: str):
+        async with self._lock:
+            try:
+                await self._chat_update(channel=self._channel, ts=ts, text=text)
+            except Exception as e:
+                print(f"⚠️ Не удалось обновить сообщение: {e}")
+
+    async def wait(self):
+        """Ждет отправки запланированных обновлений"""
+        await asyncio.sleep(0)
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+
+def _throttled(event, api_calls) -> tuple:
+    updater = _ChatUpdater(api_calls.wrap(app.client.chat_update, "chat.update"), event.get('channel'))
+    return ThrottledMessage(None, updater, min_interval=PROGRESS_CONFIG["min_update_interval"]), updater
+
+
+async def post_delta_async(delta, say, thread_ts, target=None):
+    if _delta_changes(delta) is not None and HISTORY_CONFIG["post_delta"]:
+        await say(render_delta(delta, target), thread_ts=thread_ts)
+
+
+async def post_analysis_async(event, say, api_calls, thread_ts, analyze):
+    """Публикует AI заключение; analyze(on_text) - корутина, возвращающая (текст, возраст кеша)"""
+    analysis_header = "🤖 *Итоговый анализ:*"
+    try:
+        if PROGRESS_CONFIG["ai_streaming"]:
+            ai_message, updater = _throttled(event, api_calls)
+            placeholder = f"{analysis_header}\n⏳ _Анализ результатов..._"
+            ai_message.start(placeholder, (await say(placeholder, thread_ts=thread_ts))["ts"])
+            analysis, age = await analyze(lambda partial: ai_message.set_text(f"{analysis_header}\n{partial}"))
+            ai_message.set_text(f"{analysis_header}\n{format_summary(analysis)}{format_cache_age(age)}")
+            ai_message.flush()
+            await updater.wait()
+        else:
+            analysis, age = await analyze(None)
+            await say(f"{analysis_header}\n{format_summary(analysis)}{format_cache_age(age)}", thread_ts=thread_ts)
+    except Exception as e:
+        await say(f"⚠️ *AI анализ недоступен*: {str(e)}\n📊 Результаты тестов доступны выше", thread_ts=thread_ts)
+
+
+async def run_target_tests_async(target, globalping_header, local_header, board=None, on_stage=None) -> tuple:
+    """Globalping тесты и локальные команды одной цели; on_stage(заголовок, результаты) - корутина"""
+    measurements = {}
+    ledger = CreditLedger(escalation_stats, current_report())
+    with span("globalping", target=target) as globalping_span:
+        globalping_results = await run_globalping_tests_async(
+            target, GLOBALPING_TESTS,
+            on_result=(lambda test_type, text, skipped=False: board.finish_item(globalping_header, test_type, text, skipped=skipped)) if board else None,
+            measurements=measurements,
+            ledger=ledger
+        )
+        globalping_span.set(credits=ledger.total)
+    print(f"{ledger.render()} `{target}`")
+    if board:
+        board.finish_item(globalping_header, CREDITS_ITEM, ledger.render(), ok=True)
+    if on_stage and globalping_results:
+        await on_stage(globalping_header, globalping_results + [ledger.render()])
+
+    with span("local", target=target):
+        local_results = await run_local_commands_async(
+            get_os_commands(target),
+            on_result=(lambda command, text: board.finish_item(local_header, command, text, ok=local_result_ok(text))) if board else None
+        )
+    if on_stage and local_results:
+        await on_stage(local_header, local_results)
+    return globalping_results, local_results, measurements
+
+
+async def _start_board(event, say, api_calls, thread_ts, title, sections) -> tuple:
+    """Сообщение со статусами тестов: публикуется сразу, обновляется через chat.update"""
+    message, updater = _throttled(event, api_calls)
+    board = ProgressBoard(message, title=title)
+    for header, items in sections:
+        board.add_section(header, items)
+    board.start((await say(board.render(), thread_ts=thread_ts))["ts"])
+    return board, updater
+
+
+async def run_diagnostics_async(event, target, say):
+    """Этапы диагностики одной цели: скриншот, Globalping, локальные команды и AI анализ"""
+    try:
+        thread_ts = event.get('ts')
+        try:
+            permalink = await asyncio.to_thread(slack_metadata.permalink, event.get('channel'), event.get('ts'))
+        except Exception as e:
+            permalink = f"Ошибка получения ссылки: {str(e)}"
+        print(f"🔍 {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} {target} {permalink}")
+
+        api_calls = slack_metadata.new_event()
+        say = api_calls.wrap(say, "chat.postMessage")
+        token_status = "🔑" if GLOBALPING_API_TOKEN else "🌐"
+        await say(f"🔍 *Диагностика ресурса:* `{target}`", thread_ts=thread_ts)
+        screenshot = asyncio.ensure_future(post_screenshot_async(target, say, thread_ts))
+
+        globalping_header = f"`{token_status}` *Результаты глобальных проверок:*"
+        local_header = "💻 *Результаты локальных команд:*"
+
+        if PROGRESS_CONFIG["streaming"]:
+            board, updater = await _start_board(
+                event, say, api_calls, thread_ts, f"📡 *Ход диагностики* `{target}`",
+                [(globalping_header, GLOBALPING_TESTS + [CREDITS_ITEM]), (local_header, get_os_commands(target))]
+            )
+            globalping_results, local_results, measurements = await run_target_tests_async(target, globalping_header, local_header, board=board)
+            board.close()
+            await updater.wait()
+        else:
+            globalping_results, local_results, measurements = await run_target_tests_async(
+                target, globalping_header, local_header,
+                on_stage=lambda header, results: say(f"{header}\n" + "\n\n".join(results), thread_ts=thread_ts)
+            )
+
+        all_results = "\n".join(globalping_results + local_results)
+        delta = await asyncio.to_thread(record_history, target, all_results, measurements)
+        await post_delta_async(delta, say, thread_ts)
+
+        await post_analysis_async(
+            event, say, api_calls, thread_ts,
+            lambda on_text: cached_analysis_async(
+                target, all_results, on_text=on_text, measurements=measurements, changes=_delta_changes(delta)
+            )
+        )
+        await screenshot
+        print(f"📊 Web API вызовов за событие: {api_calls.total} {api_calls.calls} 📥 Очередь: {report_queue.stats()}")
+
+    except Exception as e:
+        report = current_report()
+        if report is not None:
+            report.fail()
+        try:
+            await say(f"❌ *Критическая ошибка бота*: {str(e)}\nПовторите запрос через несколько минут", thread_ts=event.get('ts'))
+        except Exception:
+            print(f"Критическая ошибка: {e}")
+
+
+async def run_multi_diagnostics_async(event, targets, say):
+    """Несколько целей одновременно с общим сравнительным AI анализом"""
+    try:
+        thread_ts = event.get('ts')
+        print(f"🔍 {len(targets)} целей: {', '.join(targets)}")
+
+        api_calls = slack_metadata.new_event()
+        say = api_calls.wrap(say, "chat.postMessage")
+        token_status = "🔑" if GLOBALPING_API_TOKEN else "🌐"
+        await say(f"🔍 *Диагностика ресурсов:* " + ", ".join(f"`{target}`" for target in targets), thread_ts=thread_ts)
+        screenshots = [asyncio.ensure_future(post_screenshot_async(target, say, thread_ts)) for target in targets]
+
+        headers = {
+            target: (f"`{token_status}` *Глобальные проверки* `{target}`:", f"💻 *Локальные команды* `{target}`:")
+            for target in targets
+        }
+        board = updater = None
+        if PROGRESS_CONFIG["streaming"]:
+            sections = []
+            for target in targets:
+                sections += [(headers[target][0], GLOBALPING_TESTS + [CREDITS_ITEM]), (headers[target][1], get_os_commands(target))]
+            board, updater = await _start_board(
+                event, say, api_calls, thread_ts, "📡 *Ход диагностики* " + ", ".join(f"`{target}`" for target in targets), sections
+            )
+
+        outcomes = await run_ordered_async(
+            [
+                (target, lambda target=target: run_target_tests_async(
+                    target, *headers[target], board=board,
+                    on_stage=None if board else lambda header, results: say(f"{header}\n" + "\n\n".join(results), thread_ts=thread_ts)
+                ))
+                for target in targets
+            ],
+            on_error=lambda target, e: ([f"❌ **Критическая ошибка** `{target}`: {str(e)}"], [], {})
+        )
+        if board is not None:
+            board.close()
+            await updater.wait()
+
+        results_by_target = []
+        for target, (globalping_results, local_results, measurements) in zip(targets, outcomes):
+            all_results = "\n".join(globalping_results + local_results)
+            delta = await asyncio.to_thread(record_history, target, all_results, measurements)
+            await post_delta_async(delta, say, thread_ts, target)
+            results_by_target.append((target, all_results, measurements, _delta_changes(delta)))
+        await post_analysis_async(
+            event, say, api_calls, thread_ts,
+            lambda on_text: cached_comparison_async(results_by_target, on_text=on_text)
+        )
+        await asyncio.gather(*screenshots)
+        print(f"📊 Web API вызовов за событие: {api_calls.total} {api_calls.calls} 📥 Очередь: {report_queue.stats()}")
+
+    except Exception as e:
+        report = current_report()
+        if report is not None:
+            report.fail()
+        try:
+            await say(f"❌ *Критическая ошибка бота*: {str(e)}\nПовторите запрос через несколько минут", thread_ts=event.get('ts'))
+        except Exception:
+            print(f"Критическая ошибка: {e}")
+
+
+async def diagnose_target_async(event, target, say):
+    with report_trace(target, log_path=METRICS_CONFIG["report_log"] or None, channel=event.get('channel')):
+        with deadline_scope(ERROR_RECOVERY_CONFIG["report_deadline"]):
+            await run_diagnostics_async(event, target, say)
+
+
+async def diagnose_targets_async(event, targets, say):
+    with report_trace(", ".join(targets), log_path=METRICS_CONFIG["report_log"] or None, channel=event.get('channel'), targets=len(targets)):
+        with deadline_scope(ERROR_RECOVERY_CONFIG["report_deadline"]):
+            await run_multi_diagnostics_async(event, targets, say)
+
+
+def _leased_async(job, lease):
+    """Задача, по завершении которой событие помечается обработанным для всех узлов"""
+    async def run():
+        try:
+            await job()
+        finally:
+            await asyncio.to_thread(lease.complete)
+    return run
+
+
+@app.event("message")
+async def handle_message(event, say, body=None):
+    """Обработка входящих Slack-сообщений: отчет ставится в очередь цикла событий"""
+    if event.get('thread_ts') and event.get('thread_ts') != event.get('ts'):
+        return
+    try:
+        # Идентичность бота получена при запуске и берется из кеша; после смены токена
+        # auth.test блокирует, поэтому запрашивается вне цикла событий
+        identity = await asyncio.to_thread(slack_metadata.resolve)
+        if event.get('user') == identity["user_id"]:
+            return
+
+        max_targets = MULTI_TARGET_CONFIG["max_targets"] if MULTI_TARGET_CONFIG["enabled"] else 1
+        targets = unique_hosts(target_extractor.extract(event), max_targets)
+        if not targets:
+            return
+
+        lease = None
+        if lease_coordinator is not None:
+            lease = await asyncio.to_thread(lease_coordinator.claim, event_keys(event, (body or {}).get('event_id')))
+            if lease is None:
+                print(f"🔁 Событие {event.get('channel')}/{event.get('ts')} уже обрабатывается")
+                return
+
+        if len(targets) == 1:
+            job = lambda: diagnose_target_async(event, targets[0], say)
+        else:
+            job = lambda: diagnose_targets_async(event, targets, say)
+        if lease is not None:
+            job = _leased_async(job, lease)
+        try:
+            position = report_queue.submit(event.get('channel', ''), job)
+        except QueueFull:
+            if lease is not None:
+                await asyncio.to_thread(lease.release)
+            await say(f"🚦 *Очередь диагностики переполнена* ({QUEUE_CONFIG['max_depth']} задач). Повторите запрос через несколько минут", thread_ts=event.get('ts'))
+            return
+
+        if position > 0:
+            await say(f"⏳ Запрос поставлен в очередь, позиция {position}", thread_ts=event.get('ts'))
+
+    except Exception as e:
+        try:
+            await say(f"❌ *Критическая ошибка бота*: {str(e)}\nПовторите запрос через несколько минут", thread_ts=event.get('ts'))
+        except Exception:
+            print(f"Критическая ошибка: {e}")
+
+
+async def main():
+    global globalping_client
+    print("🚀 Запуск Slack AI бота (asyncio)...")
+    print(f"🔑 Globalping токен: {'✅ Настроен' if GLOBALPING_API_TOKEN else '❌ Отсутствует (будет использован публичный API)'}")
+    print(f"🤖 OpenAI API: {'✅ Настроен' if OPENAI_API_KEY else '❌ Отсутствует'}")
+    print(f"⚡ Одновременных отчетов: до {ASYNC_CONFIG['max_reports']}, HTTP соединений: {ASYNC_CONFIG['http_connections']}")
+
+    if METRICS_CONFIG["port"]:
+        start_metrics_server(METRICS_CONFIG["host"], METRICS_CONFIG["port"])
+        print(f"📈 Метрики: http://{METRICS_CONFIG['host']}:{METRICS_CONFIG['port']}/metrics")
+
+    connector = aiohttp.TCPConnector(limit=ASYNC_CONFIG["http_connections"])
+    async with aiohttp.ClientSession(connector=connector) as session:
+        globalping_client = AsyncGlobalpingClient(session, GLOBALPING_API_TOKEN, scheduler=globalping_scheduler)
+        if GLOBALPING_API_TOKEN:
+            credits = await globalping_client.get_credits()
+            if credits["success"]:
+                globalping_scheduler.set_credits("token", credits["credits"].get("remaining"))
+                print(f"💰 Кредиты Globalping: {credits['credits'].get('remaining', 'N/A')}")
+
+        if measurement_store is not None:
+            removed = await asyncio.to_thread(measurement_store.compact)
+            print(f"🗄️ История измерений: {measurement_store.stats()}, удалено устаревших запусков: {removed}")
+
+        identity = await asyncio.to_thread(slack_metadata.resolve)
+        print(f"🆔 Бот: {identity['user_id']} ({identity['url']})")
+        if lease_coordinator is not None:
+            print(f"🧩 Узел: {lease_coordinator.owner} (аренды: {CLUSTER_CONFIG['lease_store']})")
+
+        report_queue.start()
+        handler = AsyncSocketModeHandler(app, SLACK_APP_TOKEN)
+        await handler.connect_async()
+
+        # SIGTERM (systemctl stop/restart): новые события уходят другим узлам, текущие отчеты дописываются
+        stop_requested = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_requested.set)
+        await stop_requested.wait()
+        print("🛑 Остановка: соединение с Slack закрывается, ожидание текущих диагностик...")
+        await handler.close_async()
+        drained = await report_queue.drain(CLUSTER_CONFIG["drain_timeout"])
+        print(f"🛑 Очередь {'завершена' if drained else 'не завершена за лимит'}: {report_queue.stats()}")
+        report_queue.shutdown()
+        if lease_coordinator is not None:
+            lease_coordinator.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except Exception as e:
+        print(f"❌ Ошибка запуска бота: {e}")
+        print("Проверьте переменные окружения в .env файле")
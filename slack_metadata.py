@@ -0,0 +1,94 @@
+"""
+Кеш идентичности бота и учет вызовов Slack Web API на одно событие
+"""
+
+import threading
+from typing import Any, Callable, Dict, Optional
+
+
+class EventApiCounter:
+    """Счетчик вызовов Web API, совершенных при обработке одного события"""
+
+    def __init__(self, totals: "SlackMetadata"):
+        self._totals = totals
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+
+    def count(self, method: str):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        self._totals.count(method)
+
+    def wrap(self, func: Callable, method: str) -> Callable:
+        """Оборачивает функцию (say, client.chat_update...) с подсчетом вызовов"""
+        def counted(*args, **kwargs):
+            self.count(method)
+            return func(*args, **kwargs)
+        return counted
+
+    @property
+    def total(self) -> int:
+        with self._lock:
+            return sum(self.calls.values())
+
+
+class SlackMetadata:
+    """Идентичность бота и адрес workspace, полученные один раз через auth.test.
+
+    Повторный запрос выполняется только при смене токена клиента.
+    """
+
+    def __init__(self, client: Any):
+        self.client = client
+        self._lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._identity: Dict[str, Any] = {}
+        self._totals: Dict[str, int] = {}
+        self.events = 0
+
+    def resolve(self) -> Dict[str, Any]:
+        """Возвращает данные auth.test, запрашивая их только при смене токена"""
+        with self._lock:
+            if self._identity and self._token == self.client.token:
+                return self._identity
+            token = self.client.token
+        response = self.client.auth_test()
+        self.count("auth.test")
+        with self._lock:
+            self._token = token
+            self._identity = {
+                "user_id": response.get("user_id"),
+                "bot_id": response.get("bot_id"),
+                "team_id": response.get("team_id"),
+                "url": response.get("url") or ""
+            }
+            return self._identity
+
+    @property
+    def bot_user_id(self) -> Optional[str]:
+        return self.resolve()["user_id"]
+
+    def permalink(self, channel: str, message_ts: str) -> str:
+        """Строит ссылку на сообщение локально, без вызова chat.getPermalink"""
+        base_url = self.resolve()["url"]
+        if not base_url:
+            return f"{channel}/{message_ts}"
+        return f"{base_url.rstrip('/')}/archives/{channel}/p{message_ts.replace('.', '')}"
+
+    def count(self, method: str):
+        with self._lock:
+            self._totals[method] = self._totals.get(method, 0) + 1
+
+    def new_event(self) -> EventApiCounter:
+        with self._lock:
+            self.events += 1
+        return EventApiCounter(self)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(self._totals.values())
+            return {
+                "events": self.events,
+                "calls": dict(self._totals),
+                "calls_per_event": round(total / self.events, 2) if self.events else 0.0
+            }
@@ -0,0 +1,203 @@
+"""
+Извлечение целей диагностики из сообщений Slack
+"""
+
+import ipaddress
+import re
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+# Цель всегда содержит точку или двоеточие: сканер запускается только на таких словах текста.
+# IPv4 разбирается вместе с доменами, кандидаты IPv6 проверяются через ipaddress.
+# (?=(?P<label>...))(?P=label) - атомарная группа без возврата (работает и до Python 3.11):
+# первая метка домена не перебирается посимвольно, если точки после нее нет.
+_SCANNER = re.compile(
+    r"""
+    (?P<scheme>https?)://
+        (?:\[(?P<url_v6>[0-9A-Fa-f:.]+)\]|(?P<url_host>[^\s/:?\#<>|"'`()\[\],;]+))
+        (?::(?P<url_port>\d{1,5}))?
+        (?P<path>[/?\#][^\s<>|"'`]*)?
+    | \b(?P<host>[^\W_](?=(?P<label>[\w-]*))(?P=label)(?:\.[\w-]+)+)(?::(?P<host_port>\d{1,5})\b)?
+    | (?<![\w:.])(?P<v6>[0-9A-Fa-f]{0,4}:[0-9A-Fa-f:]*)
+    """,
+    re.VERBOSE | re.IGNORECASE
+)
+
+# Знаки препинания, которыми обычно заканчивается предложение после ссылки
+_TRAILING = ".,;:!?)»'\""
+
+# Сколько байт сообщения (текст, файлы, поля вложений вместе) просматривается на одно событие
+DEFAULT_MAX_SCAN_BYTES = 64 * 1024
+
+
+class Target(NamedTuple):
+    """Нормализованная цель: схема и путь есть только у URL, host - ASCII (IDN в punycode)"""
+    scheme: Optional[str]
+    host: str
+    port: Optional[int] = None
+    path: str = ""
+
+    @property
+    def is_ip(self) -> bool:
+        return _ipv4(self.host) is not None or ":" in self.host
+
+    @property
+    def netloc(self) -> str:
+        host = f"[{self.host}]" if ":" in self.host else self.host
+        return f"{host}:{self.port}" if self.port else host
+
+    def __str__(self) -> str:
+        if self.scheme:
+            return f"{self.scheme}://{self.netloc}{self.path}"
+        return self.netloc if self.port else self.host
+
+
+def _port(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    port = int(value)
+    return port if 0 < port < 65536 else None
+
+
+def _ipv4(value: str) -> Optional[str]:
+    parts = value.split(".")
+    if len(parts) != 4 or not all(part.isdigit() and len(part) <= 3 and int(part) <= 255 for part in parts):
+        return None
+    return value
+
+
+def _ipv6(value: str) -> Optional[str]:
+    try:
+        address = ipaddress.IPv6Address(value)
+    except ValueError:
+        return None
+    return None if address.is_unspecified else str(address)
+
+
+def _host(value: str) -> Optional[str]:
+    """IPv4 или домен в нижнем регистре и punycode; None, если это не похоже на хост"""
+    host = value.rstrip(".").lower()
+    tld = host.rpartition(".")[2]
+    if tld.isdigit():
+        return _ipv4(host)
+    if len(tld) < 2 or not tld.isalpha():
+        return None
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            return None
+    return host
+
+
+def _parse(match: "re.Match[str]") -> Optional[Target]:
+    scheme, url_v6, url_host, url_port, path, host, host_port, v6 = match.group(
+        "scheme", "url_v6", "url_host", "url_port", "path", "host", "host_port", "v6"
+    )
+    if scheme:
+        host = _ipv6(url_v6) if url_v6 else _host(url_host.rstrip(_TRAILING))
+        if host is None:
+            return None
+        path = path.rstrip(_TRAILING) if path else ""
+        return Target(scheme.lower(), host, _port(url_port), "" if path == "/" else path)
+    if host:
+        host = _host(host)
+        return Target(None, host, _port(host_port)) if host else None
+    host = _ipv6(v6)
+    return Target(None, host) if host else None
+
+
+def _scan(text: str) -> Iterator[Target]:
+    for word in text.split():
+        if "." in word or ":" in word:
+            for match in _SCANNER.finditer(word):
+                target = _parse(match)
+                if target is not None:
+                    yield target
+
+
+def parse_target(text: str) -> Optional[Target]:
+    """Первая цель в строке или None"""
+    return next(_scan(text), None)
+
+
+def _event_texts(event: Dict[str, Any]) -> Iterator[str]:
+    """Текст сообщения, затем содержимое файлов и поля вложений"""
+    yield event.get('text') or ''
+    for file in event.get('files') or []:
+        yield file.get('plain_text') or ''
+    for attachment in event.get('attachments') or []:
+        for field in attachment.get('fields') or []:
+            yield field.get('value') or ''
+
+
+class TargetExtractor:
+    """Находит цели в событии Slack: без повторов, в порядке появления, без игнорируемых хостов.
+
+    ignore - домены, которые не диагностируются вместе со своими поддоменами.
+    max_scan_bytes ограничивает объем просматриваемого текста на событие,
+    чтобы огромные вставленные логи не занимали обработчик.
+    """
+
+    def __init__(self, ignore: Iterable[str] = (), max_scan_bytes: int = DEFAULT_MAX_SCAN_BYTES):
+        self.ignore = frozenset(host.strip().rstrip(".").lower() for host in ignore if host.strip())
+        self.max_scan_bytes = max_scan_bytes
+
+    def is_ignored(self, host: str) -> bool:
+        if not self.ignore:
+            return False
+        labels = host.split(".")
+        return any(".".join(labels[index:]) in self.ignore for index in range(len(labels)))
+
+    def extract(self, event: Dict[str, Any], limit: Optional[int] = None) -> List[Target]:
+        targets: List[Target] = []
+        seen = set()
+        budget = self.max_scan_bytes
+        for text in _event_texts(event):
+            if budget <= 0:
+                break
+            chunk = text[:budget]
+            if chunk.isascii():
+                budget -= len(chunk)
+            else:
+                # Символ UTF-8 занимает до 4 байт: после обрезки по символам режем точно по байтам
+                raw = chunk.encode("utf-8")[:budget]
+                chunk = raw.decode("utf-8", "ignore")
+                budget -= len(raw)
+            for target in _scan(chunk):
+                if target in seen or self.is_ignored(target.host):
+                    continue
+                seen.add(target)
+                targets.append(target)
+                if limit is not None and len(targets) >= limit:
+                    return targets
+        return targets
+
+
+_default_extractor = TargetExtractor()
+
+
+def extract_domain(target):
+    """Извлекает чистый хост из URL или цели с портом"""
+    parsed = parse_target(target)
+    if parsed is None:
+        return target.replace("https://", "").replace("http://", "").split("/")[0]
+    return parsed.host
+
+
+def extract_targets(event: Dict[str, Any], extractor: Optional[TargetExtractor] = None) -> List[str]:
+    """Извлечение целей из различных частей сообщения Slack"""
+    return [str(target) for target in (extractor or _default_extractor).extract(event)]
+
+
+def unique_hosts(targets: Iterable[Target], limit: Optional[int] = None) -> List[str]:
+    """Цели с разными хостами в порядке появления: URL и домен одного хоста проверяются один раз"""
+    hosts = set()
+    result = []
+    for target in targets:
+        if target.host in hosts:
+            continue
+        hosts.add(target.host)
+        result.append(str(target))
+        if limit is not None and len(result) >= limit:
+            break
+    return result
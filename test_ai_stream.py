@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты потокового AI анализа
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from ai_stream import StreamingSummaryFormatter, apply_summary_transforms, stream_completion, stream_completion_async, stream_timings
+
+
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class _FakeCompletions:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.request = None
+
+    def create(self, **request):
+        self.request = request
+        return iter(self.chunks)
+
+
+def test_incremental_formatting_matches_full_formatting():
+    """Потоковое форматирование дает тот же результат, что и форматирование целиком"""
+    text = "### Статус\n**Работает**, задержка **20ms**\n#### Проблемы\nнет"
+    formatter = StreamingSummaryFormatter()
+    for index in range(0, len(text), 3):
+        partial = formatter.feed(text[index:index + 3])
+    assert partial == apply_summary_transforms(text).strip()
+
+
+def test_stream_completion_reports_partial_text_and_timings():
+    """Текст передается частями, записываются время первого токена и полное время"""
+    completions = _FakeCompletions([_chunk("**Ста"), _chunk("тус**"), _chunk(None), _chunk(": ok")])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    updates = []
+
+    text, timings = stream_completion(client, updates.append, model="gpt-4o", messages=[])
+
+    assert completions.request["stream"] is True
+    assert text == "**Статус**: ok"
+    assert updates[-1] == "*Статус*: ok"
+    assert len(updates) == 3
+    assert timings["ttft"] <= timings["total"]
+    assert stream_timings.snapshot()["completions"] >= 1
+
+
+def test_async_stream_awaits_updates():
+    """Асинхронный вариант ждет корутинные обновления и дает тот же текст"""
+    class _AsyncCompletions:
+        async def create(self, **request):
+            async def chunks():
+                for text in ("**Ста", "тус**", ": ok"):
+                    yield _chunk(text)
+            return chunks()
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=_AsyncCompletions()))
+    updates = []
+
+    async def on_text(text):
+        updates.append(text)
+
+    text, timings = asyncio.run(stream_completion_async(client, on_text, model="gpt-4o", messages=[]))
+    assert text == "**Статус**: ok"
+    assert updates[-1] == "*Статус*: ok"
+    assert timings["ttft"] <= timings["total"]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты набора микробенчмарков
+"""
+
+from benchmarks.run_benchmarks import build_benchmarks, compare, load_baseline
+
+
+def test_every_benchmark_runs_offline():
+    """Каждый бенчмарк выполняется на фикстурах и есть в baseline"""
+    baseline = load_baseline()["benchmarks"]
+    for name, func in build_benchmarks():
+        assert func() is not None
+        assert name in baseline
+
+
+def test_large_fixtures_are_realistic():
+    """Фикстуры содержат много проб и 30-хоповый mtr"""
+    benchmarks = dict(build_benchmarks())
+    mtr = benchmarks["globalping.parse.mtr"]()
+    assert len(mtr.probes) >= 10
+    assert all(len(probe.hops) == 30 for probe in mtr.probes)
+    assert len(benchmarks["globalping.parse.ping"]().probes) >= 50
+
+
+def test_regression_is_flagged_over_tolerance():
+    """Регрессией считается только замедление сверх допуска; новые бенчмарки не сравниваются"""
+    rows = compare({"fast": 10.0, "slow": 31.0, "new": 5.0}, {"fast": 9.0, "slow": 10.0}, tolerance=2.0)
+    flagged = {row["name"]: row["regression"] for row in rows}
+    assert flagged == {"fast": False, "slow": True, "new": False}
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты аренд событий между экземплярами бота
+"""
+
+import threading
+
+import pytest
+
+from cluster_lease import LeaseCoordinator, LeaseStore, MemoryLeaseStore, SQLiteLeaseStore, event_keys, open_lease_store
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_incomplete_store_fails_on_construction():
+    """Хранилище без одного из методов не создается, а не падает на первом событии"""
+    class NoPurge(LeaseStore):
+        def acquire(self, keys, owner, ttl):
+            return True
+
+        def renew(self, keys, owner, ttl):
+            return True
+
+        def release(self, keys, owner):
+            pass
+
+    with pytest.raises(TypeError):
+        NoPurge()
+
+
+def test_event_keys_cover_delivery_and_message():
+    """Ключи - id доставки и (канал, ts); без event_id остается только сообщение"""
+    event = {"channel": "C1", "ts": "1.0"}
+    assert event_keys(event, "Ev1") == ["event:Ev1", "message:C1:1.0"]
+    assert event_keys(event) == ["message:C1:1.0"]
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_lease_is_exclusive_until_expired(tmp_path, backend):
+    """Занятый ключ не выдается ни другому узлу, ни повторно тому же; после истечения - выдается"""
+    clock = _Clock()
+    store = MemoryLeaseStore(clock) if backend == "memory" else SQLiteLeaseStore(str(tmp_path / "leases.sqlite3"), clock)
+    assert store.acquire(["event:1", "message:C1:1.0"], "node-a", ttl=60)
+    assert not store.acquire(["message:C1:1.0"], "node-b", ttl=60)
+    assert not store.acquire(["event:1"], "node-a", ttl=60)
+    # Все или ничего: свободный ключ не захватывается вместе с занятым
+    assert not store.acquire(["event:2", "message:C1:1.0"], "node-b", ttl=60)
+    assert store.acquire(["event:2"], "node-b", ttl=60)
+
+    assert not store.renew(["event:1"], "node-b", ttl=60)
+    clock.now += 61
+    assert not store.renew(["event:1"], "node-a", ttl=60)
+    assert store.acquire(["event:1", "message:C1:1.0"], "node-b", ttl=60)
+    assert store.purge() == 1
+    store.close()
+
+
+def test_sqlite_store_is_shared_between_connections(tmp_path):
+    """Два процесса с одним файлом: событие достается только одному"""
+    path = str(tmp_path / "leases.sqlite3")
+    stores = [open_lease_store(f"sqlite://{path}"), open_lease_store(path)]
+    results = []
+    barrier = threading.Barrier(len(stores))
+
+    def claim(index):
+        barrier.wait()
+        results.append(stores[index].acquire(["event:1"], f"node-{index}", ttl=60))
+
+    threads = [threading.Thread(target=claim, args=(index,)) for index in range(len(stores))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False, True]
+    for store in stores:
+        store.close()
+
+    with pytest.raises(ValueError):
+        open_lease_store("redis://localhost")
+
+
+def test_coordinator_completes_releases_and_renews():
+    """Обработанное событие остается занятым на done_ttl, отпущенное - свободно, активные продлеваются"""
+    clock = _Clock()
+    store = MemoryLeaseStore(clock)
+    node_a = LeaseCoordinator(store, owner="node-a", ttl=30, done_ttl=3600)
+    node_b = LeaseCoordinator(store, owner="node-b", ttl=30, done_ttl=3600)
+    try:
+        done = node_a.claim(["event:1"])
+        assert done is not None and node_b.claim(["event:1"]) is None
+        done.complete()
+        clock.now += 600
+        assert node_b.claim(["event:1"]) is None
+
+        released = node_a.claim(["event:2"])
+        released.release()
+        assert node_b.claim(["event:2"]) is not None
+
+        running = node_a.claim(["event:3"])
+        clock.now += 20
+        node_a.renew_all()
+        clock.now += 20
+        assert node_b.claim(["event:3"]) is None
+        running.complete()
+
+        assert node_a.stats()["completed"] == 2 and node_a.stats()["released"] == 1
+        assert node_b.stats()["duplicates"] == 3
+    finally:
+        node_a.close()
+        node_b.close()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты общих шагов диагностики синхронного и асинхронного режимов
+"""
+
+from diagnostic_steps import (
+    command_failed, command_not_started, command_outcome, command_span_fields, command_timeout,
+    globalping_cache_key, globalping_result, local_result, local_result_ok, native_outcome
+)
+from globalping_models import Measurement, Probe
+from probe_escalation import CreditLedger, ProbeRequest
+from retry_policy import Deadline, RetryPolicy
+
+
+def test_command_outcomes_for_retry_policy():
+    """Исходы попытки: вывод, stderr как ошибка, пустой вывод, таймаут и незапущенная команда"""
+    assert command_outcome("dig", 1, 8, (0, "1.1.1.1\n", "")) == ("1.1.1.1\n", None)
+    assert command_outcome("dig", 2, 8, (1, "", "timed out\n")) == ("❌ Ошибка после 2 попыток: timed out", "timed out\n")
+    assert command_outcome("dig", 1, 8, (0, "", "")) == ("⚠️ Команда выполнена, но результат пуст", None)
+    assert command_outcome("mtr", 3, 25, None) == ("⏱️ Mtr прерван по таймауту (25с) после 3 попыток", "timeout")
+    assert command_not_started("ping", slots_busy=True)[1] == "deadline"
+
+    text, error = command_failed("mtr", FileNotFoundError("mtr"))
+    assert text.startswith("❌ Команда не найдена: mtr") and isinstance(error, FileNotFoundError)
+    assert command_span_fields((0, "ab", "c")) == {"outcome": "ok", "bytes": 3}
+    assert command_span_fields(None) == {"outcome": "timeout"}
+
+
+def test_command_timeout_grows_and_respects_deadline():
+    """Таймаут растет с попытками, но не выходит за дедлайн"""
+    assert command_timeout("dig", 1.5, Deadline(None)) == 12
+    assert command_timeout("unknown", 1, Deadline(None)) == 10
+    assert command_timeout("mtr", 2, Deadline(5)) <= 5
+    assert command_timeout("native-dns", 1.5, Deadline(None), base_timeout=4) == 6
+
+
+def test_native_probe_errors_go_through_retry_policy():
+    """Ошибка встроенной пробы повторяется, NXDOMAIN - нет"""
+    outputs = iter(["❌ DNS A example.test: SERVFAIL (сервер 127.0.0.1, 3ms)", "192.0.2.10\n;; NOERROR"])
+    policy = RetryPolicy(base_delay=0, jitter=0, min_attempt_time=0, sleep=lambda seconds: None)
+    assert policy.run("local.native-dns", lambda attempt, scale: native_outcome(next(outputs))) == "192.0.2.10\n;; NOERROR"
+
+    attempts = []
+    nxdomain = "❌ DNS A missing.test: NXDOMAIN (сервер 127.0.0.1, 3ms)"
+    assert policy.run("local.native-dns", lambda attempt, scale: attempts.append(attempt) or native_outcome(nxdomain)) == nxdomain
+    assert attempts == [1]
+
+
+def test_local_result_text_and_outcome():
+    """Результат команды с кешем и без; ошибки и таймауты не считаются успехом"""
+    text, outcome = local_result("dig example.com", "1.1.1.1", None)
+    assert text == "💻 `dig example.com`:\n```1.1.1.1```" and outcome == "ok"
+    assert local_result("dig example.com", "1.1.1.1", 30)[1] == "cached"
+    assert local_result("dig example.com", "❌ Ошибка после 3 попыток: boom", None)[1] == "error"
+    assert not local_result_ok("💻 `ping x`: ⏱️ не завершена за общий лимит этапа (60с)")
+
+
+def test_globalping_result_records_measurement_and_credits():
+    """Свежее измерение попадает в measurements и ledger, кешированное кредитов не тратит"""
+    request = ProbeRequest(("RU",), 2, "initial")
+    measurement = Measurement("ping", "example.com", [Probe("Moscow", "RU", avg=10.0, loss=0.0)])
+    measurements = {}
+    ledger = CreditLedger()
+
+    text, fields = globalping_result("ping", measurement, None, request, measurements, ledger)
+    assert "PING" in text and fields == {"outcome": "ok", "probes": 1}
+    assert measurements["ping"] is measurement and ledger.by_stage == {"initial": 1}
+
+    _, fields = globalping_result("ping", measurement, 12.0, request, measurements, ledger)
+    assert fields["outcome"] == "cached" and ledger.total == 1
+
+    text, fields = globalping_result("http", "⏱️ **HTTP**: таймаут", None)
+    assert text == "⏱️ **HTTP**: таймаут" and fields == {"outcome": "timeout"}
+    assert globalping_cache_key("https://Example.com/", "ping", request) == ("globalping", "example.com", "ping", ("RU",), 2)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты планировщика бюджета Globalping
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from globalping_budget import BudgetExhausted, EndpointBudget, GlobalpingScheduler, TokenFallback
+from globalping_with_token import GlobalpingTokenClient
+from retry_policy import RetryPolicy
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class _Response:
+    def __init__(self, status_code=202, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def _scheduler(clock, token_rate=3600, public_rate=3600, burst=10, **kwargs):
+    return GlobalpingScheduler(
+        {
+            "token": EndpointBudget("token", token_rate, burst, clock),
+            "public": EndpointBudget("public", public_rate, burst, clock)
+        },
+        clock=clock, sleep=clock.sleep, **kwargs
+    )
+
+
+def test_bucket_is_shared_and_queues_until_refill():
+    """Все запросы расходуют одно ведро; при нехватке запрос ждет пополнения"""
+    clock = _Clock()
+    scheduler = _scheduler(clock, token_rate=3600, burst=8)
+    assert scheduler.acquire(4, order=("token",)).limit == 4
+    assert scheduler.acquire(4, order=("token",)).limit == 4
+
+    grant = scheduler.acquire(4, order=("token",), max_wait=10)
+    assert grant.endpoint == "token" and grant.limit == 4
+    assert grant.waited == pytest.approx(4.0)
+
+    with pytest.raises(BudgetExhausted):
+        scheduler.acquire(4, order=("token",), max_wait=0)
+
+
+def test_rate_limit_headers_reduce_probe_limit():
+    """Заголовки лимитов учитываются: при низком остатке измерение запускается с минимумом проб"""
+    clock = _Clock()
+    scheduler = _scheduler(clock, burst=100, min_limit=1, low_fraction=0.2)
+    scheduler.update("token", _Response(headers={
+        "X-RateLimit-Limit": "500", "X-RateLimit-Remaining": "60", "X-RateLimit-Reset": "1800", "X-Credits-Remaining": "10"
+    }))
+    grant = scheduler.acquire(4, order=("token",))
+    assert grant.limit == 1 and grant.reduced
+    assert scheduler.stats()["token"]["credits"] == 10
+
+
+def test_429_blocks_endpoint_and_switches_only_with_public_headroom():
+    """После 429 токен заблокирован на Retry-After; публичный API используется, только если у него есть запас"""
+    clock = _Clock()
+    scheduler = _scheduler(clock)
+    scheduler.update("token", _Response(429, {"Retry-After": "120"}))
+    assert scheduler.acquire(4).endpoint == "public"
+
+    scheduler.update("public", _Response(429, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "3000"}))
+    with pytest.raises(BudgetExhausted):
+        scheduler.acquire(4, max_wait=60)
+
+    clock.now += 121
+    assert scheduler.acquire(4).endpoint == "token"
+    assert scheduler.stats()["token"]["throttled"] == 1
+
+
+def test_concurrent_reports_never_overdraw():
+    """Параллельные отчеты не получают больше проб, чем есть в ведре"""
+    scheduler = GlobalpingScheduler({"token": EndpointBudget("token", 0, 20)})
+    granted = []
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            grant = scheduler.acquire(4, order=("token",))
+        except BudgetExhausted:
+            return
+        with lock:
+            granted.append(grant.limit)
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(granted) == 20
+    assert scheduler.stats()["rejected"] == 5
+
+
+def test_async_acquire_waits_without_blocking_loop():
+    """Асинхронное ожидание бюджета не блокирует цикл событий и подчиняется тем же правилам"""
+    scheduler = GlobalpingScheduler({"token": EndpointBudget("token", 36000, 2)})
+    ticks = []
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(1)
+            await asyncio.sleep(0.02)
+
+    async def scenario():
+        assert (await scheduler.acquire_async(2, order=("token",))).limit == 2
+        grant, _ = await asyncio.gather(scheduler.acquire_async(1, order=("token",), max_wait=2), ticker())
+        with pytest.raises(BudgetExhausted):
+            await scheduler.acquire_async(2, order=("token",), max_wait=0)
+        return grant
+
+    grant = asyncio.run(scenario())
+    assert grant.limit == 1 and grant.waited > 0
+    assert len(ticks) == 5
+
+
+class _RejectingSession:
+    def __init__(self):
+        self.posts = 0
+
+    def post(self, url, **kwargs):
+        self.posts += 1
+        return _Response(401)
+
+
+def test_rejected_token_falls_back_to_public_in_the_same_attempt():
+    """Токен получил 401: публичный API запрашивается сразу, а не после окончательной ошибки"""
+    clock = _Clock()
+    scheduler = _scheduler(clock)
+    session = _RejectingSession()
+    client = GlobalpingTokenClient("bad-token", http_client=type("Client", (), {"session": session})(), scheduler=scheduler)
+    fallback = TokenFallback(scheduler, use_token=True)
+    public_calls = []
+
+    def token_attempt():
+        result = client.ping("example.com", "RU", 2)
+        return (result.get("measurement"), None) if result["success"] else (result["error"], result["error"])
+
+    def public_attempt():
+        public_calls.append(fallback.order)
+        return "public measurement", None
+
+    attempts = []
+
+    def attempt_once(attempt, timeout_scale):
+        attempts.append(attempt)
+        return fallback.run(token_attempt, public_attempt)
+
+    result = RetryPolicy(sleep=clock.sleep).run("globalping.ping", attempt_once)
+    assert result == "public measurement"
+    assert attempts == [1] and session.posts == 1
+    assert public_calls == [("public",)]
+
+
+def test_token_fallback_needs_public_headroom_and_rejection():
+    """Без запаса публичного API ошибка токена возвращается как есть; сетевые ошибки ждут следующей попытки"""
+    clock = _Clock()
+    scheduler = _scheduler(clock, burst=10)
+    scheduler.acquire(10, order=("public",))
+    fallback = TokenFallback(scheduler, use_token=True, min_limit=1)
+    assert fallback.run(lambda: ("err", "HTTP 403"), lambda: ("public", None)) == ("err", "HTTP 403")
+    assert fallback.use_token
+
+    clock.sleep(60)
+    assert fallback.run(lambda: ("err", "timeout"), lambda: ("public", None)) == ("err", "timeout")
+    assert fallback.order == ("public",)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты типизированных записей измерений Globalping
+"""
+
+from globalping_models import parse_measurement, render_slack
+from prompt_builder import compact_results, summarize_measurement
+
+
+def _result(city, country, result):
+    return {"probe": {"city": city, "country": country}, "result": result}
+
+
+PING = {"results": [
+    _result("Berlin", "DE", {"status": "finished", "stats": {"min": 11.2, "avg": 12.0, "max": 13.5, "loss": 0}}),
+    _result("London", "GB", {"status": "finished", "stats": {"avg": 40.1, "loss": 25}})
+]}
+
+HTTP = {"results": [
+    _result("Paris", "FR", {"status": "finished", "statusCode": 200, "timings": {"total": 150, "dns": 10, "firstByte": 90}})
+]}
+
+TRACEROUTE = {"results": [
+    _result("Amsterdam", "NL", {"hops": [
+        {"resolvedHostname": "gw.local", "timings": [{"rtt": 1.5}]},
+        {"timings": []},
+        {"resolvedAddress": "93.184.216.34", "timings": [{"rtt": 30.2}]}
+    ]})
+]}
+
+MTR = {"results": [
+    _result("Moscow", "RU", {"hops": [
+        {"resolvedHostname": "gw.local", "stats": {"avg": 1.0, "loss": 0}},
+        {"resolvedHostname": "core.net", "stats": {"avg": 45.0, "loss": 30}},
+        {"resolvedHostname": "example.com", "stats": {"avg": 46.0, "loss": 0}}
+    ]})
+]}
+
+
+def test_probe_records_hold_numbers():
+    """Значения разбираются в числа за один проход"""
+    measurement = parse_measurement(PING, "ping", "example.com")
+    berlin, london = measurement.probes
+    assert (berlin.min, berlin.avg, berlin.max, berlin.loss) == (11.2, 12.0, 13.5, 0.0)
+    assert london.location == "London, GB" and london.loss == 25.0
+
+    http = parse_measurement(HTTP, "http", "example.com").probes[0]
+    assert http.status == 200
+    assert http.timings.total == 150.0 and http.timings.first_byte == 90.0
+
+    hops = parse_measurement(TRACEROUTE, "traceroute", "example.com").probes[0].hops
+    assert [hop.host for hop in hops] == ["gw.local", None, "93.184.216.34"]
+    assert hops[1].loss == 100.0
+
+
+def test_records_use_slots():
+    """Записи без __dict__, чтобы держать в кеше как можно меньше памяти"""
+    probe = parse_measurement(PING, "ping", "example.com").probes[0]
+    assert not hasattr(probe, "__dict__")
+
+
+def test_slack_rendering():
+    """Текст для Slack одинаков для обоих API, результат токена отмечается ✅"""
+    text = render_slack(parse_measurement(PING, "ping", "example.com"))
+    assert text.splitlines() == [
+        "🌍 **PING** для `example.com`:",
+        "📍 Berlin, DE: 12ms (потерь: 0%)",
+        "📍 London, GB: 40.1ms (потерь: 25%)"
+    ]
+    assert render_slack(parse_measurement(HTTP, "http", "example.com", source="token")).startswith("✅ 🌍 **HTTP**")
+    trace = render_slack(parse_measurement(TRACEROUTE, "traceroute", "example.com"))
+    assert "   2. * * * (timeout)" in trace
+    mtr = render_slack(parse_measurement(MTR, "mtr", "example.com"))
+    assert "   2. core.net - 45ms (30% loss)" in mtr
+    assert render_slack(parse_measurement({"results": []}, "dns", "example.com")).startswith("❌")
+
+
+def test_prompt_summary_matches_text_parsing():
+    """Сводка по записям совпадает со сводкой, разобранной из текста"""
+    for data, test_type in ((PING, "ping"), (HTTP, "http"), (MTR, "mtr")):
+        measurement = parse_measurement(data, test_type, "example.com")
+        from_text = compact_results(render_slack(measurement))["globalping"][test_type]
+        assert summarize_measurement(measurement) == from_text
+
+    measurement = parse_measurement(MTR, "mtr", "example.com")
+    summary = compact_results(render_slack(measurement), measurements={"mtr": measurement})
+    assert [hop["n"] for hop in summary["globalping"]["mtr"][0]["notable"]] == [2]
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты адаптивного опроса Globalping измерений
+"""
+
+import asyncio
+import json
+import threading
+
+from globalping_polling import poll_measurement, poll_measurement_async, poll_stats
+
+
+class _FakeResponse:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self._data = data
+        self.headers = headers or {}
+        self.content = json.dumps(data).encode() if data is not None else b""
+
+    def json(self):
+        return self._data
+
+
+class _FakeSession:
+    """Отдает заранее заданную последовательность ответов и запоминает заголовки"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.sent_headers = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.sent_headers.append(headers or {})
+        return self.responses.pop(0)
+
+
+def test_fast_test_uses_short_first_interval():
+    """DNS тест опрашивается через доли секунды, а не через секунду"""
+    sleeps = []
+    session = _FakeSession([_FakeResponse(200, {"status": "finished", "results": []})])
+    poll = poll_measurement(session, "url", "m-fast", "dns", max_wait=10, sleep=sleeps.append)
+
+    assert poll["status"] == "finished"
+    assert poll["polls"] == 1
+    assert sleeps[0] < 0.5
+
+
+def test_unchanged_results_use_etag():
+    """Повторный опрос отправляет If-None-Match, ответ 304 учитывается отдельно"""
+    session = _FakeSession([
+        _FakeResponse(200, {"status": "in-progress"}, {"ETag": '"v1"'}),
+        _FakeResponse(304),
+        _FakeResponse(200, {"status": "finished"}, {"ETag": '"v2"'}),
+    ])
+    poll = poll_measurement(session, "url", "m-etag", "ping", max_wait=10, sleep=lambda s: None)
+
+    assert poll["status"] == "finished"
+    assert poll["polls"] == 3
+    assert poll["not_modified"] == 1
+    assert session.sent_headers[1]["If-None-Match"] == '"v1"'
+    assert poll_stats.snapshot()["recent"]["m-etag"]["polls"] == 3
+
+
+def test_retry_after_extends_interval():
+    """Подсказка сервера Retry-After увеличивает следующий интервал"""
+    sleeps = []
+    session = _FakeSession([
+        _FakeResponse(429, headers={"Retry-After": "3"}),
+        _FakeResponse(200, {"status": "failed", "error": "boom"}),
+    ])
+    poll = poll_measurement(session, "url", "m-retry", "http", max_wait=10, sleep=sleeps.append)
+
+    assert poll["status"] == "failed"
+    assert sleeps[1] == 3
+
+
+def test_backoff_grows_for_slow_tests():
+    """Интервалы для mtr растут, но не превышают потолок профиля"""
+    sleeps = []
+    session = _FakeSession([_FakeResponse(200, {"status": "in-progress"})] * 6 + [_FakeResponse(200, {"status": "finished"})])
+    poll_measurement(session, "url", "m-mtr", "mtr", max_wait=60, sleep=sleeps.append)
+
+    assert sleeps == sorted(sleeps)
+    assert max(sleeps) <= 4.0
+
+
+def test_client_error_stops_polling():
+    """Ответ 4xx, кроме 429 (например, 404 для истекшего измерения), прекращает опрос сразу"""
+    session = _FakeSession([_FakeResponse(404, {"error": "not found"})] + [_FakeResponse(200, {"status": "in-progress"})] * 3)
+    poll = poll_measurement(session, "url", "m-404", "ping", max_wait=60, sleep=lambda s: None)
+    assert (poll["status"], poll["http_status"], poll["polls"]) == ("rejected", 404, 1)
+
+    async def fetch(url, headers, timeout):
+        return _FakeResponse(403)
+
+    poll = asyncio.run(poll_measurement_async(fetch, "url", "m-403", "dns", max_wait=60))
+    assert (poll["status"], poll["http_status"], poll["polls"]) == ("rejected", 403, 1)
+
+
+def test_cancel_stops_polling():
+    """Отмена (проигравший хедж) прекращает опрос без ожидания таймаута"""
+    cancel = threading.Event()
+    cancel.set()
+    session = _FakeSession([_FakeResponse(200, {"status": "in-progress"})] * 3)
+    poll = poll_measurement(session, "url", "m-cancel", "mtr", max_wait=60, cancel=cancel)
+
+    assert poll["status"] == "cancelled"
+    assert poll["polls"] == 0
+
+
+def test_async_poll_uses_etag_and_survives_network_errors():
+    """Асинхронный опрос: If-None-Match, 304 и временные ошибки сети - как в синхронном"""
+    session = _FakeSession([
+        _FakeResponse(200, {"status": "in-progress"}, {"ETag": '"v1"'}),
+        ConnectionError("reset by peer"),
+        _FakeResponse(304),
+        _FakeResponse(200, {"status": "finished"}),
+    ])
+    errors = []
+
+    async def fetch(url, headers, timeout):
+        response = session.get(url, headers=headers, timeout=timeout)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    poll = asyncio.run(poll_measurement_async(fetch, "url", "m-async", "dns", max_wait=10, on_error=lambda e, left: errors.append(e)))
+    assert poll["status"] == "finished" and poll["polls"] == 4 and poll["not_modified"] == 1
+    assert session.sent_headers[2]["If-None-Match"] == '"v1"'
+    assert len(errors) == 1
+    assert poll_stats.snapshot()["recent"]["m-async"]["status"] == "finished"
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты хеджирования медленных Globalping измерений
+"""
+
+import asyncio
+import threading
+
+from hedging import Hedger, percentile
+
+
+def _instant(result, error=None):
+    return lambda cancel: (result, error)
+
+
+def _stalled(result="token", error=None, seconds=5.0):
+    """Основной запрос, который ждет до отмены или seconds"""
+    def operation(cancel):
+        if cancel.wait(seconds):
+            return "cancelled", "cancelled"
+        return result, error
+    return operation
+
+
+def test_delay_is_percentile_of_primary_latencies():
+    """Задержка хеджа - перцентиль задержек основного запроса в заданных границах"""
+    hedger = Hedger(percentile=0.9, min_delay=0.5, max_delay=4, default_delay=2, min_samples=5)
+    assert hedger.delay("ping") == 2
+    for value in (1.0, 1.1, 1.2, 1.3, 3.0, 1.0, 1.1, 1.2, 1.3, 1.4):
+        hedger.stats.record_latency("ping", value)
+    assert hedger.delay("ping") == percentile(hedger.stats.latencies("ping"), 0.9) == 1.4
+    hedger.stats.record_latency("mtr", 30)
+    for _ in range(5):
+        hedger.stats.record_latency("mtr", 30)
+    assert hedger.delay("mtr") == 4
+
+
+def test_fast_primary_is_not_hedged():
+    """Основной запрос, уложившийся в задержку, не дублируется"""
+    hedger = Hedger(default_delay=1)
+    secondary_calls = []
+
+    def secondary(cancel):
+        secondary_calls.append(1)
+        return "public", None
+
+    assert hedger.run("dns", _instant("token"), secondary) == ("token", None, "primary")
+    assert secondary_calls == []
+    assert hedger.stats.snapshot()["dns"]["primary_fast"] == 1
+    assert len(hedger.stats.latencies("dns")) == 1
+
+
+def test_stalled_primary_is_hedged_and_cancelled():
+    """Задержавшийся основной запрос дублируется; победил запасной - основной отменяется"""
+    hedger = Hedger(default_delay=0.05)
+    cancelled = threading.Event()
+
+    def primary(cancel):
+        if cancel.wait(5):
+            cancelled.set()
+            return "cancelled", "cancelled"
+        return "token", None
+
+    result, error, winner = hedger.run("mtr", primary, _instant("public"))
+    assert (result, error, winner) == ("public", None, "secondary")
+    assert cancelled.wait(1)
+    counts = hedger.stats.snapshot()["mtr"]
+    assert counts["fired"] == 1 and counts["hedge_wins"] == 1
+    # Проигравший основной запрос учитывается нижней границей задержки, чтобы перцентиль не смещался вниз
+    assert len(hedger.stats.latencies("mtr")) == 1 and hedger.stats.latencies("mtr")[0] >= 0.05
+
+
+def test_primary_runs_in_caller_thread_despite_busy_pool():
+    """Основной запрос не ждет в пуле: задержка хеджа отсчитывается от его фактического старта"""
+    hedger = Hedger(default_delay=0.2, max_workers=1)
+    release = threading.Event()
+    hedger._executor.submit(release.wait, 5)
+    threads = []
+
+    def primary(cancel):
+        threads.append(threading.current_thread())
+        return "token", None
+
+    try:
+        assert hedger.run("ping", primary, _instant("public")) == ("token", None, "primary")
+    finally:
+        release.set()
+    assert threads == [threading.current_thread()]
+    assert hedger.stats.snapshot()["ping"]["primary_fast"] == 1
+
+
+def test_no_hedge_without_headroom_and_primary_error_on_double_failure():
+    """Без запаса у запасного API хедж не запускается; если оба не успели - возвращается ошибка основного"""
+    hedger = Hedger(default_delay=0.05)
+    result = hedger.run("http", _stalled(seconds=0.1), _instant("public"), can_hedge=lambda: False)
+    assert result == ("token", None, "primary")
+    assert hedger.stats.snapshot()["http"]["skipped"] == 1
+
+    result = hedger.run("ping", _stalled("token failed", "HTTP 500", seconds=0.1), _instant("public failed", "HTTP 503"))
+    assert result == ("token failed", "HTTP 500", None)
+    assert hedger.stats.snapshot()["ping"]["failed"] == 1
+
+
+def test_async_stalled_primary_is_hedged_and_cancelled():
+    """Асинхронный вариант: задержавшийся основной запрос дублируется, проигравшая задача отменяется"""
+    hedger = Hedger(default_delay=0.05)
+    cancelled = []
+
+    async def primary():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append("primary")
+            raise
+        return "token", None
+
+    async def secondary():
+        return "public", None
+
+    async def scenario():
+        outcome = await hedger.run_async("mtr", primary, secondary)
+        await asyncio.sleep(0)
+        return outcome
+
+    assert asyncio.run(scenario()) == ("public", None, "secondary")
+    assert cancelled == ["primary"]
+    assert hedger.stats.snapshot()["mtr"]["hedge_wins"] == 1
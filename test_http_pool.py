@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты общего HTTP клиента с пулом соединений
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from http_pool import SharedHTTPClient
+
+
+class _OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_connections_are_reused():
+    """Повторные запросы к одному хосту идут через одно keep-alive соединение"""
+    server = _start_server()
+    client = SharedHTTPClient(pool_connections=2, pool_maxsize=2)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/"
+        for _ in range(3):
+            assert client.get(url, timeout=5).text == "ok"
+
+        stats = client.stats()
+        assert stats["requests"] == 3
+        assert stats["connections_opened"] == 1
+        assert stats["connections_reused"] == 2
+    finally:
+        client.close()
+        server.shutdown()
+
+
+def test_client_is_thread_safe():
+    """Запросы из нескольких потоков не превышают размер пула"""
+    server = _start_server()
+    client = SharedHTTPClient(pool_connections=1, pool_maxsize=4)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/"
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(5):
+                    client.get(url, timeout=5)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not errors
+        stats = client.stats()
+        assert stats["requests"] == 20
+        assert stats["connections_opened"] <= 4
+    finally:
+        client.close()
+        server.shutdown()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты очереди диагностических задач
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from job_queue import AsyncDiagnosticsQueue, DiagnosticsQueue, QueueFull
+
+
+def _wait_until(condition, timeout=2.0):
+    started = time.monotonic()
+    while not condition():
+        if time.monotonic() - started > timeout:
+            raise AssertionError("Условие не выполнено")
+        time.sleep(0.01)
+
+
+def test_submit_returns_immediately_and_reports_position():
+    """Задача принимается сразу, при занятых воркерах возвращается позиция"""
+    release = threading.Event()
+    queue = DiagnosticsQueue(workers=1, max_depth=5)
+    try:
+        assert queue.submit("C1", release.wait) == 0
+        _wait_until(lambda: queue.stats()["active"] == 1)
+        assert queue.submit("C1", lambda: None) == 1
+        assert queue.submit("C2", lambda: None) == 2
+    finally:
+        release.set()
+        queue.shutdown()
+
+
+def test_backpressure_when_full():
+    """При достижении максимальной глубины новые задачи отклоняются"""
+    release = threading.Event()
+    queue = DiagnosticsQueue(workers=1, max_depth=1)
+    try:
+        queue.submit("C1", release.wait)
+        _wait_until(lambda: queue.stats()["active"] == 1)
+        queue.submit("C1", lambda: None)
+        with pytest.raises(QueueFull):
+            queue.submit("C1", lambda: None)
+        assert queue.stats()["rejected"] == 1
+    finally:
+        release.set()
+        queue.shutdown()
+
+
+def test_channels_are_served_round_robin():
+    """Всплеск в одном канале не задерживает задачи других каналов"""
+    release = threading.Event()
+    order = []
+    queue = DiagnosticsQueue(workers=1, max_depth=10)
+    try:
+        queue.submit("busy", release.wait)
+        _wait_until(lambda: queue.stats()["active"] == 1)
+        for index in range(3):
+            queue.submit("busy", lambda index=index: order.append(f"busy-{index}"))
+        queue.submit("quiet", lambda: order.append("quiet"))
+        release.set()
+        _wait_until(lambda: len(order) == 4)
+        assert order.index("quiet") == 1
+    finally:
+        queue.shutdown()
+
+
+def test_failed_jobs_are_counted():
+    """Исключение в задаче не останавливает воркер"""
+    queue = DiagnosticsQueue(workers=1, max_depth=5)
+    try:
+        queue.submit("C1", lambda: 1 / 0)
+        queue.submit("C1", lambda: None)
+        _wait_until(lambda: queue.stats()["completed"] == 1)
+        assert queue.stats()["failed"] == 1
+    finally:
+        queue.shutdown()
+
+
+def test_drain_waits_for_running_and_queued_jobs():
+    """drain возвращает True после завершения всех задач и False по таймауту"""
+    release = threading.Event()
+    done = []
+    queue = DiagnosticsQueue(workers=1, max_depth=5)
+    try:
+        queue.submit("C1", release.wait)
+        queue.submit("C1", lambda: done.append(1))
+        assert queue.drain(0.05) is False
+        release.set()
+        assert queue.drain(2.0) is True
+        assert done == [1]
+    finally:
+        queue.shutdown()
+
+
+def test_async_queue_limits_reports_and_drains():
+    """Асинхронная очередь: лимит одновременных отчетов, круг по каналам, отказ при переполнении и drain"""
+    order = []
+
+    def job(name, seconds=0.05):
+        async def run():
+            order.append(name)
+            await asyncio.sleep(seconds)
+        return run
+
+    async def scenario():
+        queue = AsyncDiagnosticsQueue(workers=2, max_depth=4)
+        queue.start()
+        try:
+            positions = [queue.submit("C1", job(name)) for name in ("a1", "a2", "a3")]
+            positions.append(queue.submit("C2", job("b1")))
+            with pytest.raises(QueueFull):
+                queue.submit("C2", job("b2"))
+            await asyncio.sleep(0)
+            assert queue.stats()["active"] == 2
+            assert await queue.drain(2.0) is True
+            return positions, queue.stats()
+        finally:
+            queue.shutdown()
+
+    positions, stats = asyncio.run(scenario())
+    assert positions == [0, 0, 1, 2]
+    assert order[:3] == ["a1", "b1", "a2"]
+    assert stats["completed"] == 4 and stats["rejected"] == 1
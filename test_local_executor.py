@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты ограничения одновременных локальных команд
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from local_executor import AsyncCommandLimiter, CommandLimiter, CommandSlotTimeout, run_process_async
+
+
+def test_limit_per_command_kind():
+    """Одновременно работает не больше процессов вида, чем разрешено лимитом"""
+    limiter = CommandLimiter({"mtr": 2, "default": 4})
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def worker():
+        with limiter.slot("mtr"):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) == 2
+
+
+def test_slot_respects_deadline():
+    """Если слот не освободился до дедлайна, вызывается CommandSlotTimeout"""
+    limiter = CommandLimiter({"ping": 1, "default": 1})
+    with limiter.slot("ping"):
+        with pytest.raises(CommandSlotTimeout):
+            with limiter.slot("ping", deadline=time.monotonic() + 0.05):
+                pass
+
+
+def test_unknown_commands_share_default_limit():
+    """Команды без собственного лимита используют общий лимит default"""
+    limiter = CommandLimiter({"default": 1})
+    with limiter.slot("whois"):
+        assert limiter.stats()["default"]["active"] == 1
+    assert limiter.stats()["default"]["active"] == 0
+
+
+def test_async_limit_and_process_timeout():
+    """Асинхронный лимитер держит тот же лимит, а процесс по таймауту убивается"""
+    limiter = AsyncCommandLimiter({"sleep": 2, "default": 4})
+    peak = []
+
+    async def worker():
+        async with limiter.slot("sleep"):
+            peak.append(limiter.stats()["sleep"]["active"])
+            await asyncio.sleep(0.05)
+
+    async def scenario():
+        await asyncio.gather(*(worker() for _ in range(6)))
+        async with limiter.slot("sleep"), limiter.slot("sleep"):
+            with pytest.raises(CommandSlotTimeout):
+                async with limiter.slot("sleep", deadline=time.monotonic() + 0.05):
+                    pass
+        return (
+            await run_process_async("echo hello", timeout=5),
+            await run_process_async("sleep 5", timeout=0.1),
+        )
+
+    started = time.monotonic()
+    finished, timed_out = asyncio.run(scenario())
+    assert max(peak) == 2
+    assert finished == (0, "hello\n", "")
+    assert timed_out is None and time.monotonic() - started < 2
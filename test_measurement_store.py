@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты истории измерений и изменений относительно исправного запуска
+"""
+
+import time
+
+from measurement_store import MeasurementStore, diff_facts, is_healthy, render_delta, summary_facts
+
+
+def _summary(status="200", avg=12.0, hops=("core.example.net",), answers=("1.1.1.1",), city="Moscow"):
+    return {
+        "globalping": {
+            "ping": [{"location": f"{city}, RU", "avg": avg, "loss": 0.0}],
+            "http": [{"location": f"{city}, RU", "status": status, "total": 100.0}],
+            "mtr": [{
+                "location": f"{city}, RU", "hops": 5, "timeouts": 0,
+                "final": {"n": 5, "host": "example.com", "rtt": avg, "loss": 0.0},
+                "notable": [{"n": index + 2, "host": host, "rtt": 40.0, "loss": 0.0} for index, host in enumerate(hops)]
+            }],
+        },
+        "local": [{"command": "dig example.com +short", "kind": "dns", "answers": list(answers)}],
+        "errors": [],
+    }
+
+
+def test_health_of_runs():
+    """Ошибки, HTTP 5xx и большие потери делают запуск неисправным"""
+    assert is_healthy(_summary())
+    assert not is_healthy(_summary(status="502"))
+    assert not is_healthy({**_summary(), "errors": ["❌ timeout"]})
+    lossy = _summary()
+    lossy["globalping"]["ping"][0]["loss"] = 40.0
+    assert not is_healthy(lossy)
+
+
+def test_diff_reports_only_material_changes():
+    """Джиттер и другой город той же страны не дают изменений; статус, хопы, ответы и сдвиг RTT - дают"""
+    base = summary_facts(_summary())
+    assert diff_facts(base, summary_facts(_summary(avg=14.0, city="Kazan"))) == []
+
+    changes = diff_facts(base, summary_facts(_summary(status="502", avg=90.0, hops=("new.example.net",), answers=("2.2.2.2",))))
+    text = "\n".join(changes)
+    assert "[globalping http RU] status: 200 → 502" in text
+    assert "[globalping ping RU] rtt: 12 → 90ms" in text
+    assert "новые хопы: new.example.net" in text and "пропали хопы: core.example.net" in text
+    assert "[local dns] новые ответы: 2.2.2.2" in text
+
+
+def test_delta_against_last_healthy_run(tmp_path):
+    """Базой служит последний исправный запуск, а не последний вообще"""
+    store = MeasurementStore(str(tmp_path / "history.sqlite3"))
+    assert store.delta("example.com", _summary()).baseline_age is None
+
+    store.record("example.com", _summary(), created_at=time.time() - 7200)
+    store.record("example.com", _summary(status="502"))
+    delta = store.delta("example.com", _summary(status="503"))
+    assert delta.baseline_age >= 7200
+    assert delta.changes == ["[globalping http RU] status: 200 → 503"]
+    assert render_delta(delta).startswith("📈 *Изменения* относительно последнего исправного состояния (2ч назад)")
+    assert store.stats()["runs"] == 2 and store.stats()["healthy"] == 1
+
+    history = store.history("example.com", "globalping:http")
+    assert [data[0]["status"] for _, data in history] == ["502", "200"]
+
+
+def test_retention_and_compaction(tmp_path):
+    """Старые запуски и запуски сверх лимита на цель удаляются вместе с результатами"""
+    path = str(tmp_path / "history.sqlite3")
+    store = MeasurementStore(path, retention=3600, max_runs=2, compact_every=1000)
+    store.record("example.com", _summary(), created_at=time.time() - 7200)
+    for _ in range(3):
+        store.record("example.com", _summary())
+    store.record("example.org", _summary())
+    assert store.compact() == 2
+    assert store.stats()["runs"] == 3
+    assert len(store.history("example.com", "globalping:ping")) == 2
+    store.close()
+
+    reopened = MeasurementStore(path)
+    assert reopened.baseline("example.org") is not None
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты трассировки этапов и экспорта метрик
+"""
+
+import json
+import urllib.request
+
+from metrics import Histogram, MetricsRegistry, Span, current_report, report_trace, span, start_metrics_server
+from parallel_tasks import run_ordered
+
+
+def test_histogram_buckets_and_quantiles():
+    """Наблюдения раскладываются по кумулятивным корзинам, квантили оцениваются по ним"""
+    histogram = Histogram("latency_seconds", "test", buckets=(0.1, 1, 10))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, stage="ping")
+
+    text = "\n".join(histogram.render())
+    assert 'latency_seconds_bucket{stage="ping",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{stage="ping",le="1"} 3' in text
+    assert 'latency_seconds_bucket{stage="ping",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{stage="ping"} 4' in text
+    assert 0.1 < histogram.quantile(0.5, stage="ping") <= 1
+    assert histogram.quantile(0.99, stage="ping") > 1
+
+
+def test_report_collects_spans_from_worker_threads(tmp_path):
+    """Спаны из задач run_ordered и завершенные в другом потоке попадают в один отчет"""
+    registry = MetricsRegistry()
+    log_path = tmp_path / "reports.jsonl"
+
+    def task(name):
+        with span(f"globalping.{name}", registry=registry) as current:
+            current.set(bytes=100)
+        return name
+
+    with report_trace("example.com", log_path=str(log_path), registry=registry, channel="C1"):
+        late = Span("screenshot")
+        run_ordered([(name, lambda name=name: task(name)) for name in ("ping", "dns")], max_workers=2)
+        with span("local.mtr.attempt", attempt=2, registry=registry) as attempt:
+            attempt.set(outcome="timeout")
+        late.finish("ok", registry=registry)
+
+    record = json.loads(log_path.read_text(encoding="utf-8").strip())
+    assert record["target"] == "example.com" and record["channel"] == "C1"
+    stages = {item["stage"]: item for item in record["spans"]}
+    assert set(stages) == {"globalping.ping", "globalping.dns", "local.mtr.attempt", "screenshot"}
+    assert stages["local.mtr.attempt"]["attempt"] == 2
+    assert stages["local.mtr.attempt"]["outcome"] == "timeout"
+    assert registry.stage_bytes.value(stage="globalping.ping") == 100
+    assert registry.reports.value(outcome="ok") == 1
+
+
+def test_span_marks_exceptions_as_errors():
+    """Исключение внутри спана учитывается как error"""
+    registry = MetricsRegistry()
+    try:
+        with span("ai", registry=registry):
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    assert 'stage="ai"' in registry.render() and 'outcome="error"' in registry.render()
+
+
+def test_handled_report_error_is_counted_as_error(tmp_path):
+    """Ошибка, перехваченная внутри отчета и помеченная через fail, учитывается в исходе отчета"""
+    registry = MetricsRegistry()
+    log_path = tmp_path / "reports.jsonl"
+    with report_trace("example.com", log_path=str(log_path), registry=registry):
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            current_report().fail()
+    assert registry.reports.value(outcome="error") == 1 and registry.reports.value(outcome="ok") == 0
+    assert json.loads(log_path.read_text(encoding="utf-8"))["outcome"] == "error"
+def test_metrics_endpoint_serves_histograms_and_collectors():
+    """/metrics отдает гистограммы этапов и числа из зарегистрированных stats()"""
+    registry = MetricsRegistry()
+    registry.add_collector("result_cache", lambda: {"hits": 3, "name": "ignored", "nested": {"size": 2}})
+    with span("globalping", registry=registry):
+        pass
+    server = start_metrics_server("127.0.0.1", 0, registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        body = urllib.request.urlopen(url, timeout=5).read().decode("utf-8")
+    finally:
+        server.shutdown()
+    assert "slackbot_stage_duration_seconds_bucket{outcome=\"ok\",stage=\"globalping\"" in body
+    assert "slackbot_result_cache_hits 3" in body
+    assert "slackbot_result_cache_nested_size 2" in body
+    assert "ignored" not in body
+
+
+def test_collector_labels_and_attempt_counter():
+    """Словари с id в ключах отдаются одной метрикой с меткой; попытки считаются только по спанам *.attempt"""
+    registry = MetricsRegistry()
+    registry.add_collector("queue", lambda: {"depth": 2, "channels": {"C123": 1, "C456": 1}}, labels={"channels": "channel"})
+    with span("globalping.ping", registry=registry):
+        with span("globalping.ping.attempt", registry=registry):
+            pass
+    body = registry.render()
+    assert body.count("# TYPE slackbot_queue_channels gauge") == 1
+    assert 'slackbot_queue_channels{channel="C123"} 1' in body
+    assert "slackbot_queue_channels_c123" not in body
+    assert 'slackbot_stage_attempts_total{stage="globalping.ping.attempt"} 1' in body
+    assert 'slackbot_stage_attempts_total{stage="globalping.ping"}' not in body
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты встроенных сетевых проб на локальных DNS и HTTP серверах
+"""
+
+import socket
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from native_probes import (
+    ProbeError, build_dns_query, dns_query, http_head, native_commands, parse_dns_response,
+    run_native_command, tcp_connect
+)
+from prompt_builder import compact_results
+
+
+def _answer(qtype, rdata):
+    # Имя сжато ссылкой на вопрос (смещение 12)
+    return b"\xc0\x0c" + struct.pack("!HHIH", qtype, 1, 300, len(rdata)) + rdata
+
+
+def _encode(name):
+    return b"".join(bytes([len(label)]) + label.encode() for label in name.split(".")) + b"\x00"
+
+
+class _StubDNSServer:
+    """UDP сервер, отвечающий A записью для example.test и SOA для зоны"""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                query, address = self.sock.recvfrom(512)
+            except OSError:
+                return
+            query_id = struct.unpack("!H", query[:2])[0]
+            question = query[12:]
+            qtype = struct.unpack("!H", question[-4:-2])[0]
+            name = question[:-4]
+            if name == _encode("missing.test"):
+                header = struct.pack("!HHHHHH", query_id, 0x8183, 1, 0, 0, 0)
+                self.sock.sendto(header + question, address)
+                continue
+            if qtype == 1:
+                answers = [_answer(1, socket.inet_aton("192.0.2.10")), _answer(1, socket.inet_aton("192.0.2.11"))]
+            else:
+                soa = _encode("ns1.example.test") + _encode("admin.example.test") + struct.pack("!IIIII", 2024010101, 7200, 3600, 1209600, 300)
+                answers = [_answer(6, soa)]
+            header = struct.pack("!HHHHHH", query_id, 0x8180, 1, len(answers), 0, 0)
+            self.sock.sendto(header + question + b"".join(answers), address)
+
+    def close(self):
+        self.sock.close()
+
+
+class _HeadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_response(301)
+        self.send_header("Location", "https://example.test/")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def dns_server():
+    server = _StubDNSServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _HeadHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def test_dns_query_a_records(dns_server):
+    """A записи разбираются с учетом сжатия имен и замером времени"""
+    result = dns_query("example.test", "A", server="127.0.0.1", port=dns_server.port)
+    assert result["rcode"] == "NOERROR"
+    assert [answer["value"] for answer in result["answers"]] == ["192.0.2.10", "192.0.2.11"]
+    assert result["time_ms"] >= 0
+
+
+def test_dns_query_soa_record(dns_server):
+    """SOA запись возвращается в формате dig +short"""
+    result = dns_query("example.test", "SOA", server="127.0.0.1", port=dns_server.port)
+    assert result["answers"][0]["value"] == "ns1.example.test. admin.example.test. 2024010101 7200 3600 1209600 300"
+
+
+def test_dns_nxdomain(dns_server):
+    """Код ответа NXDOMAIN сообщается как есть"""
+    assert dns_query("missing.test", "A", server="127.0.0.1", port=dns_server.port)["rcode"] == "NXDOMAIN"
+
+
+def test_dns_response_id_is_checked():
+    """Ответ с чужим ID отвергается"""
+    query = build_dns_query("example.test", "A", 1)
+    response = struct.pack("!HHHHHH", 2, 0x8180, 1, 0, 0, 0) + query[12:]
+    with pytest.raises(ProbeError):
+        parse_dns_response(response, 1)
+
+
+def test_malformed_dns_response_is_probe_error():
+    """Усеченный ответ или ошибка сокета дают текст ошибки пробы, а не исключение разбора"""
+    query = build_dns_query("example.test", "SOA", 7)
+    soa = _encode("ns1.example.test") + _encode("admin.example.test") + struct.pack("!IIIII", 1, 2, 3, 4, 5)
+    response = struct.pack("!HHHHHH", 7, 0x8180, 1, 1, 0, 0) + query[12:] + _answer(6, soa)
+    for length in range(12, len(response)):
+        try:
+            parse_dns_response(response[:length], 7)
+        except ProbeError:
+            pass
+    assert run_native_command("native-dns example.test A", dns_server="999.0.0.1").startswith("❌ DNS сервер 999.0.0.1")
+
+
+def test_http_head_timings(http_server):
+    """HEAD проба возвращает статус, заголовки и раздельные тайминги"""
+    port = http_server.server_address[1]
+    result = http_head(f"http://127.0.0.1:{port}/path")
+    assert result["status"] == 301
+    assert result["headers"]["location"] == "https://example.test/"
+    for key in ("dns_ms", "connect_ms", "ttfb_ms", "total_ms"):
+        assert result[key] >= 0
+    assert "tls_ms" not in result
+
+
+def test_tcp_connect(http_server):
+    """TCP проба замеряет время соединения"""
+    result = tcp_connect("127.0.0.1", http_server.server_address[1])
+    assert result["ip"] == "127.0.0.1"
+    assert result["connect_ms"] >= 0
+
+
+def test_tcp_connect_refused():
+    """Закрытый порт дает понятную ошибку пробы"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    with pytest.raises(ProbeError):
+        tcp_connect("127.0.0.1", port, timeout=1)
+
+
+def test_native_command_output_feeds_prompt_builder(dns_server, http_server):
+    """Вывод встроенных проб разбирается тем же сжатием, что и вывод dig/curl"""
+    dns_output = run_native_command("native-dns example.test A", dns_server="127.0.0.1", dns_port=dns_server.port)
+    soa_output = run_native_command("native-dns www.example.test SOA", dns_server="127.0.0.1", dns_port=dns_server.port)
+    missing_output = run_native_command("native-dns missing.test A", dns_server="127.0.0.1", dns_port=dns_server.port)
+    assert soa_output.startswith("ns1.example.test.")
+    assert missing_output.startswith("❌ DNS A missing.test: NXDOMAIN")
+
+    port = http_server.server_address[1]
+    http_output = run_native_command(f"native-http http://127.0.0.1:{port}/")
+    tcp_output = run_native_command(f"native-tcp 127.0.0.1 {port}")
+    results = (
+        f"💻 `native-http http://127.0.0.1:{port}/`:\n```{http_output}```\n"
+        f"💻 `native-dns example.test A`:\n```{dns_output}```\n"
+        f"💻 `native-tcp 127.0.0.1 {port}`:\n```{tcp_output}```"
+    )
+    local = compact_results(results)["local"]
+    assert local[0]["statuses"] == ["HTTP/1.1 301"]
+    assert "ttfb=" in local[0]["timings"]
+    assert local[1]["answers"] == ["192.0.2.10", "192.0.2.11"]
+    assert local[2]["kind"] == "tcp" and local[2]["connected"] == f"127.0.0.1:{port}"
+    assert "connect=" in local[2]["timings"]
+
+
+def test_native_commands_for_ip_skip_dns():
+    """Для IP адреса DNS пробы не нужны"""
+    assert native_commands("192.0.2.1", "192.0.2.1") == ["native-tcp 192.0.2.1 443", "native-http 192.0.2.1"]
+    assert native_commands("https://example.test", "example.test") == [
+        "native-dns example.test SOA", "native-dns example.test A", "native-tcp example.test 443", "native-http https://example.test"
+    ]
+
+
+def test_native_tcp_port_follows_target_scheme():
+    """TCP проба идет на порт из цели: явный, 80 для http и 443 по умолчанию"""
+    assert native_commands("http://example.test/path", "example.test")[2] == "native-tcp example.test 80"
+    assert native_commands("example.test:8443", "example.test")[2] == "native-tcp example.test 8443"
+    assert native_commands("example.test", "example.test")[2] == "native-tcp example.test 443"
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты параллельного выполнения диагностических задач
+"""
+
+import asyncio
+import time
+
+from parallel_tasks import run_ordered, run_ordered_async
+
+
+def test_results_keep_original_order():
+    """Результаты возвращаются в порядке задач, а не в порядке завершения"""
+    tasks = [
+        ("slow", lambda: time.sleep(0.2) or "slow"),
+        ("fast", lambda: "fast"),
+        ("medium", lambda: time.sleep(0.1) or "medium"),
+    ]
+    assert run_ordered(tasks, max_workers=3) == ["slow", "fast", "medium"]
+
+
+def test_stage_time_is_set_by_slowest_task():
+    """Время этапа определяется самой медленной задачей, а не суммой"""
+    tasks = [(str(i), lambda: time.sleep(0.2) or "ok") for i in range(5)]
+    started = time.monotonic()
+    run_ordered(tasks, max_workers=5)
+    assert time.monotonic() - started < 0.6
+
+
+def test_deadline_marks_unfinished_tasks():
+    """Задачи, не уложившиеся в общий лимит, получают результат on_timeout"""
+    tasks = [("fast", lambda: "ok"), ("stuck", lambda: time.sleep(1) or "late")]
+    results = run_ordered(tasks, max_workers=2, deadline=0.2, on_timeout=lambda name: f"timeout {name}")
+    assert results == ["ok", "timeout stuck"]
+
+
+def test_errors_are_reported_per_task():
+    """Исключение в одной задаче не ломает остальные"""
+    def broken():
+        raise RuntimeError("boom")
+
+    results = run_ordered(
+        [("broken", broken), ("ok", lambda: "ok")],
+        max_workers=2,
+        on_error=lambda name, e: f"{name}: {e}",
+    )
+    assert results == ["broken: boom", "ok"]
+
+
+def test_async_tasks_keep_order_and_cancel_on_deadline():
+    """Асинхронный вариант: порядок задач, ошибки по задаче и отмена по общему лимиту"""
+    cancelled = []
+
+    async def value(result, delay=0.0):
+        await asyncio.sleep(delay)
+        return result
+
+    async def stuck():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append("stuck")
+            raise
+
+    async def broken():
+        raise RuntimeError("boom")
+
+    tasks = [
+        ("slow", lambda: value("slow", 0.1)),
+        ("fast", lambda: value("fast")),
+        ("stuck", stuck),
+        ("broken", broken),
+    ]
+    results = asyncio.run(run_ordered_async(
+        tasks,
+        deadline=0.3,
+        on_timeout=lambda name: f"timeout {name}",
+        on_error=lambda name, e: f"{name}: {e}",
+    ))
+    assert results == ["slow", "fast", "timeout stuck", "broken: boom"]
+    assert cancelled == ["stuck"]
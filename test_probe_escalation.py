@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты адаптивного подбора проб Globalping и учета кредитов
+"""
+
+from globalping_models import HttpTimings, Measurement, Probe, parse_measurement
+from metrics import ReportTrace
+from probe_escalation import AdaptiveRun, CreditLedger, EscalationPolicy, EscalationStats, ProbeRequest, probe_magic
+
+
+def _ping(*probes):
+    return Measurement("ping", "example.com", [Probe(city, country, avg=avg, loss=loss, asn=asn) for city, country, avg, loss, asn in probes])
+
+
+def _healthy():
+    return {
+        "ping": _ping(("Moscow", "RU", 10.0, 0.0, 1000), ("Berlin", "DE", 40.0, 0.0, 2000)),
+        "http": Measurement("http", "example.com", [
+            Probe("Moscow", "RU", status=200, timings=HttpTimings(total=120.0)),
+            Probe("Berlin", "DE", status=301, timings=HttpTimings(total=150.0))
+        ]),
+        "dns": Measurement("dns", "example.com", [
+            Probe("Moscow", "RU", answers=("1.1.1.1",)),
+            Probe("Berlin", "DE", answers=("1.1.1.1", "1.0.0.1"))
+        ])
+    }
+
+
+def test_healthy_first_pass_needs_nothing_more():
+    """Без потерь, ошибок и расхождений нет ни расширенных повторов, ни трассировок; редирект 3xx - норма"""
+    policy = EscalationPolicy()
+    problems = policy.find_problems(["ping", "http", "dns"], _healthy())
+    assert problems == []
+    assert policy.retests(problems) == []
+    assert policy.path_request(problems) is None
+
+
+def test_problems_escalate_and_pin_path_locations():
+    """Потери, 5xx, расхождение DNS и выброс задержки дают повторы и трассировки только из проблемных проб"""
+    measurements = _healthy()
+    measurements["ping"] = _ping(("Moscow", "RU", 10.0, 0.0, 1000), ("Berlin", "DE", 40.0, 33.3, 2000), ("Tokyo", "JP", 400.0, 0.0, None))
+    measurements["http"].probes[0].status = 502
+    measurements["http"].probes[1].status = "finished"
+    measurements["dns"].probes.append(Probe("Paris", "FR", answers=("9.9.9.9",)))
+
+    policy = EscalationPolicy({"max_path_locations": 3})
+    problems = policy.find_problems(["ping", "http", "dns"], measurements)
+    reasons = {(problem.test_type, problem.probe.city): problem.reason for problem in problems}
+    assert reasons[("ping", "Berlin")] == "потери 33.3%"
+    assert reasons[("ping", "Tokyo")].startswith("задержка 400ms")
+    assert reasons[("http", "Moscow")] == "HTTP 502"
+    assert reasons[("http", "Berlin")] == "нет HTTP ответа"
+    assert reasons[("dns", "Paris")].startswith("ответы DNS расходятся")
+    assert policy.retests(problems) == ["ping", "http", "dns"]
+
+    path = policy.path_request(problems)
+    assert path == ProbeRequest(("Berlin+AS2000", "Tokyo+JP", "Moscow+RU"), 3, "path")
+
+
+def test_failed_test_traces_from_initial_locations_and_thresholds_are_configurable():
+    """Тест без результатов дает трассировки из первого набора; пороги и проверка DNS настраиваются"""
+    policy = EscalationPolicy({"initial_locations": ("RU",), "initial_limit": 1, "loss_threshold": 50, "dns_mismatch": False})
+    measurements = _healthy()
+    del measurements["http"]
+    measurements["ping"] = _ping(("Moscow", "RU", 10.0, 33.3, None), ("Berlin", "DE", 12.0, 0.0, None))
+    measurements["dns"].probes[1].answers = ("9.9.9.9",)
+
+    problems = policy.find_problems(["ping", "http", "dns"], measurements)
+    assert [(problem.test_type, problem.probe, problem.reason) for problem in problems] == [("http", None, "тест не выполнен")]
+    assert policy.path_request(problems) == ProbeRequest(("RU",), 1, "path")
+
+
+def test_probe_request_retries_and_magic():
+    """Повторы - из тех же локаций с половиной проб; asn разбирается из ответа API"""
+    request = ProbeRequest(("RU", "EU"), 5, "escalation")
+    assert request.for_attempt(1) is request
+    assert request.for_attempt(2) == ProbeRequest(("RU", "EU"), 2, "escalation")
+    assert ProbeRequest(("Moscow+RU",), 1, "path").for_attempt(3).limit == 1
+
+    measurement = parse_measurement({"results": [{"probe": {"city": "Moscow", "country": "RU", "asn": 12389}, "result": {}}]}, "ping", "example.com")
+    assert probe_magic(measurement.probes[0]) == "Moscow+AS12389"
+    assert probe_magic(Probe("Unknown", "RU")) == "RU"
+
+
+def test_credit_ledger_records_report_and_totals():
+    """Кредиты считаются по этапам и попадают в счетчики отчета и общую статистику"""
+    stats = EscalationStats()
+    report = ReportTrace("example.com")
+    ledger = CreditLedger(stats, report)
+    ledger.add("initial", 2)
+    ledger.add("initial", 2)
+    ledger.add("path", 1)
+    assert ledger.total == 5
+    assert ledger.render() == "💳 Кредиты Globalping: 5 (первый проход 4, трассировки 1)"
+    assert report.to_dict("ok")["counters"] == {"globalping_credits": 5, "globalping_credits.initial": 4, "globalping_credits.path": 1}
+    assert stats.snapshot()["credits"] == {"initial": 4, "path": 1}
+
+    stats.record_run(escalated=True, path=False)
+    assert stats.snapshot()["escalated"] == 1 and stats.snapshot()["path_skipped"] == 1
+
+
+def test_adaptive_run_restores_failed_retest_without_double_counting():
+    """Неудачный расширенный повтор оставляет первый проход, его проблемы не учитываются дважды"""
+    measurements = _healthy()
+    measurements["ping"] = _ping(("Moscow", "RU", 10.0, 0.0, 1000), ("Berlin", "DE", 40.0, 33.3, 2000))
+    reported = []
+    stats = EscalationStats()
+    run = AdaptiveRun(EscalationPolicy(), "example.com", ["ping", "http", "dns", "traceroute"], measurements,
+                      lambda test_type, text, skipped=False: reported.append((test_type, text, skipped)), stats)
+
+    stage = run.first_stage()
+    assert stage.test_types == ["ping", "http", "dns"] and stage.request.stage == "initial"
+    stage = run.next_stage(["ping-1", "http-1", "dns-1"])
+    assert stage.test_types == ["ping"] and stage.request.stage == "escalation"
+    assert "ping" not in measurements
+
+    # Повтор не дал измерения: в доску он не попадает, измерение первого прохода возвращается
+    stage.on_result("ping", "❌ ping-2")
+    stage = run.next_stage(["❌ ping-2"])
+    assert reported == []
+    assert measurements["ping"].probes[1].loss == 33.3
+    assert len(run.problems) == 1
+    assert stage.test_types == ["traceroute"] and stage.request == ProbeRequest(("Berlin+AS2000",), 1, "path")
+
+    assert run.next_stage(["trace"]) is None
+    assert run.ordered_results() == ["ping-1", "http-1", "dns-1", "trace"]
+    assert stats.snapshot()["escalated"] == 1 and stats.snapshot()["path_runs"] == 1
+
+
+def test_adaptive_run_reports_skipped_path_tests():
+    """Без проблем трассировки не запускаются и передаются в on_result с отметкой skipped"""
+    reported = []
+    stats = EscalationStats()
+    run = AdaptiveRun(EscalationPolicy(), "example.com", ["ping", "traceroute", "mtr"], _healthy(),
+                      lambda test_type, text, skipped=False: reported.append((test_type, skipped)), stats)
+    run.first_stage()
+    assert run.next_stage(["ping-1"]) is None
+    assert reported == [("traceroute", True), ("mtr", True)]
+    assert run.ordered_results()[1].startswith("⏭️ **TRACEROUTE**")
+    assert stats.snapshot()["path_skipped"] == 1
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты сообщения о ходе диагностики
+"""
+
+import time
+
+from progress_message import ProgressBoard, ThrottledMessage
+
+
+class _FakeSlack:
+    def __init__(self):
+        self.posts = []
+        self.updates = []
+
+    def post(self, text):
+        self.posts.append(text)
+        return "1700000000.000100"
+
+    def update(self, ts, text):
+        self.updates.append((ts, text))
+
+
+def test_placeholders_are_replaced_in_place():
+    """Плейсхолдеры ⏳ заменяются на ✅/❌ в одном и том же сообщении"""
+    slack = _FakeSlack()
+    board = ProgressBoard(ThrottledMessage(slack.post, slack.update, min_interval=0), "title")
+    board.add_section("*Globalping:*", ["ping", "http"])
+    board.start()
+    assert "⏳ `ping`" in slack.posts[0]
+
+    board.finish_item("*Globalping:*", "ping", "✅ PING 10ms")
+    board.finish_item("*Globalping:*", "http", "❌ HTTP 500")
+    board.close()
+
+    assert len(slack.posts) == 1
+    final = slack.updates[-1][1]
+    assert "✅ PING 10ms" in final
+    assert "❌ ❌ HTTP 500" not in final and "❌ HTTP 500" in final
+    assert "⏳" not in final
+
+
+def test_updates_are_throttled_and_coalesced():
+    """Частые изменения объединяются, последнее состояние отправляется всегда"""
+    slack = _FakeSlack()
+    message = ThrottledMessage(slack.post, slack.update, min_interval=0.2)
+    message.start("0")
+    for index in range(1, 6):
+        message.set_text(str(index))
+
+    assert slack.updates == []
+    time.sleep(0.35)
+    assert slack.updates == [("1700000000.000100", "5")]
+    assert message.updates_coalesced == 4
+
+
+def test_close_flushes_pending_update():
+    """Финальное состояние отправляется при закрытии, не дожидаясь таймера"""
+    slack = _FakeSlack()
+    message = ThrottledMessage(slack.post, slack.update, min_interval=10)
+    message.start("start")
+    message.set_text("done")
+    message.flush()
+    assert slack.updates[-1][1] == "done"
+
+
+def test_skipped_items_are_not_marked_successful():
+    """Пропущенный тест показывается как ⏭️, а не ✅ - по флагу или по значку в тексте"""
+    slack = _FakeSlack()
+    board = ProgressBoard(ThrottledMessage(slack.post, slack.update, min_interval=0), "title")
+    board.add_section("*Globalping:*", ["traceroute", "mtr"])
+    board.start()
+    board.finish_item("*Globalping:*", "traceroute", "**TRACEROUTE**: пропущен", skipped=True)
+    board.finish_item("*Globalping:*", "mtr", "⏭️ **MTR**: пропущен")
+    board.close()
+
+    final = slack.updates[-1][1]
+    assert "⏭️ **TRACEROUTE**: пропущен" in final
+    assert "⏭️ **MTR**: пропущен" in final and "⏭️ ⏭️" not in final
+    assert "✅" not in final
+
+
+def test_slack_update_runs_outside_the_state_lock():
+    """Пока chat.update выполняется, новые изменения принимаются без ожидания и отправляются следом"""
+    slack = _FakeSlack()
+    message = ThrottledMessage(slack.post, None, min_interval=0)
+
+    def update(ts, text):
+        assert message._lock.acquire(blocking=False)
+        message._lock.release()
+        if text == "first":
+            message.set_text("second")
+        slack.update(ts, text)
+
+    message._update = update
+    message.start("start")
+    message.set_text("first")
+    assert [text for _, text in slack.updates] == ["first", "second"]
+    assert message.updates_sent == 2
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты сжатия результатов для AI промпта
+"""
+
+from prompt_builder import ANALYST_INSTRUCTIONS, build_analysis_prompt, build_comparison_prompt, build_compact_results, compact_results, render_compact
+
+GLOBALPING_PING = """✅ 🌍 **PING** для `example.com`:
+📍 Moscow, RU: 12.5ms (потерь: 0%)
+📍 London, GB: 40.1ms (потерь: 25%)"""
+
+GLOBALPING_HTTP = """✅ 🌍 **HTTP** для `example.com`:
+📍 Moscow, RU: HTTP 200 (120ms)"""
+
+GLOBALPING_MTR = """✅ 🌍 **MTR** для `example.com`:
+📍 Moscow, RU MTR:
+   1. 192.168.1.1 - 0.5ms
+   2. isp.example.net - 1.5ms (50% loss)
+   3. core.example.net - 45.2ms
+   4. example.com - 46.0ms"""
+
+LOCAL_PING = """💻 `ping -4 -c 10 -s 1000 -i 0.2 example.com`:
+```PING example.com (93.184.216.34) 1000(1028) bytes of data.
+1008 bytes from 93.184.216.34: icmp_seq=1 ttl=56 time=11.2 ms
+--- example.com ping statistics ---
+10 packets transmitted, 9 received, 10% packet loss, time 1805ms
+rtt min/avg/max/mdev = 11.0/11.4/12.9/0.5 ms
+```"""
+
+LOCAL_CURL = """💻 `curl -I -v -m 10 example.com`:
+```*   Trying 93.184.216.34:80...
+* Connected to example.com (93.184.216.34) port 80 (#0)
+> HEAD / HTTP/1.1
+< HTTP/1.1 301 Moved Permanently
+HTTP/1.1 301 Moved Permanently
+```"""
+
+LOCAL_ERROR = """💻 `dig example.com +short`:
+```❌ Команда не найдена: dig (возможно, не установлена в системе)```"""
+
+ALL_RESULTS = "\n".join([GLOBALPING_PING, GLOBALPING_HTTP, GLOBALPING_MTR, LOCAL_PING, LOCAL_CURL, LOCAL_ERROR])
+
+
+def test_globalping_results_are_structured():
+    """Результаты Globalping превращаются в числа по пробам"""
+    summary = compact_results(ALL_RESULTS)
+    ping = summary["globalping"]["ping"]
+    assert ping[1] == {"location": "London, GB", "avg": 40.1, "loss": 25.0}
+    assert summary["globalping"]["http"][0]["status"] == "200"
+
+    mtr = summary["globalping"]["mtr"][0]
+    assert mtr["hops"] == 4
+    assert mtr["final"]["host"] == "example.com"
+    # Остаются только хопы с потерями или скачком задержки
+    assert [hop["n"] for hop in mtr["notable"]] == [2, 3]
+
+
+def test_local_results_are_structured():
+    """Из вывода локальных команд остаются только итоговые значения"""
+    local = compact_results(ALL_RESULTS)["local"]
+    assert local[0]["loss"] == 10.0 and local[0]["avg"] == 11.4
+    assert local[1]["statuses"] == ["HTTP/1.1 301"]
+    assert local[1]["connected"] == "93.184.216.34:80"
+    assert local[2]["error"].startswith("❌ Команда не найдена")
+
+
+def test_compact_form_is_smaller_than_raw():
+    """Сжатая сводка занимает меньше токенов, чем сырой вывод"""
+    text, stats = build_compact_results(ALL_RESULTS, token_budget=1500)
+    assert stats["compact_tokens"] < stats["raw_tokens"]
+    assert "icmp_seq" not in text
+    assert "HTTP 200" in text
+
+
+def test_token_budget_is_respected():
+    """При малом бюджете сначала убираются детали хопов, затем сводка обрезается"""
+    summary = compact_results(ALL_RESULTS)
+    assert "заметные" in render_compact(summary, detail=2)
+    assert "заметные" not in render_compact(summary, detail=1)
+
+    text, stats = build_compact_results(ALL_RESULTS, token_budget=40)
+    assert stats["compact_tokens"] <= 60
+    assert "обрезана" in text
+
+
+def test_comparison_prompt_has_section_per_target():
+    """Общий промпт нескольких целей содержит раздел каждой цели и просит сравнить их"""
+    prompt = build_comparison_prompt([("example.com", "[globalping ping]\n- ok"), ("1.1.1.1", "[local ping]\n- loss 100%")])
+    assert "'example.com', '1.1.1.1'" in prompt
+    assert prompt.index("### example.com") < prompt.index("### 1.1.1.1")
+    assert "Общие проблемы" in prompt
+    # Инструкции общие с промптом одной цели
+    assert prompt.startswith(ANALYST_INSTRUCTIONS) and build_analysis_prompt("example.com", "- ok").startswith(ANALYST_INSTRUCTIONS)
+
+
+def test_analysis_prompt_includes_changes_from_history():
+    """Изменения относительно истории попадают в промпт; без истории раздела нет"""
+    assert "исправного состояния" not in build_analysis_prompt("example.com", "- ok")
+    assert "Изменений относительно последнего исправного состояния нет" in build_analysis_prompt("example.com", "- ok", [])
+    prompt = build_analysis_prompt("example.com", "- ok", ["[globalping http RU] status: 200 → 502"])
+    assert "- [globalping http RU] status: 200 → 502" in prompt
+
+
+def test_skipped_tests_are_not_errors():
+    """Пропущенная адаптивным режимом трассировка не считается ни ошибкой, ни строкой пробы"""
+    skipped = "⏭️ **TRACEROUTE**: пропущен - первый проход не нашел проблем"
+    summary = compact_results("\n".join([GLOBALPING_HTTP, skipped]))
+    assert summary["errors"] == []
+    assert summary["globalping"]["http"] == compact_results(GLOBALPING_HTTP)["globalping"]["http"]
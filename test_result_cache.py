@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты TTL кеша результатов с объединением одновременных запросов
+"""
+
+import asyncio
+import threading
+import time
+
+from result_cache import TTLCache, normalize_target, format_cache_age, strip_cache_marks
+
+
+def test_normalize_target():
+    """Схема, путь и регистр не влияют на ключ кеша"""
+    assert normalize_target("https://Example.COM/path") == "example.com"
+    assert normalize_target("example.com.") == "example.com"
+
+
+def test_hit_reports_age():
+    """Повторный запрос берется из кеша и сообщает возраст значения"""
+    cache = TTLCache(ttl=60, max_entries=10)
+    assert cache.get_or_compute("k", lambda: "v") == ("v", None)
+    value, age = cache.get_or_compute("k", lambda: "other")
+    assert value == "v"
+    assert age is not None and age >= 0
+
+
+def test_ttl_expiry_and_lru_eviction():
+    """Значения устаревают по TTL, а при переполнении вытесняются самые старые"""
+    cache = TTLCache(ttl=0.05, max_entries=2)
+    cache.get_or_compute("a", lambda: 1)
+    time.sleep(0.1)
+    assert cache.get_or_compute("a", lambda: 2) == (2, None)
+
+    cache.get_or_compute("b", lambda: 3)
+    cache.get_or_compute("c", lambda: 4)
+    assert cache.stats()["evictions"] == 1
+    assert cache.get_or_compute("a", lambda: 5) == (5, None)
+
+
+def test_errors_are_not_cached():
+    """Результаты, отклоненные should_cache, считаются заново"""
+    cache = TTLCache(ttl=60, max_entries=10)
+    cache.get_or_compute("k", lambda: "❌", should_cache=lambda v: v != "❌")
+    assert cache.get_or_compute("k", lambda: "ok") == ("ok", None)
+
+
+def test_single_flight():
+    """Одновременные запросы одного ключа выполняют расчет только один раз"""
+    cache = TTLCache(ttl=60, max_entries=10)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return "v"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", slow)[0])) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ["v"] * 5
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_async_single_flight_shares_entries():
+    """Асинхронные запросы одного ключа объединяются и используют те же записи кеша"""
+    cache = TTLCache(ttl=60, max_entries=10)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_compute_async("k", compute) for _ in range(5)))
+
+    assert [value for value, _ in asyncio.run(scenario())] == ["result"] * 5
+    assert len(calls) == 1
+    assert cache.get_or_compute("k", lambda: "other")[0] == "result"
+    stats = cache.stats()
+    assert stats["coalesced"] == 4 and stats["hits"] == 1 and stats["inflight"] == 0
+
+
+def test_cache_marks_are_stripped():
+    """Пометка возраста не меняет текст, по которому строится ключ анализа"""
+    assert strip_cache_marks("result" + format_cache_age(12.5)) == "result"
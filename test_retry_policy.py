@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты политики повторов и дедлайна отчета
+"""
+
+import asyncio
+import random
+
+import pytest
+
+from parallel_tasks import run_ordered
+from retry_policy import FATAL, RETRYABLE, Deadline, RetryPolicy, RetryStats, classify_error, current_deadline, deadline_scope
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _policy(clock, stats, **kwargs):
+    return RetryPolicy(sleep=clock.sleep, stats=stats, rng=random.Random(1), **kwargs)
+
+
+def test_backoff_is_exponential_jittered_and_capped():
+    """Задержка растет экспоненциально, не превышает потолок и не меньше (1 - jitter) от номинала"""
+    policy = RetryPolicy(base_delay=1, max_delay=5, multiplier=2, jitter=0.5, rng=random.Random(7))
+    for attempt, nominal in ((1, 1), (2, 2), (3, 4), (4, 5), (8, 5)):
+        delay = policy.backoff(attempt)
+        assert nominal * 0.5 <= delay <= nominal
+    assert len({round(policy.backoff(2), 6) for _ in range(10)}) > 1
+
+
+def test_classification_of_fatal_errors():
+    """Отсутствующая команда, NXDOMAIN и отказ API не повторяются"""
+    assert classify_error("sh: 1: mtr: command not found") == FATAL
+    assert classify_error(";; ->>HEADER<<- opcode: QUERY, status: NXDOMAIN") == FATAL
+    assert classify_error(FileNotFoundError("dig")) == FATAL
+    assert classify_error("HTTP 400") == FATAL
+    assert classify_error("timeout") == RETRYABLE
+    assert classify_error("HTTP 503") == RETRYABLE
+    assert classify_error(ConnectionError("reset by peer")) == RETRYABLE
+
+
+def test_retries_until_success_and_counts_attempts():
+    """Повторяемая ошибка повторяется с ростом таймаута; счетчики учитывают попытки и время"""
+    clock, stats = _Clock(), RetryStats()
+    scales = []
+
+    def operation(attempt, timeout_scale):
+        scales.append(timeout_scale)
+        return ("ok", None) if attempt == 3 else ("fail", "timeout")
+
+    assert _policy(clock, stats, timeout_factor=1.5).run("ping", operation) == "ok"
+    assert scales == [1.0, 1.5, 2.25]
+    snapshot = stats.snapshot()["ping"]
+    assert snapshot["attempts"] == 3 and snapshot["retries"] == 2 and snapshot["ok"] == 1
+
+
+def test_fatal_error_is_not_retried():
+    """Фатальная ошибка возвращается сразу"""
+    clock, stats = _Clock(), RetryStats()
+    calls = []
+
+    def operation(attempt, timeout_scale):
+        calls.append(attempt)
+        return "❌ dig: command not found", "sh: dig: command not found"
+
+    assert _policy(clock, stats).run("dig", operation).startswith("❌")
+    assert calls == [1]
+    assert stats.snapshot()["dig"]["fatal"] == 1
+    assert clock.now == 100.0
+
+
+def test_deadline_stops_retries():
+    """Повтор не начинается, если задержка с минимальной попыткой не укладывается в дедлайн"""
+    clock, stats = _Clock(), RetryStats()
+    deadline = Deadline(3, clock)
+
+    def operation(attempt, timeout_scale):
+        clock.now += 1
+        return "⏱️", "timeout"
+
+    _policy(clock, stats, max_attempts=10, base_delay=1, jitter=0).run("mtr", operation, deadline=deadline)
+    snapshot = stats.snapshot()["mtr"]
+    assert snapshot["deadline"] == 1
+    assert snapshot["attempts"] == 2
+    assert clock.now <= deadline.at
+
+
+def test_exception_of_last_attempt_is_raised():
+    """Исключения повторяются как ошибки, исключение последней попытки пробрасывается"""
+    clock, stats = _Clock(), RetryStats()
+
+    def operation(attempt, timeout_scale):
+        raise ConnectionError(f"attempt {attempt}")
+
+    with pytest.raises(ConnectionError, match="attempt 2"):
+        _policy(clock, stats, max_attempts=2).run("http", operation)
+    assert stats.snapshot()["http"]["exhausted"] == 1
+
+
+def test_deadline_scope_is_inherited_and_never_extended():
+    """Дедлайн отчета виден в задачах run_ordered, вложенная область может его только сократить"""
+    assert current_deadline().remaining() == float("inf")
+    with deadline_scope(60) as report:
+        with deadline_scope(600) as stage:
+            assert stage is report
+        with deadline_scope(5) as stage:
+            assert stage.remaining() <= 5
+        seen = run_ordered([("task", lambda: current_deadline())], max_workers=1)
+        assert seen == [report]
+    assert current_deadline().at is None
+
+
+def test_async_run_retries_like_sync():
+    """Асинхронный вариант повторяет по тем же правилам и пишет те же счетчики"""
+    stats = RetryStats()
+    calls = []
+
+    async def operation(attempt, timeout_scale):
+        calls.append(timeout_scale)
+        return ("ok", None) if attempt == 2 else ("fail", "timeout")
+
+    policy = RetryPolicy(base_delay=0.01, max_delay=0.01, min_attempt_time=0, stats=stats)
+    assert asyncio.run(policy.run_async("ping", operation)) == "ok"
+    assert calls == [1.0, 1.5]
+    assert stats.snapshot()["ping"]["retries"] == 1
+
+    async def fatal(attempt, timeout_scale):
+        return "nx", "NXDOMAIN"
+
+    assert asyncio.run(policy.run_async("dig", fatal)) == "nx"
+    assert stats.snapshot()["dig"]["fatal"] == 1
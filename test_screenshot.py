@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты параллельного опроса сервисов скриншотов
+"""
+
+import threading
+import time
+
+from screenshot import ScreenshotRacer, is_image_response
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 2000
+
+
+class FakeResponse:
+    """Ответ с потоковым телом: считает, сколько байт было прочитано"""
+
+    def __init__(self, body=PNG, status_code=200, content_type="image/png"):
+        self.body = body
+        self.status_code = status_code
+        self.headers = {"Content-Type": content_type, "Content-Length": str(len(body))}
+        self.read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            self.read += chunk_size
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+def _providers(*names):
+    return [(name, lambda url, cache_bust, name=name: f"https://{name}/?{url}") for name in names]
+
+
+def test_image_validated_by_first_bytes():
+    """Для проверки читаются только первые байты, HTML-заглушка отклоняется"""
+    response = FakeResponse()
+    assert is_image_response(response)
+    assert response.read == 16
+    assert not is_image_response(FakeResponse(body=b"<html>" + b" " * 2000, content_type=""))
+    assert not is_image_response(FakeResponse(body=b"\x89PNG", content_type="image/png"))
+    assert not is_image_response(FakeResponse(content_type="text/html"))
+
+
+def test_fastest_valid_provider_wins():
+    """Побеждает первый провайдер с годным изображением, а не первый в списке"""
+    def fetch(url, **kwargs):
+        if "slow" in url:
+            time.sleep(0.5)
+            return FakeResponse()
+        if "broken" in url:
+            return FakeResponse(status_code=500)
+        return FakeResponse()
+
+    racer = ScreenshotRacer(providers=_providers("slow", "broken", "fast"), timeout=2, stagger=0, fetch=fetch)
+    started = time.monotonic()
+    assert racer.capture("example.com") == "https://fast/?https://example.com"
+    assert time.monotonic() - started < 0.4
+
+
+def test_all_failed_returns_empty():
+    """Если ни один провайдер не ответил изображением, возвращается пустая строка без ожидания таймаута"""
+    racer = ScreenshotRacer(
+        providers=_providers("a", "b"), timeout=5, stagger=0,
+        fetch=lambda url, **kwargs: FakeResponse(status_code=404)
+    )
+    started = time.monotonic()
+    assert racer.capture_async("example.com").result() == ""
+    assert time.monotonic() - started < 1
+
+
+def test_unreliable_provider_is_demoted():
+    """Провайдер с ошибками опускается в рейтинге и стартует позже"""
+    racer = ScreenshotRacer(providers=_providers("flaky", "stable"), timeout=2, stagger=0)
+    for _ in range(3):
+        racer.stats.record("flaky", False, 1.0)
+        racer.stats.record("stable", True, 1.0)
+    assert racer.stats.ranking(["flaky", "stable"]) == ["stable", "flaky"]
+
+
+def test_staggered_providers_are_cancelled_after_a_winner():
+    """После победы отложенные провайдеры не запрашиваются и сразу освобождают потоки пула"""
+    fetched = []
+
+    def fetch(url, **kwargs):
+        fetched.append(url)
+        time.sleep(0.1)
+        return FakeResponse()
+
+    racer = ScreenshotRacer(providers=_providers("first", "second", "third"), timeout=2, stagger=5, concurrency=1, fetch=fetch)
+    assert racer.capture("example.com") == "https://first/?https://example.com"
+
+    # Все три потока свободны: задачи, которые ждут друг друга, выполняются одновременно
+    barrier = threading.Barrier(3, timeout=1)
+    assert all(future.result(timeout=2) is not None for future in [racer._executor.submit(barrier.wait) for _ in range(3)])
+    assert fetched == ["https://first/?https://example.com"]
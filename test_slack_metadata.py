@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты кеша идентичности бота и учета вызовов Web API
+"""
+
+from slack_metadata import SlackMetadata
+
+
+class _FakeClient:
+    def __init__(self, token):
+        self.token = token
+        self.auth_calls = 0
+
+    def auth_test(self):
+        self.auth_calls += 1
+        return {"user_id": f"U-{self.token}", "team_id": "T1", "url": "https://team.slack.com/"}
+
+
+def test_identity_resolved_once():
+    """auth.test вызывается один раз, пока токен не меняется"""
+    client = _FakeClient("a")
+    metadata = SlackMetadata(client)
+    for _ in range(5):
+        assert metadata.bot_user_id == "U-a"
+    assert client.auth_calls == 1
+
+
+def test_identity_refreshed_on_token_change():
+    """Смена токена приводит к повторному запросу идентичности"""
+    client = _FakeClient("a")
+    metadata = SlackMetadata(client)
+    metadata.resolve()
+    client.token = "b"
+    assert metadata.bot_user_id == "U-b"
+    assert client.auth_calls == 2
+
+
+def test_permalink_is_built_locally():
+    """Ссылка на сообщение строится без обращения к chat.getPermalink"""
+    metadata = SlackMetadata(_FakeClient("a"))
+    assert metadata.permalink("C123", "1700000000.123456") == "https://team.slack.com/archives/C123/p1700000000123456"
+
+
+def test_calls_per_event_are_counted():
+    """Обернутые функции учитываются в счетчике события и в общей статистике"""
+    metadata = SlackMetadata(_FakeClient("a"))
+    metadata.resolve()
+    counter = metadata.new_event()
+    say = counter.wrap(lambda text: text, "chat.postMessage")
+    say("one")
+    say("two")
+
+    assert counter.total == 2
+    stats = metadata.stats()
+    assert stats["calls"] == {"auth.test": 1, "chat.postMessage": 2}
+    assert stats["calls_per_event"] == 3.0
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты извлечения и нормализации целей
+"""
+
+import re
+
+from target_extraction import _SCANNER, Target, TargetExtractor, extract_domain, extract_targets, parse_target, unique_hosts
+
+
+def test_targets_are_normalized():
+    """URL раскладывается на схему, хост, порт и путь; завершающая пунктуация отбрасывается"""
+    assert parse_target("см. https://GitHub.com:8443/org/repo?tab=1.") == Target("https", "github.com", 8443, "/org/repo?tab=1")
+    assert parse_target("https://example.com/") == Target("https", "example.com")
+    assert parse_target("api.example.com:8080") == Target(None, "api.example.com", 8080)
+    assert str(parse_target("http://[2001:DB8::1]:80/health")) == "http://[2001:db8::1]:80/health"
+
+
+def test_ipv6_idn_and_invalid_addresses():
+    """IPv6 и IDN распознаются, некорректные IPv4, время и MAC адреса - нет"""
+    text = "пример.рф отвечает, 2001:4860:4860::8888 нет; 999.1.1.1 в 12:30:45 с aa:bb:cc:dd:ee:ff"
+    assert extract_targets({"text": text}) == ["xn--e1afmkfd.xn--p1ai", "2001:4860:4860::8888"]
+    assert extract_domain("https://пример.рф/путь") == "xn--e1afmkfd.xn--p1ai"
+
+
+def test_deduplication_and_ignore_list():
+    """Повторы убираются с сохранением порядка, игнорируемые домены пропускаются вместе с поддоменами"""
+    extractor = TargetExtractor(["slack.com", "backup03.itsoft.ru"])
+    event = {
+        "text": "https://team.slack.com/archives/C1 backup03.itsoft.ru ya.ru",
+        "files": [{"plain_text": "ya.ru 8.8.8.8 ya.ru"}]
+    }
+    assert [str(target) for target in extractor.extract(event)] == ["ya.ru", "8.8.8.8"]
+    assert extractor.extract(event, limit=1) == [Target(None, "ya.ru")]
+
+
+def test_scan_is_capped_in_bytes():
+    """Огромные вставленные логи просматриваются только в пределах лимита байт на событие"""
+    extractor = TargetExtractor(max_scan_bytes=100)
+    event = {
+        "text": "ошибка " * 5 + "first.example.com",
+        "files": [{"plain_text": "x" * 10_000 + " late.example.com"}]
+    }
+    assert extract_targets(event, extractor) == ["first.example.com"]
+    # Обрезка посреди многобайтного символа не ломает разбор
+    assert TargetExtractor(max_scan_bytes=7).extract({"text": "яяяя ya.ru"}) == []
+
+
+def test_unique_hosts_for_multi_target_reports():
+    """Для многоцелевого отчета URL и домен одного хоста проверяются один раз, число целей ограничено"""
+    targets = TargetExtractor().extract({"text": "https://shop.example.com/api shop.example.com cdn.example.net 1.1.1.1 9.9.9.9"})
+    assert unique_hosts(targets) == ["https://shop.example.com/api", "cdn.example.net", "1.1.1.1", "9.9.9.9"]
+    assert unique_hosts(targets, limit=3) == ["https://shop.example.com/api", "cdn.example.net", "1.1.1.1"]
+
+
+def test_scanner_avoids_python_311_syntax():
+    """Шаблон компилируется и на Python 3.10: без притяжательных квантификаторов и атомарных групп"""
+    assert re.search(r"[*+?}]\+|\(\?>", _SCANNER.pattern) is None
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты постоянного кеша AI заключений
+"""
+
+import time
+
+from verdict_cache import VerdictCache, verdict_fingerprint
+
+
+def _summary(avg=12.0, city="Moscow", status="200", loss=0.0):
+    return {
+        "globalping": {
+            "ping": [{"location": f"{city}, RU", "avg": avg, "loss": loss}],
+            "http": [{"location": f"{city}, RU", "status": status, "total": 100.0}],
+        },
+        "local": [{"kind": "dns", "command": "dig x +short", "answers": ["2.2.2.2", "1.1.1.1"]}],
+        "errors": [],
+    }
+
+
+def test_fingerprint_ignores_jitter_and_cities():
+    """Джиттер задержки и город пробы не меняют отпечаток"""
+    base = verdict_fingerprint("example.com", _summary())
+    assert verdict_fingerprint("example.com", _summary(avg=13.1, city="Kazan")) == base
+
+
+def test_fingerprint_changes_on_material_difference():
+    """Смена HTTP статуса, потери или порядка величины задержки меняют отпечаток"""
+    base = verdict_fingerprint("example.com", _summary())
+    assert verdict_fingerprint("example.com", _summary(status="502")) != base
+    assert verdict_fingerprint("example.com", _summary(loss=30.0)) != base
+    assert verdict_fingerprint("example.com", _summary(avg=250.0)) != base
+
+
+def test_fingerprint_includes_changes_without_numbers():
+    """Изменения относительно истории входят в отпечаток, числа в них - нет"""
+    base = verdict_fingerprint("example.com", _summary(), changes=["[globalping ping RU] rtt: 12 → 90ms"])
+    assert verdict_fingerprint("example.com", _summary(), changes=["[globalping ping RU] rtt: 12 → 95.5ms"]) == base
+    assert verdict_fingerprint("example.com", _summary(), changes=[]) != base
+    assert verdict_fingerprint("example.com", _summary()) != base
+
+
+def test_cache_persists_across_restarts(tmp_path):
+    """Заключение сохраняется в SQLite и доступно после перезапуска"""
+    path = str(tmp_path / "verdicts.sqlite3")
+    cache = VerdictCache(path)
+    cache.put("fp", "example.com", "Ресурс работает")
+    cache.close()
+
+    reopened = VerdictCache(path)
+    verdict, age = reopened.get("fp")
+    assert verdict == "Ресурс работает"
+    assert age >= 0
+    assert reopened.get("missing") is None
+    assert reopened.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+
+def test_eviction_by_size_and_age(tmp_path):
+    """Старые и давно не использованные заключения вытесняются"""
+    cache = VerdictCache(str(tmp_path / "verdicts.sqlite3"), max_entries=2, max_age=3600)
+    for index in range(3):
+        cache.put(f"fp{index}", "example.com", f"v{index}")
+        time.sleep(0.01)
+    assert cache.stats()["entries"] == 2
+    assert cache.get("fp0") is None
+
+    cache.max_age = 0
+    assert cache.get("fp2") is None
@@ -0,0 +1,183 @@
+"""
+Постоянный кеш AI заключений по отпечатку нормализованных результатов
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _rtt_bucket(value: Optional[float], factor: float) -> Optional[int]:
+    """Логарифмическая корзина задержки: колебания в пределах джиттера дают одну корзину"""
+    if value is None:
+        return None
+    return int(math.log(max(value, 1.0), factor))
+
+
+def _loss_bucket(value: Optional[float]) -> Optional[int]:
+    if value is None:
+        return None
+    for index, limit in enumerate((0, 5, 20, 50, 99.9)):
+        if value <= limit:
+            return index
+    return 5
+
+
+def _country(location: str) -> str:
+    """Оставляет только страну: город пробы меняется от запуска к запуску"""
+    return location.rsplit(",", 1)[-1].strip()
+
+
+def _normalize_hop(hop: Dict[str, Any], factor: float) -> Dict[str, Any]:
+    if not hop:
+        return {}
+    return {"host": hop.get("host"), "rtt": _rtt_bucket(hop.get("rtt"), factor), "loss": _loss_bucket(hop.get("loss"))}
+
+
+def _normalize_path(item: Dict[str, Any], factor: float) -> Dict[str, Any]:
+    return {
+        "final": _normalize_hop(item.get("final", {}), factor),
+        "notable": sorted({hop.get("host") or "*" for hop in item.get("notable", [])})
+    }
+
+
+def normalize_summary(summary: Dict[str, Any], rtt_factor: float = 2.0) -> Dict[str, Any]:
+    """Оставляет в сводке только существенные для заключения признаки"""
+    globalping: Dict[str, Any] = {}
+    for test_type, probes in summary.get("globalping", {}).items():
+        normalized = []
+        for probe in probes:
+            item: Dict[str, Any] = {"country": _country(probe.get("location", ""))}
+            if "error" in probe:
+                item["error"] = True
+            elif test_type == "ping":
+                item.update({"rtt": _rtt_bucket(probe.get("avg"), rtt_factor), "loss": _loss_bucket(probe.get("loss"))})
+            elif test_type == "http":
+                item.update({"status": probe.get("status"), "rtt": _rtt_bucket(probe.get("total"), rtt_factor)})
+            elif test_type == "dns":
+                item["answer"] = probe.get("answer")
+            else:
+                item.update(_normalize_path(probe, rtt_factor))
+            normalized.append(item)
+        globalping[test_type] = sorted(normalized, key=lambda value: json.dumps(value, sort_keys=True))
+
+    local = []
+    for item in summary.get("local", []):
+        normalized = {"kind": item.get("kind")}
+        if "error" in item:
+            normalized["error"] = re.sub(r"\d+", "#", item["error"])
+        if item.get("kind") == "ping":
+            normalized.update({"rtt": _rtt_bucket(item.get("avg"), rtt_factor), "loss": _loss_bucket(item.get("loss"))})
+        elif item.get("kind") in ("dns", "dns_soa"):
+            normalized["answers"] = sorted(item.get("answers", []))
+        elif item.get("kind") == "curl":
+            normalized.update({"statuses": item.get("statuses", []), "tls": item.get("tls")})
+        elif "hops" in item:
+            normalized.update(_normalize_path(item, rtt_factor))
+        local.append(normalized)
+
+    errors = sorted(re.sub(r"\d+", "#", error) for error in summary.get("errors", []))
+    return {"globalping": globalping, "local": local, "errors": errors}
+
+
+def verdict_fingerprint(
+    target: str,
+    summary: Dict[str, Any],
+    rtt_factor: float = 2.0,
+    changes: Optional[List[str]] = None
+) -> str:
+    """Отпечаток нормализованных результатов: одинаков для несущественно разных запусков.
+
+    changes - изменения относительно истории, которые видит модель; числа в них не учитываются.
+    """
+    fields: Dict[str, Any] = {"target": target.lower(), "results": normalize_summary(summary, rtt_factor)}
+    if changes is not None:
+        fields["changes"] = sorted(re.sub(r"\d+(?:\.\d+)?", "#", change) for change in changes)
+    payload = json.dumps(
+        fields,
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    """Кеш заключений в SQLite с вытеснением по возрасту и размеру"""
+
+    def __init__(self, path: str, max_entries: int = 1000, max_age: float = 6 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS verdicts (
+                fingerprint TEXT PRIMARY KEY,
+                target TEXT NOT NULL,
+                verdict TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_hit REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_verdicts_created ON verdicts(created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_verdicts_last_hit ON verdicts(last_hit)")
+        self._conn.commit()
+
+    def get(self, fingerprint: str) -> Optional[Tuple[str, float]]:
+        """Возвращает (заключение, возраст в секундах) или None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT verdict, created_at FROM verdicts WHERE fingerprint = ? AND created_at >= ?",
+                (fingerprint, now - self.max_age)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE verdicts SET last_hit = ?, hits = hits + 1 WHERE fingerprint = ?",
+                (now, fingerprint)
+            )
+            self._conn.commit()
+            return row[0], now - row[1]
+
+    def put(self, fingerprint: str, target: str, verdict: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO verdicts (fingerprint, target, verdict, created_at, last_hit, hits) VALUES (?, ?, ?, ?, ?, 0)",
+                (fingerprint, target, verdict, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM verdicts WHERE created_at < ?", (now - self.max_age,))
+        self._conn.execute(
+            """DELETE FROM verdicts WHERE fingerprint IN (
+                SELECT fingerprint FROM verdicts ORDER BY last_hit DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+            return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()